@@ -0,0 +1,194 @@
+# account_pool.py - 多账号凭据池
+# 每个账号拥有独立的发推额度和健康状态，调度器按事件类型/链路由，
+# 无匹配时回退到负载最低的健康账号。
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, List
+
+import tweepy
+
+from config import Config
+from twitter_client import TwitterClient
+
+logger = logging.getLogger(__name__)
+
+# 发推额度窗口 (24 小时)
+QUOTA_WINDOW = 24 * 3600
+
+
+def _resolve_secret(value: Any) -> Any:
+    """支持 "$ENV_NAME" 形式引用环境变量，避免把密钥直接写进账号文件"""
+    if isinstance(value, str) and value.startswith('$'):
+        return os.getenv(value[1:])
+    return value
+
+
+def _rate_limit_reset(error: tweepy.TooManyRequests) -> Optional[float]:
+    """
+    429 响应中的重置时间 (Unix 秒)；没有响应头时返回 None
+
+    15 分钟窗口看 x-rate-limit-reset；24 小时发推额度用尽时 x-app/user-limit-24hour-reset 更晚，取最晚的一个。
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    resets = []
+    for name in ('x-rate-limit-reset', 'x-app-limit-24hour-reset', 'x-user-limit-24hour-reset'):
+        if name != 'x-rate-limit-reset' and headers.get(name.replace('-reset', '-remaining')) != '0':
+            continue
+        try:
+            resets.append(int(headers[name]))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return max(resets) if resets else None
+
+
+class TwitterAccount:
+    """单个账号的额度与健康状态"""
+
+    def __init__(self, name: str, client: TwitterClient, daily_limit: int,
+                 event_types: Optional[List[str]] = None, chains: Optional[List[str]] = None):
+        self.name = name
+        self.client = client
+        self.daily_limit = daily_limit
+        self.event_types = set(event_types or [])
+        self.chains = set(chains or [])
+        self.sent_times = deque()
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    def used(self, now: Optional[float] = None) -> int:
+        """窗口内已用额度"""
+        now = now or time.time()
+        with self._lock:
+            while self.sent_times and self.sent_times[0] <= now - QUOTA_WINDOW:
+                self.sent_times.popleft()
+            return len(self.sent_times)
+
+    def remaining(self, now: Optional[float] = None) -> int:
+        return max(self.daily_limit - self.used(now), 0)
+
+    def load(self, now: Optional[float] = None) -> float:
+        return self.used(now) / self.daily_limit if self.daily_limit else 1.0
+
+    def is_healthy(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) >= self.cooldown_until
+
+    def is_available(self, now: Optional[float] = None) -> bool:
+        return self.is_healthy(now) and self.remaining(now) > 0
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        return event.get('type') in self.event_types or event.get('chain') in self.chains
+
+    def record_success(self):
+        with self._lock:
+            self.sent_times.append(time.time())
+            self.consecutive_failures = 0
+
+    def record_failure(self, cooldown: Optional[float] = None):
+        """记录失败；连续失败过多或遇到速率限制时进入冷却"""
+        with self._lock:
+            self.consecutive_failures += 1
+            if cooldown is None and self.consecutive_failures >= Config.ACCOUNT_MAX_FAILURES:
+                cooldown = Config.ACCOUNT_COOLDOWN
+            if cooldown:
+                self.cooldown_until = time.time() + cooldown
+                logger.warning("账号 %s 进入冷却 %.0f 秒", self.name, cooldown)
+
+    def status(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            'name': self.name,
+            'used': self.used(now),
+            'daily_limit': self.daily_limit,
+            'healthy': self.is_healthy(now),
+            'cooldown_remaining': max(self.cooldown_until - now, 0),
+            'consecutive_failures': self.consecutive_failures,
+        }
+
+
+class AccountPool:
+    """账号池与调度器"""
+
+    def __init__(self, accounts: List[TwitterAccount]):
+        if not accounts:
+            raise ValueError("账号池为空")
+        self.accounts = accounts
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> 'AccountPool':
+        """
+        从 JSON 文件加载账号池
+
+        文件格式:
+        [
+          {"name": "asia", "bearer_token": "$ASIA_BEARER_TOKEN", "consumer_key": "...",
+           "consumer_secret": "...", "access_token": "...", "access_token_secret": "...",
+           "event_types": ["alpha_new_token"], "chains": ["BNB Smart Chain Mainnet"],
+           "daily_limit": 100}
+        ]
+        """
+        path = path or Config.TWITTER_ACCOUNTS_FILE
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+
+        accounts = []
+        for i, entry in enumerate(entries):
+            name = entry.get('name') or f"account{i}"
+            credentials = {field: _resolve_secret(entry.get(field)) for field in TwitterClient.CREDENTIAL_FIELDS}
+            client = TwitterClient(credentials=credentials, name=name, retry_on_rate_limit=False)
+            accounts.append(TwitterAccount(
+                name=name,
+                client=client,
+                daily_limit=int(entry.get('daily_limit', Config.ACCOUNT_DAILY_LIMIT)),
+                event_types=entry.get('event_types'),
+                chains=entry.get('chains'),
+            ))
+        logger.info("已加载 %d 个 Twitter 账号: %s", len(accounts), ', '.join(a.name for a in accounts))
+        return cls(accounts)
+
+    def select(self, event: Dict[str, Any], exclude: Optional[set] = None) -> Optional[TwitterAccount]:
+        """优先选择匹配事件类型/链的账号，否则回退到负载最低的可用账号"""
+        now = time.time()
+        exclude = exclude or set()
+        candidates = [a for a in self.accounts if a.name not in exclude and a.is_available(now)]
+        if not candidates:
+            return None
+        matched = [a for a in candidates if a.matches(event)]
+        return min(matched or candidates, key=lambda a: a.load(now))
+
+    def send_tweet(self, content: str, event: Dict[str, Any], **kwargs) -> Optional[Dict[str, Any]]:
+        """选择账号发送；遇到速率限制时冷却该账号并换下一个账号重试"""
+        tried = set()
+        while True:
+            account = self.select(event, exclude=tried)
+            if account is None:
+                logger.error("没有可用的 Twitter 账号 (已尝试: %s)", ', '.join(tried) or '无')
+                return None
+            tried.add(account.name)
+            try:
+                result = account.client.send_tweet(content, **kwargs)
+            except tweepy.TooManyRequests as e:
+                reset_time = _rate_limit_reset(e)
+                cooldown = reset_time - time.time() if reset_time else Config.RATE_LIMIT_BUFFER * 60
+                logger.warning("账号 %s 达到速率限制，冷却 %.0f 秒", account.name, max(cooldown, 1))
+                account.record_failure(cooldown=max(cooldown, 1))
+                continue
+
+            if result and result.get('success'):
+                account.record_success()
+                return {**result, 'account': account.name}
+            account.record_failure()
+            return None
+
+    @property
+    def primary_client(self) -> TwitterClient:
+        return self.accounts[0].client
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [a.status() for a in self.accounts]
@@ -4,6 +4,7 @@ autotwitter.py - Alpha 事件专用消费者
 功能:
 - 从 Redis 队列消费结构化 Alpha 事件(JSON)
 - 事件包含: 链/代币名与符号/数量/合约/浏览器 等字段
+- 发送前规范化: 链名与地址统一写法，浏览器链接按 chains.json 生成 (见 enrich.py)
 - 使用模板格式化推文并通过 twitter_client 发送
 
 事件JSON字段规范 (与 alpha.json 对齐):
@@ -15,14 +16,13 @@ autotwitter.py - Alpha 事件专用消费者
   "symbol": str,
   "amount": int | float | str,
   "contract": str,
-  "explorer": str,
+  "explorer": str,          # 可选，已登记的链按 chains.json 生成
   "threshold": int | float,
   "detected_at": str
 }
 """
 
 import os
-import json
 import time
 import signal
 import logging
@@ -31,14 +31,23 @@ from typing import Dict, Any
 import redis
 
 from config import Config
-from twitter_client import TwitterClient
+from sinks import SinkRouter, delivery_status
+from shards import connect, make_reader
+from log_setup import setup_logging, message_logger
+from staleness import StalenessPolicy
+from pipeline import StagedPipeline, Work
+from tweet_length import render_template
+from media import MediaUploader
+from pacer import PostingPacer, DeferredQueue
+from replies import ReplyPublisher
+from codec import MessageCodec
+from enrich import EventNormalizer
+from profiler import MessageProfiler
+from schema import REQUIRED_FIELDS
 
 
-logging.basicConfig(
-    level=getattr(logging, Config.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
+msg_logger = message_logger(__name__)
 
 
 TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'alpha_template.txt')
@@ -74,81 +83,184 @@ def build_tweet_content(event: Dict[str, Any]) -> str:
         'explorer': event.get('explorer', ''),
         'detected_at': event.get('detected_at', ''),
     }
-    return template.format(**data)
+    if not data['explorer']:
+        # 未登记的链且事件没有自带浏览器链接时去掉这一行，不输出空值
+        template = '\n'.join(line for line in template.split('\n') if '{explorer}' not in line)
+    # 超过推文长度时先去掉可选字段所在的行，而不是直接截断
+    optional_fields = [f.strip() for f in Config.TWEET_OPTIONAL_FIELDS.split(',') if f.strip()]
+    return render_template(template, data, optional_fields)
 
 class AlphaConsumer:
     def __init__(self):
         self.running = True
-        # 初始化 Twitter
-        self.twitter = TwitterClient()
-        self.twitterSending = Config.TWITTER_SENDING  # 启用推文发送
+        # 初始化输出目标；TWITTER_SENDING=false 时默认路由到 null sink (dry-run)
+        self.sinks = SinkRouter.from_config()
         # 初始化 Redis
-        redis_config = {
-            'host': Config.REDIS_HOST,
-            'port': Config.REDIS_PORT,
-            'db': Config.REDIS_DB,
-            'decode_responses': True,
-        }
-        if Config.REDIS_PASSWORD:
-            redis_config['password'] = Config.REDIS_PASSWORD
-        self.rds = redis.Redis(**redis_config)
+        self.rds = connect()
         self.rds.ping()
-        logger.info(f"连接 Redis 成功: {Config.REDIS_HOST}:{Config.REDIS_PORT}")
+        logger.info("连接 Redis 成功: %s:%s", Config.REDIS_HOST, Config.REDIS_PORT)
+        # QUEUE_SHARDS > 0 时读取本实例订阅的分片
+        self.reader = make_reader(self.rds, Config.QUEUE_NAME, block_timeout=30)
+        self.staleness = StalenessPolicy.from_config(self.rds)
+        # 同时识别 JSON 和紧凑编码的消息
+        self.codec = MessageCodec(self.rds)
+        # 图片上传 (MEDIA_ENABLED 且有 Twitter 输出时启用)
+        self.media = MediaUploader.from_sinks(self.sinks, self.rds)
+        # 发推节奏: 按 24 小时额度均摊，额度用完后暂存
+        self.pacer = PostingPacer.from_sinks(self.sinks)
+        self.deferred = DeferredQueue(self.rds)
+        # 向 send_and_wait 的调用方回报结果
+        self.replies = ReplyPublisher(self.rds)
+        # 链注册表启动时载入一次；ENRICH_ENABLED=false 时为 None
+        self.normalizer = EventNormalizer.from_config()
         # 信号
         signal.signal(signal.SIGINT, self._signal)
         signal.signal(signal.SIGTERM, self._signal)
+        # 采样剖析: PROFILE_ENABLED=true 或 kill -USR2 <pid> 开关
+        self.profiler = MessageProfiler('alpha')
+        self.profiler.install_signal()
 
     def _signal(self, signum, frame):
-        logger.info(f"收到信号 {signum}，准备退出...")
+        logger.info("收到信号 %s，准备退出...", signum)
         self.running = False
 
     def validate_event(self, event: Dict[str, Any]) -> bool:
-        required = ['type', 'chain', 'name', 'symbol', 'amount', 'contract', 'explorer']
-        for key in required:
+        for key in REQUIRED_FIELDS:
             if key not in event or event[key] in (None, ''):
-                logger.error(f"事件缺少必要字段: {key}")
+                logger.error("事件缺少必要字段: %s", key)
+                self.replies.publish(event, 'invalid', error=f"缺少字段 {key}")
                 return False
         if str(event.get('type')) != 'alpha_new_token':
-            logger.warning(f"事件类型不是 alpha_new_token: {event.get('type')}")
+            logger.warning("事件类型不是 alpha_new_token: %s", event.get('type'))
         return True
 
+    def _pace(self, event: Dict[str, Any], raw: str) -> bool:
+        """等待发送时刻；当前没有可用额度时暂存消息并返回 False"""
+        if self.pacer.wait(event, lambda: self.running):
+            return True
+        self.deferred.defer(raw)
+        msg_logger.info("⏸️  发推额度不足或未到发送时刻，消息已暂存: %s", event.get('symbol'))
+        self.replies.publish(event, 'deferred')
+        return False
+    
+    def _dispatch(self, content: str, event: Dict[str, Any], media_kwargs: Dict[str, Any]) -> bool:
+        """投递、记录发推节奏并回报结果"""
+        result = self.sinks.dispatch(content, event, **media_kwargs)
+        ok = bool(result and result.get('success'))
+        self.pacer.record(ok, event)
+        self.replies.publish(event, delivery_status(result), result)
+        if not ok and result and result.get('unknown'):
+            # 超时但可能已发出，不计为失败，避免重复投递
+            logger.warning("⚠️  投递超时，结果未知: %s %s", event.get('symbol'), result['unknown'])
+            return True
+        return ok
+
+    def normalize(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """统一链名和地址写法，按链生成浏览器链接"""
+        return self.normalizer.normalize(event) if self.normalizer else event
+
     def process_event(self, event: Dict[str, Any]) -> bool:
         if not self.validate_event(event):
             return False
+        with self.profiler.sample():
+            return self._send_event(event)
+
+    def _send_event(self, event: Dict[str, Any]) -> bool:
+        # 图片先开始上传，与渲染并行
+        media = self.media.prepare(event) if self.media else None
         content = build_tweet_content(event)
-        if self.twitterSending:
-            result = self.twitter.send_tweet(content)
-            return bool(result and result.get('success'))
-        else:
-            # 如果不发送推文，仅记录内容并返回成功
-            logger.info(f"推文内容预览（未发送）: {content}")
+        media_kwargs = self.media.resolve(media) if self.media else {}
+        return self._dispatch(content, event, media_kwargs)
+
+    def pipeline_stages(self) -> Dict[str, Any]:
+        """流水线模式下各阶段的处理函数"""
+        def decode(work: Work) -> bool:
+            work.event = self.codec.decode(work.raw)
+            return True
+
+        def validate(work: Work) -> bool:
+            # 仅处理 Alpha 事件；其他类型交给 v2 消费者
+            if work.event.get('type') != 'alpha_new_token':
+                logger.debug("非 alpha 事件，跳过: %s", work.event.get('type'))
+                return False
+            if self.staleness.drop_if_expired(work.event, work.raw):
+                self.replies.publish(work.event, 'expired')
+                return False
+            return self.validate_event(work.event)
+
+        def enrich(work: Work) -> bool:
+            work.event = self.normalize(work.event)
+            return True
+
+        def render(work: Work) -> bool:
+            # 图片在后台上传，消息排队等待 send 阶段期间即可完成
+            work.media = self.media.prepare(work.event) if self.media else None
+            work.content = build_tweet_content(work.event)
             return True
 
+        def send(work: Work) -> bool:
+            if not self._pace(work.event, work.raw):
+                return False
+            with self.profiler.sample():
+                media_kwargs = self.media.resolve(work.media) if self.media else {}
+                ok = self._dispatch(work.content, work.event, media_kwargs)
+            if ok:
+                msg_logger.info("✅ 推文发送成功: %s %s", work.event.get('symbol'), work.event.get('contract'))
+            else:
+                logger.error("❌ 推文发送失败")
+            return ok
+
+        return {'decode': decode, 'validate': validate, 'enrich': enrich, 'render': render, 'send': send}
+
     def run(self):
         logger.info("Alpha 消费者启动，监听队列: %s", Config.QUEUE_NAME)
+        try:
+            if Config.PIPELINE_ENABLED:
+                StagedPipeline.from_funcs(self.pipeline_stages(), self.reader, name='alpha').run(
+                    lambda: self.running, on_tick=lambda: self.deferred.maybe_restore(self.pacer))
+            else:
+                self._consume_loop()
+        finally:
+            # 预取但尚未处理的消息放回队列
+            self.reader.requeue()
+            logger.info("预取统计: %s", self.reader.stats())
+            self.sinks.close()
+            self.profiler.close()
+            if self.media:
+                logger.info("图片上传统计: %s", self.media.stats)
+                self.media.close()
+        logger.info("Alpha 消费者已停止")
+
+    def _consume_loop(self):
         while self.running:
             try:
-                item = self.rds.brpop(Config.QUEUE_NAME, timeout=30)
-                if item is None:
+                self.deferred.maybe_restore(self.pacer)
+                raw = self.reader.get()
+                if raw is None:
                     continue
-                _, raw = item
                 try:
-                    event = json.loads(raw)
-                except json.JSONDecodeError:
-                    logger.error("队列消息不是合法JSON，已跳过")
+                    event = self.codec.decode(raw)
+                except ValueError:
+                    logger.error("队列消息无法解析，已跳过")
                     continue
                 # 仅处理 Alpha 事件；其他类型交给 v2 消费者
                 if event.get('type') != 'alpha_new_token':
                     logger.debug("非 alpha 事件，跳过: %s", event.get('type'))
                     continue
+                if self.staleness.drop_if_expired(event, raw):
+                    self.replies.publish(event, 'expired')
+                    continue
+                event = self.normalize(event)
+                # 按发推额度等待发送时刻 (替代固定的 2 秒间隔)
+                if not self._pace(event, raw):
+                    continue
                 ok = self.process_event(event)
                 if ok:
-                    logger.info("✅ 推文发送成功")
+                    msg_logger.info("✅ 推文发送成功: %s %s", event.get('symbol'), event.get('contract'))
                 else:
                     logger.error("❌ 推文发送失败")
-                time.sleep(2)
             except redis.exceptions.ConnectionError as e:
-                logger.error(f"Redis 连接中断: {e}")
+                logger.error("Redis 连接中断: %s", e)
                 time.sleep(5)
                 try:
                     self.rds.ping()
@@ -156,11 +268,12 @@ class AlphaConsumer:
                 except Exception:
                     pass
             except Exception as e:
-                logger.error(f"处理循环异常: {e}")
+                logger.error("处理循环异常: %s", e)
                 time.sleep(2)
 
 
 def main():
+    setup_logging()
     consumer = AlphaConsumer()
     consumer.run()
     return 0
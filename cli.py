@@ -0,0 +1,178 @@
+# cli.py - 统一命令行入口
+# python cli.py produce | consume | alpha | status | inspect | load | bench-prefetch ...
+# 子命令只在执行时导入所需模块: produce / status / inspect 不会导入 tweepy、requests，
+# 冷启动只剩 Python 本身和 redis-py 的导入时间。用 python -X importtime cli.py <命令> 查看明细。
+
+import sys
+import argparse
+from typing import List
+
+
+def cmd_produce(args) -> int:
+    """生成并发送事件到队列"""
+    from producer_v2 import TweetProducer
+    producer = TweetProducer()
+    sent = 0
+    try:
+        for _ in range(args.count):
+            event = producer.generate_event(args.type)
+            if not args.wait:
+                sent += bool(producer.send_to_queue(event))
+                continue
+            reply = producer.send_and_wait(event, timeout=args.wait)
+            sent += bool(reply)
+            print(f"{event['type']}: {reply['status'] + ' ' + (reply['tweet_url'] or '') if reply else '等待超时'}")
+    finally:
+        producer.close()
+    print(f"✅ 已发送 {sent}/{args.count} 条事件")
+    return 0 if sent == args.count else 1
+
+
+def cmd_load(args) -> int:
+    from producer_v2 import run_load
+    return run_load(args.argv)
+
+
+def cmd_consume(args) -> int:
+    """运行通用推文消费者 (consumer_v2)"""
+    from consumer_v2 import TweetConsumer
+    TweetConsumer().run()
+    return 0
+
+
+def cmd_alpha(args) -> int:
+    """运行 Alpha 消费者 (autotwitter)"""
+    from autotwitter import AlphaConsumer
+    AlphaConsumer().run()
+    return 0
+
+
+def cmd_inspect(args) -> int:
+    from inspector import run_inspect
+    return run_inspect(args.argv)
+
+
+def cmd_status(args) -> int:
+    """只读 Redis 的状态；--twitter 时才初始化 Twitter 客户端并显示账号和发推额度"""
+    import os
+    from datetime import datetime
+    import redis
+    from config import Config
+    from shards import connect
+
+    redis_client = connect()
+    try:
+        queue_length = redis_client.llen(Config.QUEUE_NAME)
+    except redis.exceptions.ConnectionError as e:
+        print(f"❌ 无法连接到 Redis {Config.REDIS_HOST}:{Config.REDIS_PORT}: {e}")
+        return 1
+
+    print("\n=== 系统状态 ===")
+    print(f"队列长度: {queue_length} 条消息 ({Config.QUEUE_NAME})")
+    print(f"暂存消息: {redis_client.llen(f'{Config.QUEUE_NAME}:deferred')} 条")
+    if Config.QUEUE_PARTITIONS > 0:
+        from partitions import partition_queue
+        pipe = redis_client.pipeline(transaction=False)
+        for i in range(Config.QUEUE_PARTITIONS):
+            pipe.llen(partition_queue(Config.QUEUE_NAME, i))
+        print(f"分区积压: {dict(enumerate(pipe.execute()))}")
+    if Config.QUEUE_SHARDS > 0:
+        from shards import ShardMap
+        print(f"分片积压: {ShardMap.from_config(redis_client).depths()}")
+    if Config.SPOOL_PATH and os.path.exists(Config.SPOOL_PATH):
+        print(f"本地 spool: {os.path.getsize(Config.SPOOL_PATH)} 字节待回放 ({Config.SPOOL_PATH})")
+    if Config.PREFETCH_DUMP_PATH and os.path.exists(Config.PREFETCH_DUMP_PATH):
+        print(f"预取落盘: {os.path.getsize(Config.PREFETCH_DUMP_PATH)} 字节，消费者下次启动时放回队列 "
+              f"({Config.PREFETCH_DUMP_PATH})")
+    print(f"消息编码: {Config.QUEUE_ENCODING}")
+
+    if args.twitter:
+        from twitter_client import TwitterClient
+        from pacer import PostingPacer
+        client = TwitterClient()
+        user_info = client.get_user_info()
+        if user_info:
+            print(f"认证用户: @{user_info['username']} ({user_info['name']})")
+            print(f"粉丝数: {user_info['followers_count']}")
+        quota = PostingPacer([client]).status()
+        print(f"24小时发推额度: 剩余 {quota['remaining']}/{quota['limit']} (预留 {quota['reserved']})，"
+              f"{datetime.fromtimestamp(quota['reset']).strftime('%H:%M:%S')} 重置")
+    print(f"检查时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    return 0
+
+
+def cmd_bench_prefetch(args) -> int:
+    """对比不同预取大小下每条消息的 Redis 操作数与吞吐 (使用独立的测试队列)"""
+    import json
+    import time
+    from config import Config
+    from shards import connect
+    from prefetch import PrefetchingReader
+
+    redis_client = connect()
+    queue_name = f"{Config.QUEUE_NAME}:prefetch_bench"
+    payload = json.dumps({"type": "bench", "message": "x" * 200})
+    try:
+        for prefetch in args.prefetch:
+            redis_client.delete(queue_name)
+            for start in range(0, args.count, 1000):
+                redis_client.lpush(queue_name, *([payload] * min(1000, args.count - start)))
+            reader = PrefetchingReader(redis_client, queue_name, prefetch=prefetch, block_timeout=1)
+            started = time.perf_counter()
+            while reader.get() is not None:
+                pass
+            elapsed = time.perf_counter() - started
+            print(f"prefetch={prefetch:<4} ops/msg={reader.ops_per_message():.3f} "
+                  f"吞吐={reader.delivered / elapsed:,.0f} 条/秒")
+    finally:
+        redis_client.delete(queue_name)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='cli.py', description="推文机器人统一入口")
+    commands = parser.add_subparsers(dest='command', required=True, metavar='命令')
+
+    produce = commands.add_parser('produce', help="生成事件并发送到队列")
+    produce.add_argument('-n', '--count', type=int, default=1, help="发送条数")
+    produce.add_argument('-t', '--type', choices=('alert', 'business', 'scheduled', 'alpha'), default=None,
+                         help="事件类型，默认随机")
+    produce.add_argument('--wait', type=float, default=0, metavar='SECONDS',
+                         help="逐条等待消费者回报处理结果 (推文链接)，0 表示不等待")
+    produce.set_defaults(func=cmd_produce)
+
+    commands.add_parser('consume', help="运行通用推文消费者").set_defaults(func=cmd_consume)
+    commands.add_parser('alpha', help="运行 Alpha 消费者").set_defaults(func=cmd_alpha)
+
+    status = commands.add_parser('status', help="查看队列状态")
+    status.add_argument('--twitter', action='store_true', help="同时验证 Twitter 账号并显示发推额度")
+    status.set_defaults(func=cmd_status)
+
+    bench = commands.add_parser('bench-prefetch', help="对比不同预取大小的 Redis 操作数和吞吐")
+    bench.add_argument('-n', '--count', type=int, default=10000, help="每轮消息数")
+    bench.add_argument('--prefetch', type=int, nargs='+', default=[1, 10, 100], help="要对比的预取大小")
+    bench.set_defaults(func=cmd_bench_prefetch)
+
+    # 这两个命令的参数原样交给对应模块解析，见 PASSTHROUGH
+    commands.add_parser('inspect', help="分析队列积压 (参数见 inspect --help)")
+    commands.add_parser('load', help="开环压测负载 (参数见 load --help)")
+    return parser
+
+
+# 自带参数解析的子命令
+PASSTHROUGH = {'inspect': cmd_inspect, 'load': cmd_load}
+
+
+def main(argv: List[str] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in PASSTHROUGH:
+        args = argparse.Namespace(command=argv[0], argv=argv[1:])
+    else:
+        args = build_parser().parse_args(argv)
+    from log_setup import setup_logging
+    setup_logging()
+    return PASSTHROUGH.get(args.command, getattr(args, 'func', None))(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,378 @@
+# codec.py - 队列消息的紧凑存储编码
+# QUEUE_ENCODING=compact 时，生产者把事件写成带版本号的紧凑格式: 短字段名、消息正文引用模板、
+# 再用 zstd (未安装时回退 zlib) 加预置字典压缩。消费者同时识别旧的 JSON 和紧凑格式，
+# 因此升级顺序是先升级消费者，再打开生产者的 compact。
+#
+# 格式: "~" 版本 压缩方式 字典ID ":" 数据
+#   版本 1；压缩方式 n=不压缩 (数据为短字段 JSON) / z=zlib / s=zstd (数据为 base85)；
+#   字典ID 为 "-" 表示未使用字典。以 "{" 开头的消息按普通 JSON 解析。
+# Redis 连接使用 decode_responses=True，压缩后的二进制需要 base85 转为文本存储。
+
+import re
+import sys
+import json
+import time
+import zlib
+import base64
+import hashlib
+import logging
+import argparse
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+import redis
+
+from config import Config
+from log_setup import setup_logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+VERSION = '1'
+MAGIC = '~'
+DICT_KEY = 'codec:dict:{}'
+CURRENT_DICT_KEY = 'codec:dict:current'
+
+# 长字段名 → 短字段名；未列出的字段原样保留 (与短字段名冲突时加 "!" 前缀)
+SHORT_KEYS = {
+    'type': 't', 'message': 'm', 'queue_timestamp': 'qt', 'queue_id': 'qi', 'timestamp': 'ts',
+    'severity': 'sv', 'service': 's', 'alert_type': 'at', 'metadata': 'md', 'category': 'c',
+    'priority': 'p', 'tags': 'tg', 'chain': 'ch', 'address': 'a', 'name': 'n', 'symbol': 'sy',
+    'amount': 'am', 'contract': 'ct', 'explorer': 'ex', 'threshold': 'th', 'detected_at': 'da',
+    'server_id': 'si', 'region': 'r', 'environment': 'e', 'department': 'd', 'author': 'au',
+    'content_type': 'cty', 'scheduled': 'sc',
+}
+LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+
+# 消息正文模板: 编号 → 模板。占位符与事件字段同名时，与字段值相同的参数不重复存储。
+# 模板只需覆盖常见的格式，编码时会校验能否还原出原文，匹配不上的正文按原样存储。
+# 编号一经使用不能修改或复用，只能追加。
+MESSAGE_TEMPLATES = {
+    1: "🚨 警报！{service} 检测到 {alert_type}，时间: {time}",
+    2: "📈 业务更新: {update} - {time}",
+    3: "{tip} #{date}",
+}
+_PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+
+class CodecError(ValueError):
+    """无法解码的消息 (未知版本、缺少字典或压缩库)"""
+
+
+def _template_regex(template: str) -> 're.Pattern':
+    parts = _PLACEHOLDER.split(template)
+    # split 结果中奇数位是占位符名
+    return re.compile(''.join('(.+?)' if i % 2 else re.escape(part) for i, part in enumerate(parts)) + r'\Z',
+                      re.DOTALL)
+
+
+_TEMPLATES = {tid: (template, _PLACEHOLDER.findall(template), _template_regex(template))
+              for tid, template in MESSAGE_TEMPLATES.items()}
+
+
+def _render(tid: int, args: List[Any], event: Dict[str, Any]) -> str:
+    template, names, _ = _TEMPLATES[tid]
+    values = {name: str(event[name]) if arg is None else arg for name, arg in zip(names, args)}
+    return template.format(**values)
+
+
+def _compress_message(event: Dict[str, Any]) -> Optional[List[Any]]:
+    """正文匹配某个模板时返回 [模板编号, 参数...]"""
+    message = event.get('message')
+    if not isinstance(message, str):
+        return None
+    for tid, (_, names, pattern) in _TEMPLATES.items():
+        match = pattern.match(message)
+        if not match:
+            continue
+        args = [None if name in event and str(event[name]) == value else value
+                for name, value in zip(names, match.groups())]
+        if _render(tid, args, event) == message:
+            return [tid] + args
+    return None
+
+
+def _shorten(data: Dict[str, Any]) -> Dict[str, Any]:
+    result = {}
+    for key, value in data.items():
+        short = SHORT_KEYS.get(key)
+        if short is None:
+            short = '!' + key if key in LONG_KEYS or key.startswith('!') else key
+        result[short] = _shorten(value) if isinstance(value, dict) else value
+    return result
+
+
+def _expand(data: Dict[str, Any]) -> Dict[str, Any]:
+    result = {}
+    for key, value in data.items():
+        if key.startswith('!'):
+            long = key[1:]
+        else:
+            long = LONG_KEYS.get(key, key)
+        result[long] = _expand(value) if isinstance(value, dict) else value
+    return result
+
+
+def pack(event: Dict[str, Any]) -> Dict[str, Any]:
+    """事件 → 短字段形式 (压缩前)"""
+    packed = dict(event)
+    template = _compress_message(event)
+    if template is not None:
+        packed['message'] = template
+    # queue_id 可由 queue_timestamp 推出时只存一个 null
+    if 'queue_id' in packed and 'queue_timestamp' in packed and \
+            packed['queue_id'] == f"msg_{int(packed['queue_timestamp'] * 1000)}":
+        packed['queue_id'] = None
+    return _shorten(packed)
+
+
+def unpack(packed: Dict[str, Any]) -> Dict[str, Any]:
+    event = _expand(packed)
+    if 'queue_id' in event and event['queue_id'] is None and 'queue_timestamp' in event:
+        event['queue_id'] = f"msg_{int(event['queue_timestamp'] * 1000)}"
+    message = event.get('message')
+    if isinstance(message, list):
+        tid = message[0]
+        if tid not in _TEMPLATES:
+            raise CodecError(f"未知的消息模板: {tid}")
+        event['message'] = _render(tid, message[1:], event)
+    return event
+
+
+def _packed_bytes(event: Dict[str, Any]) -> bytes:
+    return json.dumps(pack(event), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class MessageCodec:
+    """
+    队列消息编解码
+
+    encode() 按 QUEUE_ENCODING 输出普通 JSON 或紧凑格式；decode() 两种格式都能解析。
+    字典按 ID 存在 Redis 中 (codec:dict:<id>)，内容不可变，取到后在进程内缓存。
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None, encoding: Optional[str] = None,
+                 compression: Optional[str] = None):
+        self.redis_client = redis_client
+        self.encoding = encoding or Config.QUEUE_ENCODING
+        compression = compression or Config.CODEC_COMPRESSION
+        if compression == 'auto':
+            compression = 'zstd' if zstandard else 'zlib'
+        if compression == 'zstd' and zstandard is None:
+            logger.warning("未安装 zstandard，改用 zlib 压缩 (pip install zstandard)")
+            compression = 'zlib'
+        self.compression = compression
+        self._dicts: Dict[str, bytes] = {}
+        self._zstd_dicts: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._dict_id: Optional[str] = None
+        self._dict_checked = 0.0
+
+    # ---- 字典 ----
+
+    def _load_dict(self, dict_id: str) -> bytes:
+        data = self._dicts.get(dict_id)
+        if data is None:
+            stored = self.redis_client.get(DICT_KEY.format(dict_id)) if self.redis_client else None
+            if stored is None:
+                raise CodecError(f"找不到压缩字典: {dict_id}")
+            data = base64.b64decode(stored)
+            with self._lock:
+                self._dicts[dict_id] = data
+        return data
+
+    def _current_dict(self) -> Optional[str]:
+        """当前用于编码的字典 ID，每分钟重新读取一次以便切换到新训练的字典"""
+        if self.redis_client is None:
+            return None
+        now = time.monotonic()
+        if now - self._dict_checked >= 60:
+            self._dict_checked = now
+            try:
+                dict_id = self.redis_client.get(CURRENT_DICT_KEY)
+                if dict_id:
+                    self._load_dict(dict_id)
+                self._dict_id = dict_id or None
+            except (redis.exceptions.RedisError, CodecError) as e:
+                # Redis 不可用 (生产者正在写 spool) 时沿用已有字典
+                logger.debug("读取压缩字典失败: %s", e)
+        return self._dict_id
+
+    def _zstd_dict(self, dict_id: str):
+        zdict = self._zstd_dicts.get(dict_id)
+        if zdict is None:
+            zdict = self._zstd_dicts[dict_id] = zstandard.ZstdCompressionDict(self._load_dict(dict_id))
+        return zdict
+
+    # ---- 编解码 ----
+
+    def _compress(self, data: bytes, method: str, dict_id: Optional[str]) -> bytes:
+        if method == 's':
+            zdict = self._zstd_dict(dict_id) if dict_id else None
+            return zstandard.ZstdCompressor(level=9, dict_data=zdict, write_content_size=True).compress(data)
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=self._load_dict(dict_id)) if dict_id \
+            else zlib.compressobj(9, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush()
+
+    def _decompress(self, data: bytes, method: str, dict_id: Optional[str]) -> bytes:
+        if method == 's':
+            if zstandard is None:
+                raise CodecError("消息使用 zstd 压缩，需要安装 zstandard")
+            zdict = self._zstd_dict(dict_id) if dict_id else None
+            return zstandard.ZstdDecompressor(dict_data=zdict).decompress(data)
+        if method == 'z':
+            decompressor = zlib.decompressobj(-15, zdict=self._load_dict(dict_id)) if dict_id \
+                else zlib.decompressobj(-15)
+            return decompressor.decompress(data) + decompressor.flush()
+        raise CodecError(f"未知的压缩方式: {method}")
+
+    def encode_compact(self, event: Dict[str, Any]) -> str:
+        data = _packed_bytes(event)
+        if self.compression == 'none':
+            return f"{MAGIC}{VERSION}n-:" + data.decode('utf-8')
+        method = 's' if self.compression == 'zstd' else 'z'
+        dict_id = self._current_dict()
+        body = base64.b85encode(self._compress(data, method, dict_id)).decode('ascii')
+        if len(body) >= len(data):
+            # 没有字典时短消息压缩后加上 base85 往往更长，直接存短字段 JSON
+            return f"{MAGIC}{VERSION}n-:" + data.decode('utf-8')
+        return f"{MAGIC}{VERSION}{method}{dict_id or '-'}:{body}"
+
+    def encode(self, event: Dict[str, Any]) -> str:
+        """按 QUEUE_ENCODING 序列化一条队列消息"""
+        if self.encoding == 'compact':
+            return self.encode_compact(event)
+        return json.dumps(event, ensure_ascii=False)
+
+    def decode(self, raw: str) -> Dict[str, Any]:
+        """解析队列消息，支持普通 JSON 和紧凑格式"""
+        if not raw.startswith(MAGIC):
+            return json.loads(raw)
+        header, sep, body = raw.partition(':')
+        if not sep or len(header) < 4:
+            raise CodecError("紧凑消息头无效")
+        version, method, dict_id = header[1], header[2], header[3:]
+        if version != VERSION:
+            raise CodecError(f"不支持的消息编码版本: {version}")
+        dict_id = None if dict_id == '-' else dict_id
+        if method == 'n':
+            data = body.encode('utf-8')
+        else:
+            data = self._decompress(base64.b85decode(body), method, dict_id)
+        return unpack(json.loads(data))
+
+    # ---- 字典训练 ----
+
+    def train(self, events: List[Dict[str, Any]], size: Optional[int] = None) -> str:
+        """
+        用样本事件训练字典，写入 Redis 并设为当前字典
+
+        安装了 zstandard 时训练 zstd 字典，否则取样本内容拼成 zlib 预置字典
+        (zlib 只能利用最后 32KB)。
+        """
+        size = size or Config.CODEC_DICT_SIZE
+        samples = [_packed_bytes(event) for event in events]
+        if not samples:
+            raise ValueError("没有可用于训练的样本")
+        data = None
+        if zstandard is not None and len(samples) >= 100:
+            try:
+                data = zstandard.train_dictionary(size, samples).as_bytes()
+            except zstandard.ZstdError as e:
+                logger.warning("zstd 字典训练失败，改用样本拼接: %s", e)
+        if data is None:
+            # 去重后越常见的样本越靠后 (离被压缩数据越近)
+            seen = {}
+            for sample in samples:
+                seen[sample] = seen.get(sample, 0) + 1
+            data = b''.join(sorted(seen, key=seen.get))[-min(size, 32768):]
+        dict_id = hashlib.sha1(data).hexdigest()[:8]
+        self.redis_client.set(DICT_KEY.format(dict_id), base64.b64encode(data).decode('ascii'))
+        self.redis_client.set(CURRENT_DICT_KEY, dict_id)
+        self._dicts[dict_id] = data
+        self._dict_id = dict_id
+        self._dict_checked = time.monotonic()
+        return dict_id
+
+
+def _sample_events(redis_client: redis.Redis, codec: MessageCodec, queue_name: str,
+                   count: int) -> List[Dict[str, Any]]:
+    """从队列取样本事件；队列为空时用 producer_v2 的生成器合成"""
+    events = []
+    for raw in redis_client.lrange(queue_name, 0, count - 1):
+        try:
+            events.append(codec.decode(raw))
+        except ValueError:
+            continue
+    if not events:
+        from producer_v2 import TweetProducer, build_queue_item
+        producer = TweetProducer.__new__(TweetProducer)
+        events = [build_queue_item(producer.generate_event(kind))
+                  for i in range(count) for kind in [('alert', 'business', 'scheduled', 'alpha')[i % 4]]]
+    return events
+
+
+def _memory_per_message(redis_client: redis.Redis, key: str, payloads: List[str]) -> Tuple[float, str]:
+    """把样本写入临时列表，用 MEMORY USAGE 计算平均每条占用；不支持该命令时退回负载字节数"""
+    redis_client.delete(key)
+    pipe = redis_client.pipeline(transaction=False)
+    for start in range(0, len(payloads), 1000):
+        pipe.rpush(key, *payloads[start:start + 1000])
+    pipe.execute()
+    try:
+        usage = redis_client.memory_usage(key, samples=0)
+        return usage / len(payloads), 'MEMORY USAGE'
+    except redis.exceptions.ResponseError:
+        return sum(len(p.encode('utf-8')) for p in payloads) / len(payloads), 'payload bytes'
+    finally:
+        redis_client.delete(key)
+
+
+def report(redis_client: redis.Redis, codec: MessageCodec, queue_name: str, count: int) -> Dict[str, Any]:
+    """对比同一批样本在 JSON / 紧凑 (不压缩) / 紧凑 (压缩) 三种编码下每条消息的内存占用"""
+    events = _sample_events(redis_client, codec, queue_name, count)
+    variants = {
+        'json': [json.dumps(event, ensure_ascii=False) for event in events],
+        'compact': [MessageCodec(redis_client, 'compact', 'none').encode(event) for event in events],
+        f'compact+{codec.compression}': [codec.encode_compact(event) for event in events],
+    }
+    result = {'samples': len(events), 'dict': codec._current_dict(), 'variants': {}}
+    for name, payloads in variants.items():
+        per_message, method = _memory_per_message(redis_client, f"{queue_name}:codec:probe", payloads)
+        result['variants'][name] = round(per_message, 1)
+        result['method'] = method
+    return result
+
+
+def main():
+    """字典训练与内存报告: python codec.py train|report [--sample N]"""
+    setup_logging()
+    parser = argparse.ArgumentParser(description="队列消息紧凑编码工具")
+    parser.add_argument('command', choices=('train', 'report'))
+    parser.add_argument('--queue', default=Config.QUEUE_NAME, help="取样本的队列")
+    parser.add_argument('--sample', type=int, default=2000, help="样本条数")
+    parser.add_argument('--size', type=int, default=Config.CODEC_DICT_SIZE, help="字典大小 (字节)")
+    args = parser.parse_args()
+
+    redis_client = redis.Redis(**Config.redis_kwargs())
+    codec = MessageCodec(redis_client, 'compact')
+    if args.command == 'train':
+        events = _sample_events(redis_client, codec, args.queue, args.sample)
+        dict_id = codec.train(events, args.size)
+        logger.info("✅ 已训练字典 %s (%d 个样本，%s)，生产者一分钟内切换", dict_id, len(events), codec.compression)
+        return 0
+
+    result = report(redis_client, codec, args.queue, args.sample)
+    baseline = result['variants']['json']
+    print(f"\n=== 每条消息内存占用 ({result['method']}，{result['samples']} 条样本，字典 {result['dict'] or '无'}) ===")
+    for name, size in result['variants'].items():
+        print(f"  {name:<16} {size:>8.1f} 字节  ({size / baseline:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
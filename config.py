@@ -17,6 +17,21 @@ class Config:
     TWITTER_ACCESS_TOKEN = os.getenv('TWITTER_ACCESS_TOKEN')
     TWITTER_ACCESS_TOKEN_SECRET = os.getenv('TWITTER_ACCESS_TOKEN_SECRET')
     TWITTER_SENDING = os.getenv('TWITTER_SENDING', 'true').lower() == 'true'
+    # 覆盖 Twitter API 地址，仅用于本地假服务器 / 故障注入测试
+    TWITTER_API_BASE_URL = os.getenv('TWITTER_API_BASE_URL', '')
+    
+    # 搜索结果缓存: 相同查询在 TTL 内直接返回缓存 (秒 / 条目数)
+    SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', 60))
+    SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 256))
+    # 用户信息缓存: 按 ID / 用户名缓存 get_users 结果 (秒 / 条目数)
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 3600))
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1024))
+    
+    # 多账号池: 指向账号 JSON 文件时启用，见 account_pool.py
+    TWITTER_ACCOUNTS_FILE = os.getenv('TWITTER_ACCOUNTS_FILE', '')
+    ACCOUNT_DAILY_LIMIT = int(os.getenv('ACCOUNT_DAILY_LIMIT', 100))
+    ACCOUNT_MAX_FAILURES = int(os.getenv('ACCOUNT_MAX_FAILURES', 3))
+    ACCOUNT_COOLDOWN = int(os.getenv('ACCOUNT_COOLDOWN', 900))
     
     # 代理配置
     USE_PROXY = USE_PROXY
@@ -27,13 +42,144 @@ class Config:
     REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
     REDIS_DB = int(os.getenv('REDIS_DB', 0))
     REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', None)
+    # 多节点: REDIS_CLUSTER=true 连接 Redis Cluster (REDIS_HOST/PORT 为任一节点)；
+    # 或在 REDIS_NODES 列出多个独立节点 "host:port[/db],..."，分片按一致性哈希分配到节点
+    REDIS_CLUSTER = os.getenv('REDIS_CLUSTER', 'false').lower() == 'true'
+    REDIS_NODES = os.getenv('REDIS_NODES', '')
     
     # 应用配置
     QUEUE_NAME = os.getenv('QUEUE_NAME', 'tweet_queue')
+    # Redis Cluster 下主队列带哈希标签 ({tweet_queue})，暂存、中转、分区等派生键 <QUEUE_NAME>:... 与主队列
+    # 落在同一槽位，跨键的 LMOVE / MULTI 不会报 CROSSSLOT；已带花括号的名称原样使用
+    if REDIS_CLUSTER and '{' not in QUEUE_NAME:
+        QUEUE_NAME = '{' + QUEUE_NAME + '}'
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_JSON = os.getenv('LOG_FORMAT', 'text').lower() == 'json'
+    LOG_FILE = os.getenv('LOG_FILE', '')
+    # 逐条消息日志量: full / summary / off
+    LOG_PER_MESSAGE = os.getenv('LOG_PER_MESSAGE', 'summary').lower()
     MAX_TWEET_LENGTH = int(os.getenv('MAX_TWEET_LENGTH', 280))
+    # 推文超长时按顺序去掉的模板字段 (整行删除)，见 tweet_length.py
+    TWEET_OPTIONAL_FIELDS = os.getenv('TWEET_OPTIONAL_FIELDS', 'address,chain')
     RATE_LIMIT_BUFFER = int(os.getenv('RATE_LIMIT_BUFFER', 5))
     
+    # 发推节奏 (pacer.py): 24 小时额度均摊 + AIMD，预留一部分额度给高优先级事件
+    TWEET_DAILY_LIMIT = int(os.getenv('TWEET_DAILY_LIMIT', 100))      # 单账号额度，未收到响应头时使用
+    PACER_RESERVE = float(os.getenv('PACER_RESERVE', 0.2))             # 预留给高优先级事件的额度比例
+    PACER_PRIORITY_TYPES = os.getenv('PACER_PRIORITY_TYPES', 'alpha_new_token')
+    PACER_PRIORITY_SEVERITIES = os.getenv('PACER_PRIORITY_SEVERITIES', '高,严重')
+    PACER_MIN_INTERVAL = float(os.getenv('PACER_MIN_INTERVAL', 1))     # 两条推文的最小间隔(秒)
+    PACER_MAX_WAIT = float(os.getenv('PACER_MAX_WAIT', 5))             # 普通事件最多在消费线程中等待的秒数
+    PACER_INCREASE = float(os.getenv('PACER_INCREASE', 0.1))
+    PACER_MAX_BURST = float(os.getenv('PACER_MAX_BURST', 4))
+    PACER_MIN_FACTOR = float(os.getenv('PACER_MIN_FACTOR', 0.25))
+    
+    # 采样性能剖析 (profiler.py): 每 PROFILE_EVERY 条消息剖析一条，也可用 SIGUSR2 随时开关
+    PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', 'false').lower() == 'true'
+    PROFILE_EVERY = int(os.getenv('PROFILE_EVERY', 50))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    PROFILE_DUMP_INTERVAL = float(os.getenv('PROFILE_DUMP_INTERVAL', 300))   # 输出剖析文件的间隔(秒)
+    PROFILE_SAMPLE_MS = float(os.getenv('PROFILE_SAMPLE_MS', 5))             # 调用栈采样间隔(毫秒)
+    
+    # 消费端预取: 每次往返最多取回的消息数，1 表示逐条 BRPOP
+    PREFETCH_COUNT = int(os.getenv('PREFETCH_COUNT', 10))
+    PREFETCH_DUMP_PATH = os.getenv('PREFETCH_DUMP_PATH', 'prefetch_unacked.jsonl')
+    
+    # 消息时效: 按类型的最大年龄(秒)，例 "alpha_new_token=600;*=0"，0 表示不过期
+    MESSAGE_MAX_AGE = os.getenv('MESSAGE_MAX_AGE', '')
+    # 没有 queue_timestamp 时 detected_at 的时区 (UTC / +08:00 / Asia/Shanghai)，留空为本机时区；自带偏移的值按偏移解析
+    DETECTED_AT_TZ = os.getenv('DETECTED_AT_TZ', '')
+    EXPIRED_LOG_MAX = int(os.getenv('EXPIRED_LOG_MAX', 1000))
+    # 积压超过该条数时优先处理最新消息，0 表示关闭
+    FRESH_FIRST_THRESHOLD = int(os.getenv('FRESH_FIRST_THRESHOLD', 0))
+    FRESH_CHECK_INTERVAL = float(os.getenv('FRESH_CHECK_INTERVAL', 5))
+    
+    # 队列消息编码 (codec.py): json 或 compact (短字段 + 模板 + 字典压缩)；先升级消费者再开启 compact
+    QUEUE_ENCODING = os.getenv('QUEUE_ENCODING', 'json').lower()
+    CODEC_COMPRESSION = os.getenv('CODEC_COMPRESSION', 'auto').lower()   # auto / zstd / zlib / none
+    CODEC_DICT_SIZE = int(os.getenv('CODEC_DICT_SIZE', 16384))
+    
+    # 告警汇总模式 (digest.py): 积压条数或最老消息年龄超过阈值时合并 monitoring_alert，0 表示不按该项触发
+    DIGEST_DEPTH = int(os.getenv('DIGEST_DEPTH', 0))
+    DIGEST_AGE = float(os.getenv('DIGEST_AGE', 0))
+    DIGEST_EXIT_RATIO = float(os.getenv('DIGEST_EXIT_RATIO', 0.5))    # 回落到阈值的该比例以下才退出
+    DIGEST_WINDOW = float(os.getenv('DIGEST_WINDOW', 60))             # 每组合并多久输出一条汇总(秒)
+    DIGEST_CHECK_INTERVAL = float(os.getenv('DIGEST_CHECK_INTERVAL', 5))
+    DIGEST_TYPES = os.getenv('DIGEST_TYPES', 'monitoring_alert')
+    DIGEST_KEYS = os.getenv('DIGEST_KEYS', 'service,alert_type,region')
+    
+    # send_and_wait 回复键的保留时间(秒)，见 replies.py
+    REPLY_TTL = int(os.getenv('REPLY_TTL', 300))
+    
+    # 生产端本地 spool: Redis 不可用时先写本地文件，恢复后回放；留空关闭
+    SPOOL_PATH = os.getenv('SPOOL_PATH', 'producer_spool.jsonl')
+    SPOOL_FSYNC = os.getenv('SPOOL_FSYNC', 'interval').lower()   # always / interval / never
+    SPOOL_FSYNC_INTERVAL = float(os.getenv('SPOOL_FSYNC_INTERVAL', 1))
+    SPOOL_MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', 100 * 1024 * 1024))
+    
+    # 按键分区的有序并行消费: 分区数 > 0 时启用，见 partitions.py
+    QUEUE_PARTITIONS = int(os.getenv('QUEUE_PARTITIONS', 0))
+    PARTITION_KEYS = os.getenv('PARTITION_KEYS', 'address,chain,service')
+    PARTITION_LEASE_TTL = float(os.getenv('PARTITION_LEASE_TTL', 30))
+    PARTITION_HEARTBEAT = float(os.getenv('PARTITION_HEARTBEAT', 5))
+    
+    # 队列分片 (shards.py): 分片数 > 0 时按 SHARD_KEYS 写入 <QUEUE_NAME>:{s<i>}
+    QUEUE_SHARDS = int(os.getenv('QUEUE_SHARDS', 0))
+    SHARD_KEYS = os.getenv('SHARD_KEYS', 'chain,type')
+    CONSUMER_SHARDS = os.getenv('CONSUMER_SHARDS', '')    # 本消费者订阅的分片，例 "0-3,7"，留空为全部
+    
+    # Alpha 事件规范化 (enrich.py): 链名 / 地址大小写统一，浏览器链接按链注册表生成
+    ENRICH_ENABLED = os.getenv('ENRICH_ENABLED', 'true').lower() == 'true'
+    CHAIN_REGISTRY_PATH = os.getenv('CHAIN_REGISTRY_PATH', '')    # 留空使用项目目录下的 chains.json
+    
+    # 分阶段流水线: decode → validate → enrich → render → send，见 pipeline.py
+    PIPELINE_ENABLED = os.getenv('PIPELINE_ENABLED', 'false').lower() == 'true'
+    PIPELINE_WORKERS = os.getenv('PIPELINE_WORKERS', 'send=2')    # 各阶段线程数，未列出的为 1
+    PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 100))
+    PIPELINE_STATS_INTERVAL = float(os.getenv('PIPELINE_STATS_INTERVAL', 60))
+    
+    # 推文图片: 提前异步分块上传，media_id 按内容哈希缓存，见 media.py
+    MEDIA_ENABLED = os.getenv('MEDIA_ENABLED', 'false').lower() == 'true'
+    MEDIA_TOKEN_CARD = os.getenv('MEDIA_TOKEN_CARD', 'false').lower() == 'true'   # 需要 Pillow
+    MEDIA_CACHE_TTL = int(os.getenv('MEDIA_CACHE_TTL', 23 * 3600))
+    MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', 2))
+    MEDIA_UPLOAD_TIMEOUT = float(os.getenv('MEDIA_UPLOAD_TIMEOUT', 60))
+    MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', 5 * 1024 * 1024))
+    MEDIA_DIR = os.getenv('MEDIA_DIR', '')                # 本地图片只允许此目录下的文件，留空禁止读取本地文件
+    MEDIA_URL_HOSTS = os.getenv('MEDIA_URL_HOSTS', '')    # 允许下载图片的域名 (逗号分隔)，留空禁止 URL
+    
+    # 输出目标 (Sink) 配置
+    # 例: "alpha_new_token=twitter,file;*=twitter"，留空时按 TWITTER_SENDING 选择 twitter / null
+    SINK_ROUTES = os.getenv('SINK_ROUTES', '')
+    SINK_TIMEOUT = float(os.getenv('SINK_TIMEOUT', 60))
+    SINK_WORKERS = int(os.getenv('SINK_WORKERS', 2))
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    SINK_FILE_PATH = os.getenv('SINK_FILE_PATH', 'tweets_out.jsonl')
+    
+    # 常驻生产者服务 (producer_daemon.py)
+    PRODUCER_HTTP_HOST = os.getenv('PRODUCER_HTTP_HOST', '127.0.0.1')
+    PRODUCER_HTTP_PORT = int(os.getenv('PRODUCER_HTTP_PORT', 8787))
+    PRODUCER_UNIX_SOCKET = os.getenv('PRODUCER_UNIX_SOCKET', '')
+    DAEMON_BATCH_SIZE = int(os.getenv('DAEMON_BATCH_SIZE', 500))
+    DAEMON_LINGER_MS = float(os.getenv('DAEMON_LINGER_MS', 5))
+    DAEMON_MAX_PENDING = int(os.getenv('DAEMON_MAX_PENDING', 100000))
+    DAEMON_WRITERS = int(os.getenv('DAEMON_WRITERS', 1))
+    # 退出时等待写完积压的最长时间(秒)，到期后未写入的消息转存到 SPOOL_PATH
+    DAEMON_STOP_TIMEOUT = float(os.getenv('DAEMON_STOP_TIMEOUT', 30))
+    
+    @classmethod
+    def redis_kwargs(cls) -> dict:
+        """redis.Redis 连接参数"""
+        redis_config = {
+            'host': cls.REDIS_HOST,
+            'port': cls.REDIS_PORT,
+            'db': cls.REDIS_DB,
+            'decode_responses': True
+        }
+        if cls.REDIS_PASSWORD:
+            redis_config['password'] = cls.REDIS_PASSWORD
+        return redis_config
+    
     @classmethod
     def validate(cls):
         """验证必要的配置是否存在"""
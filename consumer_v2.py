@@ -2,22 +2,27 @@
 # 这个程序负责从队列中获取内容并发送到Twitter。
 
 import redis
-import json
 import time
 import logging
 import signal
 import sys
 from datetime import datetime
-from typing import Optional, Dict, Any
 from config import Config
-from twitter_client import TwitterClient
+from sinks import SinkRouter, delivery_status
+from shards import connect, make_reader, ShardMap
+from staleness import StalenessPolicy
+from partitions import PartitionedConsumer, REQUEUE, stopping
+from pipeline import StagedPipeline, Work
+from pacer import PostingPacer, DeferredQueue
+from codec import MessageCodec
+from profiler import MessageProfiler
+from digest import AlertDigest
+from replies import ReplyPublisher
+from log_setup import setup_logging, message_logger
 
-# 配置日志
-logging.basicConfig(
-    level=getattr(logging, Config.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
+# 逐条消息日志，日志量由 LOG_PER_MESSAGE 控制
+msg_logger = message_logger(__name__)
 
 class TweetConsumer:
     """推文消费者类"""
@@ -25,39 +30,52 @@ class TweetConsumer:
     def __init__(self):
         """初始化消费者"""
         self.running = True
+        self.sinks = None
         self.twitter_client = None
         self.redis_client = None
+        self.reader = None
+        self.pacer = None
+        self.deferred = None
+        self.codec = None
+        self.digest = None
+        self.replies = None
         
         # 注册信号处理器
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
+        # 采样剖析: PROFILE_ENABLED=true 或 kill -USR2 <pid> 开关
+        self.profiler = MessageProfiler('consumer')
+        self.profiler.install_signal()
         
         try:
-            # 初始化Twitter客户端
-            self.twitter_client = TwitterClient()
+            # 初始化输出目标 (dry-run 时不会创建 Twitter 客户端)
+            self.sinks = SinkRouter.from_config()
+            self.twitter_client = self.sinks.twitter_client
             
             # 连接到Redis
-            redis_config = {
-                'host': Config.REDIS_HOST,
-                'port': Config.REDIS_PORT,
-                'db': Config.REDIS_DB,
-                'decode_responses': True
-            }
-            
-            if Config.REDIS_PASSWORD:
-                redis_config['password'] = Config.REDIS_PASSWORD
-            
-            self.redis_client = redis.Redis(**redis_config)
+            self.redis_client = connect()
             self.redis_client.ping()
-            logger.info(f"成功连接到 Redis: {Config.REDIS_HOST}:{Config.REDIS_PORT}")
+            logger.info("成功连接到 Redis: %s:%s", Config.REDIS_HOST, Config.REDIS_PORT)
+            # QUEUE_SHARDS > 0 时读取本实例订阅的分片，见 shards.py
+            self.reader = make_reader(self.redis_client, Config.QUEUE_NAME, block_timeout=30)
+            # 同时识别 JSON 和紧凑编码的消息
+            self.codec = MessageCodec(self.redis_client)
+            self.staleness = StalenessPolicy.from_config(self.redis_client)
+            # 发推节奏: 按 24 小时额度均摊，普通消息额度用完后暂存
+            self.pacer = PostingPacer.from_sinks(self.sinks)
+            self.deferred = DeferredQueue(self.redis_client)
+            # 积压时把同类监控告警合并成汇总推文
+            self.digest = AlertDigest.from_config(self.redis_client, self.codec)
+            # 向 send_and_wait 的调用方回报结果
+            self.replies = ReplyPublisher(self.redis_client)
             
         except Exception as e:
-            logger.error(f"初始化失败: {e}")
+            logger.error("初始化失败: %s", e)
             raise
     
     def _signal_handler(self, signum, frame):
         """信号处理器"""
-        logger.info(f"收到信号 {signum}，正在优雅关闭...")
+        logger.info("收到信号 %s，正在优雅关闭...", signum)
         self.running = False
     
     def process_tweet_task(self, task: dict) -> bool:
@@ -77,33 +95,91 @@ class TweetConsumer:
             
             if not tweet_content:
                 logger.error("❌ 任务中没有找到 'message' 字段")
+                self.replies.publish(task, 'invalid', error="缺少 message 字段")
                 return False
             
-            logger.info(f"📝 处理 {task_type} 类型的推文任务")
-            logger.info(f"📄 推文内容: {tweet_content}")
+            msg_logger.debug("📝 处理 %s 类型的推文任务", task_type)
+            msg_logger.debug("📄 推文内容: %s", tweet_content)
             
-            # 发送推文
-            result = self.twitter_client.send_tweet(tweet_content)
-            
-            if result and result.get('success'):
-                logger.info(f"✅ 推文发送成功!")
-                logger.info(f"🔗 推文链接: {result.get('tweet_url')}")
-                
-                # 记录成功的推文信息
-                self._log_success(task, result)
-                return True
-            else:
-                logger.error(f"❌ 推文发送失败")
-                self._log_failure(task, "发送失败")
-                return False
+            with self.profiler.sample():
+                return self._deliver(task, tweet_content)
                 
         except Exception as e:
-            logger.error(f"❌ 处理推文任务时发生错误: {e}")
+            logger.error("❌ 处理推文任务时发生错误: %s", e)
             self._log_failure(task, str(e))
+            self.replies.publish(task, 'failed', error=str(e))
+            return False
+    
+    def _pace(self, task: dict, task_json: str) -> bool:
+        """等待发送时刻；当前没有可用额度时暂存消息并返回 False"""
+        if self.pacer.wait(task, lambda: self.running):
+            return True
+        self.deferred.defer(task_json)
+        msg_logger.info("⏸️  发推额度不足或未到发送时刻，%s 消息已暂存", task.get('type', 'unknown'))
+        self.replies.publish(task, 'deferred')
+        return False
+    
+    def _filtered(self, task: dict, task_json: str) -> bool:
+        """过期丢弃或并入告警汇总时返回 True，调用方不再单独发送"""
+        if self.staleness.drop_if_expired(task, task_json):
+            self.replies.publish(task, 'expired')
+            return True
+        if self.digest.absorb(task):
+            self.replies.publish(task, 'digested')
+            return True
+        return False
+    
+    def _deliver(self, task: dict, tweet_content: str) -> bool:
+        """投递到该类型配置的所有输出目标并记录结果"""
+        result = self.sinks.dispatch(tweet_content, task)
+        self.pacer.record(bool(result and result.get('success')), task)
+        self.replies.publish(task, delivery_status(result), result)
+        
+        if result and result.get('success'):
+            msg_logger.info("✅ %s 推文发送成功: %s", task.get('type', 'unknown'), result.get('tweet_url'))
+            
+            # 记录成功的推文信息
+            self._log_success(task, result)
+            return True
+        elif result and result.get('unknown'):
+            # 超时但可能已发出，不计为失败，避免重复投递
+            logger.warning("⚠️  %s 投递超时，结果未知: %s", task.get('type', 'unknown'), result['unknown'])
+            return True
+        else:
+            logger.error("❌ 推文发送失败")
+            self._log_failure(task, "发送失败")
             return False
     
+    def pipeline_stages(self) -> dict:
+        """流水线模式下各阶段的处理函数 (本消费者没有 enrich 阶段)"""
+        def decode(work: Work) -> bool:
+            work.event = self.codec.decode(work.raw)
+            return True
+        
+        def validate(work: Work) -> bool:
+            if not work.event.get("message"):
+                logger.error("❌ 任务中没有找到 'message' 字段")
+                self.replies.publish(work.event, 'invalid', error="缺少 message 字段")
+                return False
+            # 过期消息在渲染和发送前直接丢弃；汇总模式下合并的告警不再单独发送
+            return not self._filtered(work.event, work.raw)
+        
+        def render(work: Work) -> bool:
+            work.content = work.event["message"]
+            return True
+        
+        def send(work: Work) -> bool:
+            if not self._pace(work.event, work.raw):
+                return False
+            with self.profiler.sample():
+                return self._deliver(work.event, work.content)
+        
+        return {'decode': decode, 'validate': validate, 'render': render, 'send': send}
+    
     def _log_success(self, task: dict, result: dict):
         """记录成功日志"""
+        if not msg_logger.isEnabledFor(logging.DEBUG):
+            return
         success_info = {
             'timestamp': datetime.now().isoformat(),
             'task_type': task.get('type'),
@@ -111,7 +187,7 @@ class TweetConsumer:
             'tweet_url': result.get('tweet_url'),
             'content_preview': task.get('message', '')[:100]
         }
-        logger.debug(f"📊 成功记录: {success_info}")
+        msg_logger.debug("📊 成功记录: %s", success_info)
     
     def _log_failure(self, task: dict, error_msg: str):
         """记录失败日志"""
@@ -121,7 +197,7 @@ class TweetConsumer:
             'error': error_msg,
             'content_preview': task.get('message', '')[:100]
         }
-        logger.warning(f"📊 失败记录: {failure_info}")
+        logger.warning("📊 失败记录: %s", failure_info)
     
     def get_queue_status(self) -> dict:
         """获取队列状态"""
@@ -134,7 +210,7 @@ class TweetConsumer:
                 'timestamp': time.time()
             }
         except Exception as e:
-            logger.error(f"获取队列状态失败: {e}")
+            logger.error("获取队列状态失败: %s", e)
             return {
                 'queue_name': Config.QUEUE_NAME,
                 'queue_length': -1,
@@ -148,33 +224,69 @@ class TweetConsumer:
         logger.info("🤖 Twitter 发推机器人已启动，正在等待任务...")
         
         # 显示初始状态
-        twitter_status = self.twitter_client.get_rate_limit_status()
         queue_status = self.get_queue_status()
-        user_info = self.twitter_client.get_user_info()
-        
-        logger.info(f"📱 Twitter 状态: {twitter_status['status']}")
-        logger.info(f"📋 队列状态: {queue_status['queue_length']} 条待处理消息")
-        if user_info:
-            logger.info(f"👤 认证用户: @{user_info['username']} ({user_info['name']})")
+        logger.info("📋 队列状态: %s 条待处理消息", queue_status['queue_length'])
+        if self.twitter_client:
+            twitter_status = self.twitter_client.get_rate_limit_status()
+            user_info = self.twitter_client.get_user_info()
+            logger.info("📱 Twitter 状态: %s", twitter_status['status'])
+            if user_info:
+                logger.info("👤 认证用户: @%s (%s)", user_info['username'], user_info['name'])
+        else:
+            logger.info("📱 未配置 Twitter 输出，使用 sink 路由: %s", self.sinks.routes)
         
+        try:
+            if Config.QUEUE_PARTITIONS > 0:
+                # 按键分区: 同一地址/链/服务的消息按顺序处理，不同键并行
+                PartitionedConsumer(self.redis_client, self.handle_message).run(
+                    lambda: self.running, on_tick=self._on_tick)
+            elif Config.PIPELINE_ENABLED:
+                StagedPipeline.from_funcs(self.pipeline_stages(), self.reader, name='consumer').run(
+                    lambda: self.running, on_tick=self._on_tick)
+            else:
+                self._consume_loop()
+        finally:
+            # 预取但尚未处理的消息放回队列，本地缓冲不会成为丢消息的地方
+            self.reader.requeue()
+            logger.info("📊 预取统计: %s", self.reader.stats())
+            self.digest.close()
+            self.sinks.close()
+            self.profiler.close()
+        logger.info("🔚 Twitter 发推机器人已停止")
+    
+    def _on_tick(self):
+        """主循环的周期任务: 额度恢复后放回暂存消息，检查积压并输出到期的告警汇总"""
+        self.deferred.maybe_restore(self.pacer)
+        self.digest.tick()
+    
+    def _consume_loop(self):
+        """消费主循环"""
         consecutive_errors = 0
         max_consecutive_errors = 5
         
         while self.running:
             try:
-                # 使用阻塞式操作从队列获取任务
-                # brpop 会一直等待直到队列中有新消息或超时
-                result = self.redis_client.brpop(Config.QUEUE_NAME, timeout=30)
+                self._on_tick()
+                
+                # 从本地预取缓冲取任务，缓冲为空时批量从队列取回
+                task_json = self.reader.get()
                 
-                if result is None:
+                if task_json is None:
                     # 超时，继续循环
                     logger.debug("⏰ 队列监听超时，继续等待...")
                     continue
                 
-                source_queue, task_json = result
-                task = json.loads(task_json)
+                task = self.codec.decode(task_json)
+                
+                # 过期消息在渲染和发送前直接丢弃，不占用发推额度；汇总模式下监控告警只计入汇总
+                if self._filtered(task, task_json):
+                    continue
+                
+                msg_logger.debug("🔔 从队列 '%s' 收到新任务", Config.QUEUE_NAME)
                 
-                logger.info(f"\n🔔 [{datetime.now().strftime('%H:%M:%S')}] 从队列 '{source_queue}' 收到新任务")
+                # 按发推额度等待发送时刻 (替代固定的 2 秒间隔)
+                if not self._pace(task, task_json):
+                    continue
                 
                 # 处理任务
                 success = self.process_tweet_task(task)
@@ -186,15 +298,12 @@ class TweetConsumer:
                     
                     # 如果连续失败太多次，暂停一下
                     if consecutive_errors >= max_consecutive_errors:
-                        logger.warning(f"⚠️  连续 {consecutive_errors} 次处理失败，暂停 60 秒...")
+                        logger.warning("⚠️  连续 %s 次处理失败，暂停 60 秒...", consecutive_errors)
                         time.sleep(60)
                         consecutive_errors = 0
                 
-                # 任务间隔，避免过于频繁的API调用
-                time.sleep(2)
-                
             except redis.exceptions.ConnectionError as e:
-                logger.error(f"❌ Redis 连接断开，正在尝试重连... ({e})")
+                logger.error("❌ Redis 连接断开，正在尝试重连... (%s)", e)
                 time.sleep(10)
                 try:
                     self.redis_client.ping()
@@ -203,8 +312,8 @@ class TweetConsumer:
                 except:
                     consecutive_errors += 1
                     
-            except json.JSONDecodeError as e:
-                logger.error(f"❌ 任务JSON解析失败: {e}")
+            except ValueError as e:
+                logger.error("❌ 任务解析失败: %s", e)
                 consecutive_errors += 1
                 
             except KeyboardInterrupt:
@@ -212,11 +321,24 @@ class TweetConsumer:
                 break
                 
             except Exception as e:
-                logger.error(f"❌ 处理任务时发生未知错误: {e}")
+                logger.error("❌ 处理任务时发生未知错误: %s", e)
                 consecutive_errors += 1
                 time.sleep(5)
-        
-        logger.info("🔚 Twitter 发推机器人已停止")
+    
+    def handle_message(self, task_json: str):
+        """分区工作线程的单条消息处理: 解析、过期检查、按额度等待、投递"""
+        try:
+            task = self.codec.decode(task_json)
+        except ValueError as e:
+            logger.error("❌ 任务解析失败: %s", e)
+            return False
+        if self._filtered(task, task_json):
+            return False
+        # 不暂存: 暂存的消息会放回未分区的主队列，排到同键的新消息之后，打乱分区内顺序；
+        # 这里一直等到发送时刻，退出或交出分区时放回分区队列
+        if not self.pacer.wait(task, lambda: self.running and not stopping(), block=True):
+            return REQUEUE
+        return self.process_tweet_task(task)
     
     def process_single_message(self) -> bool:
         """
@@ -232,18 +354,23 @@ class TweetConsumer:
             if result is None:
                 return False
             
-            task = json.loads(result)
-            logger.info(f"🔔 处理单条消息: {task.get('type', 'unknown')}")
+            task = self.codec.decode(result)
+            logger.info("🔔 处理单条消息: %s", task.get('type', 'unknown'))
             
             return self.process_tweet_task(task)
             
         except Exception as e:
-            logger.error(f"❌ 处理单条消息失败: {e}")
+            logger.error("❌ 处理单条消息失败: %s", e)
             return False
 
 
 def main():
     """主函数"""
+    setup_logging()
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "inspect":
+        # 只读 Redis，不需要初始化 Twitter 客户端
+        from inspector import run_inspect
+        return run_inspect(sys.argv[2:])
     try:
         consumer = TweetConsumer()
         
@@ -266,15 +393,30 @@ def main():
                 # 查看状态模式
                 logger.info("📊 状态查看模式")
                 queue_status = consumer.get_queue_status()
-                twitter_status = consumer.twitter_client.get_rate_limit_status()
-                user_info = consumer.twitter_client.get_user_info()
                 
                 print(f"\n=== 系统状态 ===")
                 print(f"队列长度: {queue_status['queue_length']} 条消息")
-                print(f"Twitter状态: {twitter_status['status']}")
-                if user_info:
-                    print(f"认证用户: @{user_info['username']} ({user_info['name']})")
-                    print(f"粉丝数: {user_info['followers_count']}")
+                if Config.QUEUE_PARTITIONS > 0:
+                    depths = PartitionedConsumer(consumer.redis_client, consumer.handle_message).depths()
+                    print(f"分区积压: {depths}")
+                if Config.QUEUE_SHARDS > 0:
+                    print(f"分片积压: {ShardMap.from_config(consumer.redis_client).depths()}")
+                if consumer.twitter_client:
+                    twitter_status = consumer.twitter_client.get_rate_limit_status()
+                    user_info = consumer.twitter_client.get_user_info()
+                    print(f"Twitter状态: {twitter_status['status']}")
+                    if user_info:
+                        print(f"认证用户: @{user_info['username']} ({user_info['name']})")
+                        print(f"粉丝数: {user_info['followers_count']}")
+                else:
+                    print(f"输出路由: {consumer.sinks.routes}")
+                pacer = consumer.pacer.status()
+                print(f"24小时发推额度: 剩余 {pacer['remaining']}/{pacer['limit']} (预留 {pacer['reserved']})，"
+                      f"{datetime.fromtimestamp(pacer['reset']).strftime('%H:%M:%S')} 重置")
+                print(f"暂存消息: {consumer.redis_client.llen(consumer.deferred.key)} 条")
+                if consumer.digest.enabled:
+                    depth, age = consumer.digest.backlog()
+                    print(f"告警汇总: 积压 {depth} 条 / 最老 {age:.0f}s (阈值 {Config.DIGEST_DEPTH} 条 / {Config.DIGEST_AGE:.0f}s)")
                 print(f"检查时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
                 return 0
             
@@ -284,6 +426,7 @@ def main():
                 print("  python consumer_v2.py        # 持续运行模式")
                 print("  python consumer_v2.py single # 处理单条消息")
                 print("  python consumer_v2.py status # 查看状态")
+                print("  python consumer_v2.py inspect [--sample N] # 分析队列积压")
                 return 1
         
         # 默认持续运行模式
@@ -294,7 +437,7 @@ def main():
         logger.info("🛑 用户中断程序")
         return 0
     except Exception as e:
-        logger.error(f"❌ 程序执行失败: {e}")
+        logger.error("❌ 程序执行失败: %s", e)
         return 1
 
 
@@ -0,0 +1,213 @@
+# digest.py - 积压时的告警汇总模式
+# 队列积压条数或最老消息年龄超过阈值时进入汇总模式: monitoring_alert 不再逐条发推，
+# 按 (service, alert_type, region) 合并，每 DIGEST_WINDOW 秒为每组生成一条带次数和时间范围的
+# monitoring_digest 事件放回队列消费端，由正常流程发送。积压降到阈值 × DIGEST_EXIT_RATIO 以下后
+# 输出剩余汇总并恢复逐条发送 (两个阈值之间不切换，避免来回抖动)。
+
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+import redis
+
+from config import Config
+from staleness import event_time
+
+logger = logging.getLogger(__name__)
+
+# 由低到高，汇总取组内最高级别
+SEVERITY_ORDER = ('低', '中', '高', '严重')
+
+
+def _field(event: Dict[str, Any], name: str) -> str:
+    """字段可以在事件顶层，也可以在 metadata 中 (例如 region)"""
+    value = event.get(name)
+    if value in (None, '') and isinstance(event.get('metadata'), dict):
+        value = event['metadata'].get(name)
+    return '' if value is None else str(value)
+
+
+class _Group:
+    """同一 (service, alert_type, region) 的合并状态"""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.count = 0
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+        self.severity = ''
+        self.servers = set()
+
+    def add(self, event: Dict[str, Any]):
+        self.count += 1
+        at = event_time(event) or time.time()
+        self.first_at = at if self.first_at is None else min(self.first_at, at)
+        self.last_at = at if self.last_at is None else max(self.last_at, at)
+        severity = event.get('severity', '')
+        if severity in SEVERITY_ORDER and (self.severity not in SEVERITY_ORDER or
+                                           SEVERITY_ORDER.index(severity) > SEVERITY_ORDER.index(self.severity)):
+            self.severity = severity
+        server = _field(event, 'server_id')
+        if server:
+            self.servers.add(server)
+
+
+class AlertDigest:
+    """
+    告警汇总器
+
+    用法: 解析后调用 absorb(event)，返回 True 表示该消息已被合并、调用方跳过；
+    主循环 (或流水线 / 分区的 on_tick) 中定期调用 tick() 检查积压并输出到期的汇总。
+    汇总事件编码后 RPUSH 到队列消费端，下一条就会被取到，进程退出时也不会丢在内存里。
+    """
+
+    def __init__(self, redis_client: redis.Redis, codec, queues: List[Tuple[redis.Redis, str]],
+                 enter_depth: Optional[int] = None, enter_age: Optional[float] = None,
+                 exit_ratio: Optional[float] = None, window: Optional[float] = None,
+                 queue_name: Optional[str] = None):
+        self.redis_client = redis_client
+        self.codec = codec
+        self.queues = queues
+        self.queue_name = queue_name or Config.QUEUE_NAME
+        self.enter_depth = Config.DIGEST_DEPTH if enter_depth is None else enter_depth
+        self.enter_age = Config.DIGEST_AGE if enter_age is None else enter_age
+        self.exit_ratio = Config.DIGEST_EXIT_RATIO if exit_ratio is None else exit_ratio
+        self.window = Config.DIGEST_WINDOW if window is None else window
+        self.types = {t.strip() for t in Config.DIGEST_TYPES.split(',') if t.strip()}
+        self.keys = [k.strip() for k in Config.DIGEST_KEYS.split(',') if k.strip()]
+        self.active = False
+        self.groups: Dict[Tuple[str, ...], _Group] = {}
+        self.absorbed = 0
+        self.emitted = 0
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, redis_client: redis.Redis, codec) -> 'AlertDigest':
+        """积压按未分片主队列 + 分区队列 + 分片队列合计"""
+        queues = [(redis_client, Config.QUEUE_NAME)]
+        if Config.QUEUE_PARTITIONS > 0:
+            from partitions import partition_queue
+            queues += [(redis_client, partition_queue(Config.QUEUE_NAME, p)) for p in range(Config.QUEUE_PARTITIONS)]
+        if Config.QUEUE_SHARDS > 0:
+            from shards import ShardMap
+            shard_map = ShardMap.from_config(redis_client)
+            queues += [(shard_map.client(s), shard_map.queue(s)) for s in range(shard_map.shards)]
+        return cls(redis_client, codec, queues)
+
+    @property
+    def enabled(self) -> bool:
+        return self.enter_depth > 0 or self.enter_age > 0
+
+    def backlog(self) -> Tuple[int, float]:
+        """(总积压条数, 最老消息年龄秒数)，每个节点一次往返"""
+        by_client: Dict[int, Tuple[redis.Redis, List[str]]] = {}
+        for client, key in self.queues:
+            by_client.setdefault(id(client), (client, []))[1].append(key)
+        depth, oldest = 0, 0.0
+        now = time.time()
+        for client, keys in by_client.values():
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.llen(key)
+                pipe.lindex(key, -1)
+            results = pipe.execute()
+            for length, raw in zip(results[::2], results[1::2]):
+                depth += length
+                if raw is None:
+                    continue
+                try:
+                    created = event_time(self.codec.decode(raw))
+                except ValueError:
+                    continue
+                if created is not None:
+                    oldest = max(oldest, now - created)
+        return depth, oldest
+
+    def _update_mode(self, depth: int, age: float):
+        over = ((self.enter_depth > 0 and depth >= self.enter_depth) or
+                (self.enter_age > 0 and age >= self.enter_age))
+        under = ((self.enter_depth <= 0 or depth < self.enter_depth * self.exit_ratio) and
+                 (self.enter_age <= 0 or age < self.enter_age * self.exit_ratio))
+        if not self.active and over:
+            self.active = True
+            logger.warning("📦 积压 %d 条 / 最老 %.0fs，进入告警汇总模式", depth, age)
+        elif self.active and under:
+            self.active = False
+            logger.info("📦 积压已回落到 %d 条 / 最老 %.0fs，恢复逐条发送 (已合并 %d 条告警)",
+                        depth, age, self.absorbed)
+
+    def absorb(self, event: Dict[str, Any]) -> bool:
+        """汇总模式下合并告警，返回 True 表示调用方不再单独发送这条消息"""
+        if not self.active or event.get('type') not in self.types:
+            return False
+        key = tuple(_field(event, name) for name in self.keys)
+        with self._lock:
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = _Group(time.monotonic())
+            group.add(event)
+            self.absorbed += 1
+        return True
+
+    def tick(self) -> int:
+        """按 DIGEST_CHECK_INTERVAL 检查积压，输出到期 (或退出汇总模式时全部) 的汇总，返回输出条数"""
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        if now - self._last_check >= Config.DIGEST_CHECK_INTERVAL:
+            self._last_check = now
+            self._update_mode(*self.backlog())
+        return self.flush(force=not self.active)
+
+    def _summary(self, key: Tuple[str, ...], group: _Group) -> Dict[str, Any]:
+        fields = dict(zip(self.keys, key))
+        first = datetime.fromtimestamp(group.first_at).strftime('%H:%M:%S')
+        last = datetime.fromtimestamp(group.last_at).strftime('%H:%M:%S')
+        where = f" ({fields['region']})" if fields.get('region') else ''
+        message = (f"🚨 告警汇总：{fields.get('service', '')} {fields.get('alert_type', '')}{where}\n"
+                   f"{first} - {last} 共 {group.count} 次")
+        if group.severity:
+            message += f"，最高级别 {group.severity}"
+        if len(group.servers) > 1:
+            message += f"，涉及 {len(group.servers)} 台服务器"
+        now = time.time()
+        return {
+            **fields,
+            'type': 'monitoring_digest',
+            'severity': group.severity,
+            'count': group.count,
+            'first_at': group.first_at,
+            'last_at': group.last_at,
+            'message': message,
+            'queue_timestamp': now,
+            'queue_id': f"digest_{int(now * 1000)}",
+        }
+
+    def flush(self, force: bool = False) -> int:
+        """把合并满 DIGEST_WINDOW 秒 (force 时全部) 的组作为汇总事件放回队列消费端"""
+        now = time.monotonic()
+        with self._lock:
+            groups = [(key, group) for key, group in self.groups.items()
+                      if force or now - group.started >= self.window]
+            if not groups:
+                return 0
+            payloads = [self.codec.encode(self._summary(key, group)) for key, group in groups]
+            # 写入成功后才移除，Redis 异常时下次 tick 重试
+            self.redis_client.rpush(self.queue_name, *payloads)
+            for key, _ in groups:
+                del self.groups[key]
+            self.emitted += len(payloads)
+        logger.info("📦 已生成 %d 条告警汇总 (合并 %d 条告警)", len(payloads), sum(g.count for _, g in groups))
+        return len(payloads)
+
+    def close(self):
+        """退出前输出所有未完成的汇总，由下一个消费者发送"""
+        try:
+            self.flush(force=True)
+        except redis.exceptions.ConnectionError as e:
+            with self._lock:
+                lost = sum(g.count for g in self.groups.values())
+            logger.error("❌ 无法写回告警汇总，%d 条已合并的告警未能发送: %s", lost, e)
@@ -0,0 +1,165 @@
+# enrich.py - Alpha 事件规范化与补全
+# 启动时把 chains.json 载入内存: 链的各种写法 ("BNB Smart Chain Mainnet" / "BSC" / "56") 统一为规范名和
+# chain_id；EVM 地址统一为 EIP-55 校验和格式 (按地址缓存)；浏览器链接按链模板生成，事件不必再自带。
+# 同一代币在不同事件中的写法一致后，去重、图片缓存等按字段取键的地方才能命中。
+
+import os
+import re
+import json
+import logging
+from functools import lru_cache
+from typing import Optional, Dict, Any, List
+
+from config import Config
+
+try:
+    from Crypto.Hash import keccak as _pycryptodome_keccak
+except ImportError:
+    _pycryptodome_keccak = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGISTRY_PATH = os.path.join(os.path.dirname(__file__), 'chains.json')
+_HEX_ADDRESS = re.compile(r'0x[0-9a-fA-F]{40}\Z')
+# 事件中按链规范化的地址字段
+ADDRESS_FIELDS = ('address', 'contract')
+
+# Keccak-f[1600] 的轮常量与旋转位移 (下标 x + 5y)
+_ROUND_CONSTANTS = (
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+)
+_ROTATIONS = (0, 1, 62, 28, 27, 36, 44, 6, 55, 20, 3, 10, 43, 25, 39,
+              41, 45, 15, 21, 8, 18, 2, 61, 56, 14)
+_MASK = (1 << 64) - 1
+
+
+def _rotl(value: int, shift: int) -> int:
+    return ((value << shift) | (value >> (64 - shift))) & _MASK if shift else value
+
+
+def _keccak_f(lanes: List[int]) -> List[int]:
+    for rc in _ROUND_CONSTANTS:
+        c = [lanes[x] ^ lanes[x + 5] ^ lanes[x + 10] ^ lanes[x + 15] ^ lanes[x + 20] for x in range(5)]
+        d = [c[(x - 1) % 5] ^ _rotl(c[(x + 1) % 5], 1) for x in range(5)]
+        lanes = [lane ^ d[i % 5] for i, lane in enumerate(lanes)]
+        b = [0] * 25
+        for x in range(5):
+            for y in range(5):
+                b[y + 5 * ((2 * x + 3 * y) % 5)] = _rotl(lanes[x + 5 * y], _ROTATIONS[x + 5 * y])
+        lanes = [b[i] ^ (~b[(i + 1) % 5 + i // 5 * 5] & b[(i + 2) % 5 + i // 5 * 5]) for i in range(25)]
+        lanes[0] ^= rc
+    return lanes
+
+
+def _keccak256_py(data: bytes) -> bytes:
+    """纯 Python 的 Keccak-256；注意 hashlib.sha3_256 的填充不同，结果不是以太坊使用的 Keccak"""
+    rate = 136
+    padded = bytearray(data) + b'\x01' + b'\x00' * (rate - 1 - len(data) % rate)
+    padded[-1] |= 0x80
+    lanes = [0] * 25
+    for offset in range(0, len(padded), rate):
+        for i in range(rate // 8):
+            lanes[i] ^= int.from_bytes(padded[offset + i * 8:offset + i * 8 + 8], 'little')
+        lanes = _keccak_f(lanes)
+    return b''.join(lane.to_bytes(8, 'little') for lane in lanes[:4])
+
+
+def keccak256(data: bytes) -> bytes:
+    """安装了 pycryptodome 时用其 C 实现，否则用纯 Python 实现"""
+    if _pycryptodome_keccak is not None:
+        return _pycryptodome_keccak.new(digest_bits=256, data=data).digest()
+    return _keccak256_py(data)
+
+
+@lru_cache(maxsize=65536)
+def to_checksum_address(address: str) -> str:
+    """EIP-55 校验和地址；不是 0x + 40 位十六进制时原样返回"""
+    if not _HEX_ADDRESS.match(address):
+        return address
+    lower = address[2:].lower()
+    digest = keccak256(lower.encode('ascii')).hex()
+    return '0x' + ''.join(ch.upper() if int(digest[i], 16) >= 8 else ch for i, ch in enumerate(lower))
+
+
+def _alias_key(name: Any) -> str:
+    return ' '.join(str(name).lower().replace('_', ' ').replace('-', ' ').split())
+
+
+class ChainRegistry:
+    """链注册表: 别名 / chain_id → 链信息，启动时从 JSON 文件载入一次"""
+
+    def __init__(self, chains: List[Dict[str, Any]]):
+        self.chains = {chain['key']: chain for chain in chains}
+        self._aliases: Dict[str, Dict[str, Any]] = {}
+        for chain in chains:
+            names = [chain['key'], chain['name'], *chain.get('aliases', [])]
+            if chain.get('chain_id') is not None:
+                names.append(str(chain['chain_id']))
+            for name in names:
+                self._aliases[_alias_key(name)] = chain
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'ChainRegistry':
+        path = path or Config.CHAIN_REGISTRY_PATH or DEFAULT_REGISTRY_PATH
+        with open(path, 'r', encoding='utf-8') as f:
+            registry = cls(json.load(f))
+        logger.info("⛓️  已载入链注册表: %d 条链 (%s)", len(registry.chains), path)
+        return registry
+
+    def resolve(self, name: Any) -> Optional[Dict[str, Any]]:
+        if name in (None, ''):
+            return None
+        return self._aliases.get(_alias_key(name))
+
+
+class EventNormalizer:
+    """
+    Alpha 事件规范化: chain → 规范名 + chain_key / chain_id，地址 → 校验和格式，explorer → 按链模板生成
+
+    未登记的链保留原始写法和事件自带的 explorer (可能为空，推文中省略该行)，只记录一次警告。
+    """
+
+    def __init__(self, registry: ChainRegistry):
+        self.registry = registry
+        self._unknown = set()
+
+    @classmethod
+    def from_config(cls) -> Optional['EventNormalizer']:
+        if not Config.ENRICH_ENABLED:
+            return None
+        try:
+            return cls(ChainRegistry.load())
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("❌ 链注册表载入失败，跳过事件规范化: %s", e)
+            return None
+
+    def normalize(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """原地规范化并返回事件"""
+        chain = self.registry.resolve(event.get('chain'))
+        if chain is None:
+            raw = str(event.get('chain'))
+            if raw not in self._unknown:
+                self._unknown.add(raw)
+                logger.warning("⚠️  未登记的链: %r，请补充 %s", raw, Config.CHAIN_REGISTRY_PATH or DEFAULT_REGISTRY_PATH)
+            return event
+
+        event['chain'] = chain['name']
+        event['chain_key'] = chain['key']
+        if chain.get('chain_id') is not None:
+            event['chain_id'] = chain['chain_id']
+        if chain.get('evm'):
+            for field in ADDRESS_FIELDS:
+                value = event.get(field)
+                if isinstance(value, str) and value:
+                    event[field] = to_checksum_address(value.strip())
+        if event.get('contract') and chain.get('token_url'):
+            url = chain['token_url'].format(explorer=chain['explorer'], contract=event['contract'],
+                                            address=event.get('address', ''))
+            # 没有持有地址时去掉 ?a= 之类的查询参数
+            event['explorer'] = url if event.get('address') else url.partition('?')[0]
+        return event
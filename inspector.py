@@ -0,0 +1,212 @@
+# inspector.py - 队列积压分析
+# 分块 LRANGE 扫描 (或均匀抽样) 队列，只从每条消息中提取 type / queue_timestamp / severity，
+# 输出最老消息年龄、等待时间分位数、年龄直方图和按类型统计。每次 LRANGE 只取一块，
+# 百万级队列也不会长时间阻塞 Redis。
+
+import re
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+from collections import Counter
+from typing import Optional, Dict, Any, List, Tuple
+
+import redis
+
+from config import Config
+from log_setup import setup_logging
+from codec import MessageCodec, MAGIC
+
+logger = logging.getLogger(__name__)
+
+# 未转义的引号只会出现在键和值的边界上，消息正文中的同名文本不会被误匹配
+_STRING_FIELD = r'(?<!\\)"{}"\s*:\s*"((?:[^"\\]|\\.)*)"'
+_TYPE_RE = re.compile(_STRING_FIELD.format('type'))
+_SEVERITY_RE = re.compile(_STRING_FIELD.format('severity'))
+_TIMESTAMP_RE = re.compile(r'(?<!\\)"queue_timestamp"\s*:\s*(-?[0-9.eE+-]+)')
+
+# 年龄直方图的桶上界 (秒) 与标签
+AGE_BUCKETS = ((10, '<10s'), (60, '<1m'), (300, '<5m'), (900, '<15m'), (3600, '<1h'),
+               (6 * 3600, '<6h'), (24 * 3600, '<24h'), (math.inf, '>=24h'))
+# 计算分位数保留的年龄样本数 (蓄水池抽样)
+RESERVOIR_SIZE = 100000
+# 抽样模式下均匀分布在整个队列上的读取窗口数
+SAMPLE_WINDOWS = 100
+
+
+def _unescape(value: str) -> str:
+    return json.loads(f'"{value}"') if '\\' in value else value
+
+
+def extract_fields(raw: str) -> Tuple[str, Optional[float], Optional[str]]:
+    """只提取 (type, queue_timestamp, severity)，不解析整条 JSON"""
+    match = _TYPE_RE.search(raw)
+    event_type = _unescape(match.group(1)) if match else 'unknown'
+    match = _TIMESTAMP_RE.search(raw)
+    try:
+        queued_at = float(match.group(1)) if match else None
+    except ValueError:
+        queued_at = None
+    match = _SEVERITY_RE.search(raw)
+    severity = _unescape(match.group(1)) if match else None
+    return event_type, queued_at, severity
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class QueueInspector:
+    """
+    队列积压分析器
+
+    队列由 LPUSH 写入、从右端消费，索引 -1 是最老的消息。扫描期间队列仍在变化，
+    结果是近似快照；抽样模式下按类型统计会按 队列长度/样本数 放大。
+    """
+
+    def __init__(self, redis_client: redis.Redis, queue_name: Optional[str] = None,
+                 chunk_size: int = 1000, pause: float = 0.0):
+        self.redis_client = redis_client
+        self.queue_name = queue_name or Config.QUEUE_NAME
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.codec = MessageCodec(redis_client)
+
+    def _fields(self, raw: Any) -> Tuple[str, Optional[float], Optional[str]]:
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8', 'replace')
+        if not raw.startswith(MAGIC):
+            return extract_fields(raw)
+        # 紧凑编码的消息需要完整解码
+        try:
+            event = self.codec.decode(raw)
+        except ValueError:
+            return 'unknown', None, None
+        return event.get('type', 'unknown'), event.get('queue_timestamp'), event.get('severity')
+
+    def _windows(self, length: int, sample: Optional[int]) -> List[Tuple[int, int]]:
+        """要读取的 [start, end] 索引区间: 全量时顺序分块，抽样时在整个队列上均匀分布"""
+        if not sample or sample >= length:
+            return [(start, min(start + self.chunk_size, length) - 1)
+                    for start in range(0, length, self.chunk_size)]
+        count = max(min(SAMPLE_WINDOWS, sample), math.ceil(sample / self.chunk_size))
+        size = math.ceil(sample / count)
+        stride = length / count
+        return [(int(i * stride), min(int(i * stride) + size, length) - 1) for i in range(count)]
+
+    def scan(self, sample: Optional[int] = None) -> Dict[str, Any]:
+        """
+        扫描队列并汇总
+
+        Args:
+            sample: 最多读取的消息数，None 表示全量扫描
+        """
+        now = time.time()
+        length = self.redis_client.llen(self.queue_name)
+        oldest_raw = self.redis_client.lindex(self.queue_name, -1) if length else None
+
+        types: Counter = Counter()
+        severities: Counter = Counter()
+        histogram: Counter = Counter()
+        ages: List[float] = []
+        scanned = 0
+        aged = 0
+        started = time.perf_counter()
+        for start, end in self._windows(length, sample):
+            for raw in self.redis_client.lrange(self.queue_name, start, end):
+                event_type, queued_at, severity = self._fields(raw)
+                scanned += 1
+                types[event_type] += 1
+                if severity:
+                    severities[severity] += 1
+                if queued_at is None:
+                    continue
+                age = max(now - queued_at, 0.0)
+                aged += 1
+                histogram[next(label for bound, label in AGE_BUCKETS if age < bound)] += 1
+                if len(ages) < RESERVOIR_SIZE:
+                    ages.append(age)
+                else:
+                    slot = random.randrange(aged)
+                    if slot < RESERVOIR_SIZE:
+                        ages[slot] = age
+            if self.pause:
+                time.sleep(self.pause)
+
+        ages.sort()
+        scale = length / scanned if scanned else 0.0
+        oldest_at = self._fields(oldest_raw)[1] if oldest_raw else None
+        return {
+            'queue': self.queue_name,
+            'length': length,
+            'scanned': scanned,
+            'sampled': scanned < length,
+            'scan_seconds': round(time.perf_counter() - started, 3),
+            'oldest_age': round(now - oldest_at, 1) if oldest_at else None,
+            'age_p50': round(_percentile(ages, 0.50), 1),
+            'age_p90': round(_percentile(ages, 0.90), 1),
+            'age_p99': round(_percentile(ages, 0.99), 1),
+            'age_max': round(ages[-1], 1) if ages else 0.0,
+            'histogram': {label: round(histogram[label] * scale) for _, label in AGE_BUCKETS},
+            'types': {name: round(count * scale) for name, count in types.most_common()},
+            'severities': {name: round(count * scale) for name, count in severities.most_common()},
+            'missing_timestamp': round((scanned - aged) * scale),
+        }
+
+
+def format_report(result: Dict[str, Any]) -> str:
+    """把 scan() 结果格式化为终端报告"""
+    lines = [f"\n=== 队列积压: {result['queue']} ===",
+             f"队列长度: {result['length']} 条 (读取 {result['scanned']} 条"
+             f"{'，抽样估算' if result['sampled'] else ''}，耗时 {result['scan_seconds']}s)"]
+    if not result['length']:
+        return '\n'.join(lines)
+    oldest = result['oldest_age']
+    lines.append(f"最老消息: {'未知' if oldest is None else f'{oldest}s 前入队'}")
+    lines.append(f"等待时间: p50 {result['age_p50']}s / p90 {result['age_p90']}s / "
+                 f"p99 {result['age_p99']}s / max {result['age_max']}s")
+    lines.append("\n年龄分布:")
+    peak = max(result['histogram'].values()) or 1
+    for label, count in result['histogram'].items():
+        lines.append(f"  {label:>6} {count:>10} {'█' * math.ceil(count / peak * 40) if count else ''}")
+    if result['missing_timestamp']:
+        lines.append(f"  (无 queue_timestamp: {result['missing_timestamp']} 条)")
+    lines.append("\n按类型:")
+    for name, count in result['types'].items():
+        lines.append(f"  {name:<24} {count:>10} ({count / result['length']:.1%})")
+    if result['severities']:
+        lines.append("\n按严重程度:")
+        for name, count in result['severities'].items():
+            lines.append(f"  {name:<24} {count:>10}")
+    return '\n'.join(lines)
+
+
+def run_inspect(argv: List[str]) -> int:
+    """队列积压分析: python consumer_v2.py inspect [--sample 50000] [--queue 队列名]"""
+    parser = argparse.ArgumentParser(prog='consumer_v2.py inspect', description="队列积压与等待时间分析")
+    parser.add_argument('--queue', default=Config.QUEUE_NAME, help="要分析的队列 (也可以是 :deferred 等)")
+    parser.add_argument('--sample', type=int, default=None, help="最多读取的消息数，默认全量扫描")
+    parser.add_argument('--chunk', type=int, default=1000, help="每次 LRANGE 读取的条数")
+    parser.add_argument('--pause', type=float, default=0.0, help="每块之间的停顿 (秒)，进一步降低对 Redis 的影响")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出")
+    args = parser.parse_args(argv)
+
+    inspector = QueueInspector(redis.Redis(**Config.redis_kwargs()), args.queue,
+                               chunk_size=args.chunk, pause=args.pause)
+    try:
+        result = inspector.scan(sample=args.sample)
+    except redis.exceptions.ConnectionError as e:
+        logger.error("❌ 无法连接到 Redis: %s", e)
+        return 1
+    print(json.dumps(result, ensure_ascii=False, indent=2) if args.json else format_report(result))
+    return 0
+
+
+if __name__ == "__main__":
+    setup_logging()
+    sys.exit(run_inspect(sys.argv[1:]))
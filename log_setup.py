@@ -0,0 +1,101 @@
+# log_setup.py - 日志配置
+# 业务线程只把日志记录放入内存队列，由后台 QueueListener 线程负责格式化和写出，
+# 日志 I/O 不会阻塞消费/发送循环。各入口在 main() 中调用一次 setup_logging()。
+
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Optional
+
+from config import Config
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 每条消息的日志按此 logger 的级别控制，见 LOG_PER_MESSAGE
+MESSAGE_LOGGER = 'messages'
+
+_PER_MESSAGE_LEVELS = {
+    'full': logging.DEBUG,      # 逐条记录内容、链接等全部细节
+    'summary': logging.INFO,    # 每条消息一行结果
+    'off': logging.WARNING,     # 不记录逐条日志，只保留警告和错误
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    不在调用线程中格式化消息
+
+    标准 QueueHandler.prepare() 会在业务线程里完成 % 格式化；
+    这里只把异常信息转为文本 (traceback 不能跨线程保留)，其余格式化交给监听线程。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def message_logger(name: str) -> logging.Logger:
+    """获取逐条消息日志使用的 logger，例如 message_logger('consumer_v2')"""
+    return logging.getLogger(f"{MESSAGE_LOGGER}.{name}")
+
+
+def setup_logging(level: Optional[str] = None, json_format: Optional[bool] = None) -> None:
+    """
+    配置根 logger (重复调用无副作用)
+
+    Args:
+        level: 日志级别，默认 LOG_LEVEL
+        json_format: 是否输出 JSON，默认按 LOG_FORMAT=json
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter() if (Config.LOG_JSON if json_format is None else json_format) \
+        else logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if Config.LOG_FILE:
+        handlers.append(logging.FileHandler(Config.LOG_FILE, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(log_queue))
+    root_level = getattr(logging, (level or Config.LOG_LEVEL).upper())
+    root.setLevel(root_level)
+
+    # 逐条消息日志只能比 LOG_LEVEL 更少，不能更多
+    logging.getLogger(MESSAGE_LOGGER).setLevel(
+        max(_PER_MESSAGE_LEVELS.get(Config.LOG_PER_MESSAGE, logging.INFO), root_level)
+    )
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,207 @@
+# media.py - 推文图片上传
+# 在渲染阶段提前异步上传 (v1.1 分块上传)，发送推文时只取回 media_id；
+# media_id 按图片内容哈希缓存在 Redis 中，有效期内同一张图片不会重复上传。
+
+import io
+import os
+from urllib.parse import urlsplit
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from typing import Optional, Dict, Any, List, Tuple
+
+import redis
+
+from config import Config
+from profiler import propagate
+
+logger = logging.getLogger(__name__)
+
+# 一条推文最多 4 张图片
+MAX_MEDIA_PER_TWEET = 4
+# 比 Twitter 给出的过期时间提前失效，避免拿到即将过期的 media_id
+EXPIRY_MARGIN = 300
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def render_token_card(event: Dict[str, Any]) -> Optional[bytes]:
+    """用 Pillow 渲染代币信息卡片 (PNG)；未安装 Pillow 时返回 None"""
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        logger.warning("未安装 Pillow，跳过代币卡片渲染 (pip install Pillow)")
+        return None
+    image = Image.new('RGB', (800, 418), (24, 26, 32))
+    draw = ImageDraw.Draw(image)
+    lines = [
+        f"{event.get('name', 'Unknown')} ({event.get('symbol', '?')})",
+        str(event.get('chain', '')),
+        f"Amount: {event.get('amount', '')}",
+        str(event.get('contract', '')),
+    ]
+    for i, line in enumerate(lines):
+        draw.text((40, 60 + i * 70), line, fill=(240, 185, 11) if i == 0 else (230, 230, 230))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class MediaUploader:
+    """
+    异步图片上传器
+
+    prepare(event) 立即返回 Future，上传在线程池中进行；发送前 resolve() 取回 media_ids。
+    同一内容在 Redis 缓存命中或正在上传时直接复用。
+    """
+
+    def __init__(self, client, redis_client: redis.Redis, ttl: Optional[int] = None,
+                 workers: Optional[int] = None, additional_owners: Optional[List[str]] = None):
+        self.client = client
+        self.redis_client = redis_client
+        self.ttl = ttl or Config.MEDIA_CACHE_TTL
+        self.additional_owners = additional_owners or None
+        self._executor = ThreadPoolExecutor(max_workers=workers or Config.MEDIA_WORKERS,
+                                            thread_name_prefix='media-upload')
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {'uploaded': 0, 'cache_hits': 0, 'failed': 0}
+
+    @classmethod
+    def from_sinks(cls, sinks, redis_client: redis.Redis) -> Optional['MediaUploader']:
+        """MEDIA_ENABLED 且配置了 Twitter 输出时创建；多账号池时把其他账号加为 media 共同所有者"""
+        if not Config.MEDIA_ENABLED or sinks.twitter_client is None:
+            return None
+        pool = getattr(sinks.sinks.get('twitter'), 'pool', None)
+        owners = [a.client.user_id for a in pool.accounts[1:] if a.client.user_id] if pool else []
+        return cls(sinks.twitter_client, redis_client, additional_owners=owners)
+
+    def _cache_key(self, digest: str) -> str:
+        return f"media:{self.client.name}:{digest}"
+
+    def sources(self, event: Dict[str, Any]) -> List[Tuple[str, Any]]:
+        """事件需要附带的图片: event['media'] 中的本地路径 (MEDIA_DIR 下) / URL (MEDIA_URL_HOSTS)，以及可选的代币卡片"""
+        sources = [(str(item), item) for item in event.get('media') or []]
+        if Config.MEDIA_TOKEN_CARD and event.get('type') == 'alpha_new_token':
+            sources.append(('token_card.png', event))
+        return sources[:MAX_MEDIA_PER_TWEET]
+
+    def _local_path(self, source: str) -> str:
+        """media 来自队列消息，本地路径只允许 MEDIA_DIR 下的文件 (按 realpath 校验，防止 ../ 或符号链接越界)"""
+        if not Config.MEDIA_DIR:
+            raise ValueError("未配置 MEDIA_DIR，不读取本地文件")
+        root = os.path.realpath(Config.MEDIA_DIR)
+        path = os.path.realpath(os.path.join(root, source))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"路径不在 MEDIA_DIR 下: {source}")
+        return path
+
+    def _fetch(self, url: str) -> bytes:
+        """只下载 MEDIA_URL_HOSTS 中的域名，不跟随重定向，超过 MEDIA_MAX_BYTES 时中止"""
+        host = (urlsplit(url).hostname or '').lower()
+        allowed = {h.strip().lower() for h in Config.MEDIA_URL_HOSTS.split(',') if h.strip()}
+        if host not in allowed:
+            raise ValueError(f"图片域名不在 MEDIA_URL_HOSTS 中: {host or url}")
+        import requests
+        with requests.get(url, timeout=Config.MEDIA_UPLOAD_TIMEOUT, allow_redirects=False, stream=True) as response:
+            response.raise_for_status()
+            if response.is_redirect:
+                raise ValueError(f"图片 URL 发生重定向，已拒绝: {url}")
+            data = b''
+            for chunk in response.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > Config.MEDIA_MAX_BYTES:
+                    break
+        return data
+
+    def _load(self, source: Any) -> Optional[bytes]:
+        if isinstance(source, dict):
+            return render_token_card(source)
+        if str(source).startswith(('http://', 'https://')):
+            data = self._fetch(str(source))
+        else:
+            with open(self._local_path(str(source)), 'rb') as f:
+                data = f.read(Config.MEDIA_MAX_BYTES + 1)
+        if len(data) > Config.MEDIA_MAX_BYTES:
+            logger.warning("图片超过 %d 字节，已跳过: %s", Config.MEDIA_MAX_BYTES, source)
+            return None
+        return data
+
+    def upload(self, data: bytes, filename: str) -> Optional[str]:
+        """上传一张图片并返回 media_id，缓存命中时不发起请求"""
+        digest = content_hash(data)
+        key = self._cache_key(digest)
+        cached = self.redis_client.get(key)
+        if cached:
+            self.stats['cache_hits'] += 1
+            return cached
+
+        with self._lock:
+            inflight = self._inflight.get(digest)
+            owner = inflight is None
+            if owner:
+                inflight = self._inflight[digest] = Future()
+        if not owner:
+            # 相同图片正在由其他任务上传，等待其结果
+            self.stats['cache_hits'] += 1
+            return inflight.result(timeout=Config.MEDIA_UPLOAD_TIMEOUT)
+
+        media_id = None
+        try:
+            media = self.client.api.media_upload(
+                os.path.basename(filename) or 'image.png', file=io.BytesIO(data), chunked=True,
+                media_category='tweet_image', additional_owners=self.additional_owners
+            )
+            media_id = media.media_id_string
+            expires = getattr(media, 'expires_after_secs', None)
+            ttl = min(self.ttl, expires - EXPIRY_MARGIN) if expires else self.ttl
+            if ttl > 0:
+                self.redis_client.set(key, media_id, ex=int(ttl))
+            self.stats['uploaded'] += 1
+            return media_id
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.error("❌ 图片上传失败 (%s): %s", filename, e)
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(digest, None)
+            inflight.set_result(media_id)
+
+    def _upload_all(self, sources: List[Tuple[str, Any]]) -> List[str]:
+        media_ids = []
+        for filename, source in sources:
+            try:
+                data = self._load(source)
+            except Exception as e:
+                logger.error("❌ 加载图片失败 (%s): %s", filename, e)
+                continue
+            if data:
+                media_id = self.upload(data, filename)
+                if media_id:
+                    media_ids.append(media_id)
+        return media_ids
+
+    def prepare(self, event: Dict[str, Any]) -> Optional[Future]:
+        """开始为事件上传图片，没有图片时返回 None"""
+        sources = self.sources(event)
+        if not sources:
+            return None
+        return self._executor.submit(propagate(self._upload_all), sources)
+
+    def resolve(self, future: Optional[Future]) -> Dict[str, Any]:
+        """取回 media_ids 作为 send_tweet 的参数；上传失败或超时时不带图片发送"""
+        if future is None:
+            return {}
+        try:
+            media_ids = future.result(timeout=Config.MEDIA_UPLOAD_TIMEOUT)
+        except FutureTimeoutError:
+            logger.warning("⏰ 图片上传超时，推文将不带图片发送")
+            return {}
+        return {'media_ids': media_ids} if media_ids else {}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
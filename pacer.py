@@ -0,0 +1,262 @@
+# pacer.py - 发推节奏控制
+# 根据响应头中的 24 小时发推额度和接口速率限制，把剩余额度均匀分摊到重置前的时间里；
+# 发送成功时加性提速，遇到限流时乘性降速 (AIMD)。额度中预留一部分给高优先级事件
+# (Alpha、严重告警)，普通消息用完自己的份额或离发送时刻还远时暂存到 <QUEUE_NAME>:deferred，
+# 消费线程不会睡在普通消息上，不阻塞后面的告警。只路由到 webhook / 文件的事件不占用发推额度。
+
+import math
+import time
+import logging
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, List, Callable
+
+import redis
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+
+
+def _split(spec: str) -> List[str]:
+    return [item.strip() for item in spec.split(',') if item.strip()]
+
+
+class PostingPacer:
+    """
+    自适应发推节奏
+
+    间隔 = 重置前剩余时间 / 可用额度 / factor，factor 按 AIMD 调整：
+    每次成功 +PACER_INCREASE (不超过 PACER_MAX_BURST)，被限流时减半。
+    尚未收到额度响应头时 (或 dry-run) 按本地记录的 24 小时发送数和 TWEET_DAILY_LIMIT 估算。
+    """
+
+    def __init__(self, clients: Optional[List[Any]] = None, daily_limit: Optional[int] = None,
+                 reserve: Optional[float] = None, min_interval: Optional[float] = None,
+                 max_wait: Optional[float] = None, router=None):
+        self.clients = clients or []
+        self.router = router
+        self.daily_limit = daily_limit or Config.TWEET_DAILY_LIMIT * max(len(self.clients), 1)
+        self.reserve = Config.PACER_RESERVE if reserve is None else reserve
+        self.min_interval = Config.PACER_MIN_INTERVAL if min_interval is None else min_interval
+        self.max_wait = Config.PACER_MAX_WAIT if max_wait is None else max_wait
+        self.priority_types = set(_split(Config.PACER_PRIORITY_TYPES))
+        self.priority_severities = set(_split(Config.PACER_PRIORITY_SEVERITIES))
+        self.factor = 1.0
+        self.next_slot = 0.0     # 普通事件的下一个均摊时刻
+        self.last_slot = 0.0     # 最近一次预约的发送时刻 (所有事件)
+        self.sent_times: deque = deque()
+        self._last_rate_limited = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_sinks(cls, sinks) -> 'PostingPacer':
+        """从 SinkRouter 取得 Twitter 客户端 (多账号池时取全部账号)；没有 Twitter 输出时只做本地限速"""
+        sink = sinks.sinks.get('twitter')
+        if sink is None:
+            return cls()
+        pool = getattr(sink, 'pool', None)
+        return cls([a.client for a in pool.accounts] if pool else [sink.client], router=sinks)
+
+    def applies(self, event: Dict[str, Any]) -> bool:
+        """事件是否会发推；只路由到 webhook / 文件的事件不参与节奏控制，也不计入额度"""
+        return self.router is None or 'twitter' in self.router.sinks_for(event.get('type'))
+
+    def is_priority(self, event: Dict[str, Any]) -> bool:
+        return event.get('type') in self.priority_types or event.get('severity') in self.priority_severities
+
+    def _prune(self, now: float):
+        while self.sent_times and self.sent_times[0] <= now - DAY:
+            self.sent_times.popleft()
+
+    def quota(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """当前 24 小时额度: limit / remaining / reset (epoch 秒)，以及接口级的最早恢复时间"""
+        now = now or time.time()
+        self._prune(now)
+        snapshots = [client.quota_snapshot() for client in self.clients]
+        daily = [s['daily'] for s in snapshots if s['daily'] and s['daily']['reset'] > now]
+        if daily and len(daily) == len(snapshots):
+            limit = sum(q['limit'] for q in daily)
+            remaining = sum(q['remaining'] for q in daily)
+            reset = max(q['reset'] for q in daily)
+        else:
+            limit = self.daily_limit
+            remaining = max(limit - len(self.sent_times), 0)
+            reset = self.sent_times[0] + DAY if self.sent_times else now + DAY
+        # 所有账号的发推接口都已耗尽时，需等到其中最早恢复的那个
+        endpoints = [s['endpoint'] for s in snapshots]
+        endpoint_reset = 0.0
+        if endpoints and all(e and e['remaining'] <= 0 and e['reset'] > now for e in endpoints):
+            endpoint_reset = min(e['reset'] for e in endpoints)
+        rate_limited = max([s['last_rate_limited'] for s in snapshots] or [0.0])
+        return {'limit': limit, 'remaining': remaining, 'reset': reset,
+                'endpoint_reset': endpoint_reset, 'last_rate_limited': rate_limited}
+
+    def _usable(self, quota: Dict[str, Any], priority: bool) -> int:
+        if priority:
+            return quota['remaining']
+        return quota['remaining'] - math.ceil(quota['limit'] * self.reserve)
+
+    def can_send(self, event: Optional[Dict[str, Any]] = None) -> bool:
+        """普通事件 (event 为空) 或给定事件当前是否还有可用额度"""
+        if not self.clients:
+            return True
+        with self._lock:
+            return self._usable(self.quota(), bool(event) and self.is_priority(event)) > 0
+
+    def acquire(self, event: Dict[str, Any], max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        为事件预约一个发送时刻
+
+        Args:
+            max_wait: 普通事件的发送时刻在此秒数之后时不预约，返回 None
+
+        Returns:
+            需要等待的秒数；该事件当前没有可用额度或需等待超过 max_wait 时返回 None (应延后处理)
+        """
+        if not self.applies(event):
+            return 0.0
+        priority = self.is_priority(event)
+        with self._lock:
+            now = time.time()
+            earliest = max(now, self.last_slot + self.min_interval)
+            if not self.clients:
+                # 没有 Twitter 输出 (dry-run / 仅 webhook、文件) 时只保持最小间隔
+                self.last_slot = earliest
+                return earliest - now
+            quota = self.quota(now)
+            if quota['last_rate_limited'] > self._last_rate_limited:
+                # 乘性降速
+                self._last_rate_limited = quota['last_rate_limited']
+                self.factor = max(self.factor / 2, Config.PACER_MIN_FACTOR)
+                logger.warning("⚠️  触发速率限制，发送速率降为均摊速率的 %.2f 倍", self.factor)
+            usable = self._usable(quota, priority)
+            if usable <= 0:
+                return None
+            if priority:
+                # 高优先级事件不参与均摊，不排在普通事件之后，只受最小间隔和接口限流约束
+                slot = max(earliest, quota['endpoint_reset'])
+            else:
+                slot = max(earliest, self.next_slot, quota['endpoint_reset'])
+                if max_wait is not None and slot - now > max_wait:
+                    return None
+                self.next_slot = slot + (quota['reset'] - now) / usable / self.factor
+            self.last_slot = slot
+            return slot - now
+
+    def wait(self, event: Dict[str, Any], should_run: Callable[[], bool] = lambda: True,
+             block: bool = False) -> bool:
+        """
+        等待到事件的发送时刻；返回 False 表示应延后处理
+
+        普通事件最多等待 PACER_MAX_WAIT 秒，更远的发送时刻不在消费线程中睡眠等待。
+        block=True 时 (不能暂存的场景，如按键分区消费) 不设上限，额度用完时等到额度恢复。
+        等待期间 should_run() 变为 False (收到退出信号) 时同样返回 False，不在未到时刻时发出。
+        """
+        while True:
+            delay = self.acquire(event, max_wait=None if block else self.max_wait)
+            if delay is not None:
+                break
+            if not block or not should_run():
+                return False
+            time.sleep(1.0)
+        deadline = time.monotonic() + delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            if not should_run():
+                return False
+            time.sleep(min(remaining, 1.0))
+
+    def restorable(self) -> Optional[int]:
+        """
+        PACER_MAX_WAIT 内普通事件还能轮到的发送次数，即暂存消息本次最多放回的条数
+
+        超出这个数的消息放回后只会再次被暂存。没有 Twitter 输出时不限制，返回 None。
+        """
+        if not self.clients:
+            return None
+        with self._lock:
+            now = time.time()
+            quota = self.quota(now)
+            usable = self._usable(quota, False)
+            if usable <= 0:
+                return 0
+            slot = max(now, self.last_slot + self.min_interval, self.next_slot, quota['endpoint_reset'])
+            horizon = now + self.max_wait
+            if slot > horizon:
+                return 0
+            interval = max((quota['reset'] - now) / usable / self.factor, self.min_interval)
+            return min(usable, 1 + int((horizon - slot) / interval))
+
+    def record(self, success: bool, event: Optional[Dict[str, Any]] = None):
+        """记录发送结果: 成功时加性提速；没有发推的事件不计入"""
+        if event is not None and not self.applies(event):
+            return
+        with self._lock:
+            if success:
+                self.sent_times.append(time.time())
+                self.factor = min(self.factor + Config.PACER_INCREASE, Config.PACER_MAX_BURST)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            quota = self.quota()
+        return {**quota, 'factor': round(self.factor, 2), 'reserved': math.ceil(quota['limit'] * self.reserve)}
+
+
+class DeferredQueue:
+    """额度不足或未到发送时刻时暂存普通消息，轮到发送后按原顺序放回队列的消费端"""
+
+    def __init__(self, redis_client: redis.Redis, queue_name: Optional[str] = None, check_interval: float = 30):
+        self.redis_client = redis_client
+        self.queue_name = queue_name or Config.QUEUE_NAME
+        self.key = f"{self.queue_name}:deferred"
+        self.check_interval = check_interval
+        self._last_check = 0.0
+
+    def defer(self, raw: str):
+        self.redis_client.lpush(self.key, raw)
+
+    def _move(self, limit: Optional[int]) -> int:
+        """把最早的 limit 条 (None 为全部) 暂存消息原子地移到队首，保持原顺序"""
+        with self.redis_client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.key)
+                    items = pipe.lrange(self.key, 0 if limit is None else -limit, -1)
+                    if not items:
+                        pipe.unwatch()
+                        return 0
+                    pipe.multi()
+                    # 暂存列表左进，最右侧最早；RPUSH 按从新到旧的顺序推入，最早的落在队首最先被消费
+                    pipe.ltrim(self.key, 0, -len(items) - 1)
+                    pipe.rpush(self.queue_name, *items)
+                    pipe.execute()
+                    return len(items)
+                except redis.exceptions.WatchError:
+                    continue
+
+    def maybe_restore(self, pacer: PostingPacer) -> int:
+        """
+        按间隔检查：只把 PACER_MAX_WAIT 内能轮到发送的条数放回队首 (最早的最先被消费)
+
+        放回的消息会立即被消费并预约到这些时刻，不会反复暂存；它们排在已入队的高优先级事件之前，
+        但总共只占用 PACER_MAX_WAIT 秒。还有剩余时在 PACER_MAX_WAIT 后再次检查，而不是等满一个检查间隔。
+        """
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return 0
+        self._last_check = now
+        budget = pacer.restorable()
+        if budget == 0 or not self.redis_client.llen(self.key):
+            return 0
+        moved = self._move(budget)
+        remaining = self.redis_client.llen(self.key)
+        if remaining:
+            self._last_check = now - self.check_interval + min(pacer.max_wait, self.check_interval)
+        if moved:
+            logger.info("↩️  已轮到发送，%d 条暂存消息放回队列 (剩余 %d 条)", moved, remaining)
+        return moved
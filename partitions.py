@@ -0,0 +1,341 @@
+# partitions.py - 按键分区的有序并行消费
+# 路由器把主队列中的消息按 address / chain / service 哈希搬到 N 个分区队列；
+# 每个分区同一时刻只由一个持有租约的工作线程处理，同一键的消息严格按入队顺序处理，
+# 不同键在不同分区上并行。消费者实例加入或退出时按成员列表重新分配分区。
+
+import os
+import time
+import zlib
+import uuid
+import socket
+import logging
+import threading
+from typing import Optional, Dict, List, Callable, Any
+
+import redis
+
+from config import Config
+from prefetch import PrefetchingReader
+from codec import MessageCodec
+
+logger = logging.getLogger(__name__)
+
+# 处理函数返回 REQUEUE 表示这条消息现在不能处理 (例如退出时尚未轮到发送)：
+# 工作线程把它放回分区队列的原位置并停止，由下一个持有者按原顺序继续
+REQUEUE = object()
+
+
+def stopping() -> bool:
+    """在分区工作线程中调用: 本分区是否正在交出或退出"""
+    stop_event = getattr(threading.current_thread(), 'stop_event', None)
+    return stop_event is not None and stop_event.is_set()
+
+
+def parse_fields(spec: str) -> List[str]:
+    """解析分区键字段，例如 "address,chain,service" (按顺序取第一个存在的字段)"""
+    return [field.strip() for field in spec.split(',') if field.strip()]
+
+
+def partition_key(event: Any, fields: List[str]) -> str:
+    """事件的分区键；都不存在时退回到事件类型"""
+    if not isinstance(event, dict):
+        return ''
+    for field in fields:
+        value = event.get(field)
+        if value not in (None, ''):
+            # 地址大小写不敏感，统一小写后再哈希
+            return str(value).lower()
+    return str(event.get('type', ''))
+
+
+def partition_for(event: Any, partitions: int, fields: List[str]) -> int:
+    """稳定哈希 (crc32)，不同进程 / 重启之间结果一致"""
+    return zlib.crc32(partition_key(event, fields).encode('utf-8')) % partitions
+
+
+def partition_queue(queue_name: str, partition: int) -> str:
+    return f"{queue_name}:p{partition}"
+
+
+class Lease:
+    """基于 SET NX PX 的租约锁，续期和释放前先校验持有者 (WATCH/MULTI)"""
+
+    def __init__(self, redis_client: redis.Redis, key: str, owner: str, ttl: float):
+        self.redis_client = redis_client
+        self.key = key
+        self.owner = owner
+        self.ttl_ms = int(ttl * 1000)
+
+    def acquire(self) -> bool:
+        return bool(self.redis_client.set(self.key, self.owner, nx=True, px=self.ttl_ms))
+
+    def _if_owner(self, action: Callable) -> bool:
+        with self.redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(self.key)
+                if pipe.get(self.key) != self.owner:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                action(pipe)
+                pipe.execute()
+                return True
+            except redis.exceptions.WatchError:
+                return False
+
+    def renew(self) -> bool:
+        return self._if_owner(lambda pipe: pipe.pexpire(self.key, self.ttl_ms))
+
+    def release(self) -> bool:
+        return self._if_owner(lambda pipe: pipe.delete(self.key))
+
+
+class PartitionRouter(threading.Thread):
+    """
+    把主队列的消息按分区键搬到分区队列
+
+    先用 RPOPLPUSH 把消息原子地移入中转列表，再在一个 MULTI 事务里写入各分区并清空中转列表；
+    路由器进程崩溃时，中转列表中的消息由下一个获得路由租约的实例补发，不丢也不重复。
+    协调线程每次续租成功后更新 lease_until；租约即将过期 (例如协调线程卡住) 时路由器自行停止，
+    不会与新的路由租约持有者同时读写中转列表。
+    """
+
+    def __init__(self, redis_client: redis.Redis, queue_name: str, partitions: int, fields: List[str],
+                 batch_size: int = 100, block_timeout: int = 1):
+        super().__init__(name='partition-router', daemon=True)
+        self.redis_client = redis_client
+        self.queue_name = queue_name
+        self.partitions = partitions
+        self.fields = fields
+        self.batch_size = batch_size
+        self.block_timeout = block_timeout
+        self.routing_key = f"{queue_name}:partitions:routing"
+        self.stop_event = threading.Event()
+        self.lease_until = 0.0   # time.monotonic() 时间，由协调线程在续租成功后更新
+        self.routed = 0
+        self.codec = MessageCodec(redis_client)
+
+    def holds_lease(self) -> bool:
+        """租约在本轮操作 (最多阻塞 block_timeout 秒) 结束前仍然有效"""
+        return time.monotonic() + self.block_timeout + 1 < self.lease_until
+
+    def _flush(self, items: List[str]):
+        """items 按出队顺序 (最早在前)，写入分区并清空中转列表"""
+        grouped: Dict[int, List[str]] = {}
+        for raw in items:
+            try:
+                event = self.codec.decode(raw)
+            except ValueError:
+                event = None
+            grouped.setdefault(partition_for(event, self.partitions, self.fields), []).append(raw)
+        pipe = self.redis_client.pipeline(transaction=True)
+        for partition, raws in grouped.items():
+            pipe.lpush(partition_queue(self.queue_name, partition), *raws)
+        pipe.delete(self.routing_key)
+        pipe.execute()
+        self.routed += len(items)
+
+    def recover(self) -> int:
+        """补发上一个路由器遗留在中转列表中的消息"""
+        items = self.redis_client.lrange(self.routing_key, 0, -1)
+        if items:
+            # 中转列表左进，最右侧是最早的消息
+            self._flush(list(reversed(items)))
+            logger.info("↩️  已补发中转列表中的 %d 条消息", len(items))
+        return len(items)
+
+    def route_batch(self) -> int:
+        first = self.redis_client.brpoplpush(self.queue_name, self.routing_key, timeout=self.block_timeout)
+        if first is None:
+            return 0
+        pipe = self.redis_client.pipeline(transaction=False)
+        for _ in range(self.batch_size - 1):
+            pipe.rpoplpush(self.queue_name, self.routing_key)
+        items = [first] + [raw for raw in pipe.execute() if raw is not None]
+        self._flush(items)
+        return len(items)
+
+    def _running(self) -> bool:
+        if self.stop_event.is_set():
+            return False
+        if not self.holds_lease():
+            logger.warning("⚠️  路由租约已过期或即将过期，分区路由器停止")
+            self.stop_event.set()
+            return False
+        return True
+
+    def run(self):
+        logger.info("🔀 分区路由器已启动: %d 个分区，按 %s 分区", self.partitions, ','.join(self.fields))
+        while self._running():
+            try:
+                self.recover()
+                while self._running():
+                    self.route_batch()
+            except redis.exceptions.ConnectionError as e:
+                logger.error("❌ 分区路由器 Redis 连接异常: %s", e)
+                self.stop_event.wait(5)
+
+
+class PartitionWorker(threading.Thread):
+    """单个分区的工作线程，按顺序逐条处理"""
+
+    def __init__(self, redis_client: redis.Redis, queue_name: str, partition: int,
+                 handler: Callable[[str], Any], block_timeout: int = 1):
+        super().__init__(name=f"partition-{partition}", daemon=True)
+        self.partition = partition
+        self.handler = handler
+        self.stop_event = threading.Event()
+        # 分区内必须保持顺序，关闭"最新优先"
+        self.reader = PrefetchingReader(redis_client, partition_queue(queue_name, partition),
+                                        block_timeout=block_timeout, fresh_first_threshold=0)
+        self.processed = 0
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    raw = self.reader.get()
+                    if raw is None:
+                        continue
+                    if self.handler(raw) is REQUEUE:
+                        self.reader.unget(raw)
+                        break
+                    self.processed += 1
+                except redis.exceptions.ConnectionError as e:
+                    logger.error("❌ 分区 %d Redis 连接异常: %s", self.partition, e)
+                    time.sleep(5)
+                except Exception as e:
+                    logger.error("❌ 分区 %d 处理消息时发生错误: %s", self.partition, e)
+        finally:
+            # 先放回预取缓冲再释放租约，下一个持有者从同一位置继续
+            self.reader.requeue()
+
+
+class PartitionedConsumer:
+    """
+    分区消费协调器
+
+    每个实例定期在成员集合中心跳，按排序后的成员列表分配分区 (分区 i 归第 i % M 个成员)；
+    对分配到的分区获取租约并启动工作线程，不再属于自己的分区在当前消息处理完后交出。
+    路由器由恰好一个实例 (持有路由租约者) 运行。
+    """
+
+    def __init__(self, redis_client: redis.Redis, handler: Callable[[str], Any],
+                 queue_name: Optional[str] = None, partitions: Optional[int] = None,
+                 fields: Optional[List[str]] = None, lease_ttl: Optional[float] = None,
+                 heartbeat: Optional[float] = None, member_id: Optional[str] = None):
+        self.redis_client = redis_client
+        self.handler = handler
+        self.queue_name = queue_name or Config.QUEUE_NAME
+        self.partitions = partitions or Config.QUEUE_PARTITIONS
+        self.fields = fields or parse_fields(Config.PARTITION_KEYS)
+        self.lease_ttl = lease_ttl or Config.PARTITION_LEASE_TTL
+        self.heartbeat = heartbeat or Config.PARTITION_HEARTBEAT
+        self.member_id = member_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.members_key = f"{self.queue_name}:partitions:members"
+        self.workers: Dict[int, PartitionWorker] = {}
+        self.leases: Dict[int, Lease] = {}
+        self.router: Optional[PartitionRouter] = None
+        self.router_lease = Lease(redis_client, f"{self.queue_name}:partitions:router", self.member_id, self.lease_ttl)
+
+    def _members(self) -> List[str]:
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zadd(self.members_key, {self.member_id: now})
+        pipe.zremrangebyscore(self.members_key, '-inf', now - self.lease_ttl)
+        pipe.zrange(self.members_key, 0, -1)
+        return pipe.execute()[2]
+
+    def assigned(self, members: List[str]) -> List[int]:
+        members = sorted(members)
+        if self.member_id not in members:
+            return []
+        return [p for p in range(self.partitions) if members[p % len(members)] == self.member_id]
+
+    def _reap(self):
+        """回收已退出的工作线程并释放其租约"""
+        for partition, worker in list(self.workers.items()):
+            if not worker.is_alive():
+                self.leases.pop(partition).release()
+                del self.workers[partition]
+                logger.info("📤 已交出分区 %d (处理 %d 条)", partition, worker.processed)
+
+    def _tick(self):
+        wanted = set(self.assigned(self._members()))
+        self._reap()
+
+        for partition, worker in self.workers.items():
+            # 交出中的分区也继续续租，直到工作线程处理完当前消息退出、由 _reap 释放租约；
+            # 否则租约过期后新的持有者会与仍在处理的消息并行，破坏分区内顺序
+            if not self.leases[partition].renew():
+                logger.warning("⚠️  分区 %d 的租约已丢失，停止工作线程", partition)
+                worker.stop_event.set()
+            elif partition not in wanted:
+                worker.stop_event.set()
+
+        for partition in wanted - set(self.workers):
+            lease = Lease(self.redis_client, f"{partition_queue(self.queue_name, partition)}:owner",
+                          self.member_id, self.lease_ttl)
+            if not lease.acquire():
+                continue
+            worker = PartitionWorker(self.redis_client, self.queue_name, partition, self.handler)
+            self.leases[partition] = lease
+            self.workers[partition] = worker
+            worker.start()
+            logger.info("📥 已接管分区 %d", partition)
+
+        # 续租前记下时间，lease_until 不会晚于 Redis 中的实际过期时间
+        started = time.monotonic()
+        if self.router and self.router.is_alive():
+            if self.router_lease.renew():
+                self.router.lease_until = started + self.lease_ttl
+            else:
+                self.router.stop_event.set()
+        elif self.router_lease.acquire():
+            self.router = PartitionRouter(self.redis_client, self.queue_name, self.partitions, self.fields)
+            self.router.lease_until = started + self.lease_ttl
+            self.router.start()
+
+    def run(self, should_run: Callable[[], bool], on_tick: Optional[Callable[[], Any]] = None):
+        """协调循环，每个心跳周期调用一次 on_tick"""
+        logger.info("🧩 分区消费已启动: 成员 %s，共 %d 个分区", self.member_id, self.partitions)
+        try:
+            while should_run():
+                try:
+                    self._tick()
+                    if on_tick is not None:
+                        on_tick()
+                except redis.exceptions.ConnectionError as e:
+                    logger.error("❌ 分区协调 Redis 连接异常: %s", e)
+                time.sleep(self.heartbeat)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """停止所有工作线程和路由器，释放租约并退出成员集合"""
+        threads = list(self.workers.values()) + ([self.router] if self.router else [])
+        for thread in threads:
+            thread.stop_event.set()
+        for thread in threads:
+            thread.join()
+        try:
+            self._reap()
+            if self.router:
+                self.router_lease.release()
+            self.redis_client.zrem(self.members_key, self.member_id)
+        except redis.exceptions.ConnectionError as e:
+            logger.warning("释放分区租约失败，将在 %ss 后自动过期: %s", self.lease_ttl, e)
+
+    def depths(self) -> Dict[int, int]:
+        pipe = self.redis_client.pipeline(transaction=False)
+        for partition in range(self.partitions):
+            pipe.llen(partition_queue(self.queue_name, partition))
+        return dict(enumerate(pipe.execute()))
+
+    def stats(self) -> dict:
+        return {
+            'member': self.member_id,
+            'owned': sorted(self.workers),
+            'processed': {p: w.processed for p, w in self.workers.items()},
+            'routed': self.router.routed if self.router else 0,
+        }
@@ -0,0 +1,205 @@
+# pipeline.py - 分阶段消息处理流水线
+# decode → validate → enrich → render → send，阶段之间用有界队列连接，
+# 每个阶段有独立的工作线程数和指标；慢的 Twitter 调用只占满 send 阶段，
+# 上游阶段被有界队列反压，不会无限堆积。
+
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Any
+
+import redis
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+STAGE_NAMES = ('decode', 'validate', 'enrich', 'render', 'send')
+
+# 关闭时逐阶段下发的结束标记
+_STOP = object()
+
+
+def parse_workers(spec: str) -> Dict[str, int]:
+    """解析各阶段线程数，例如 "send=4,render=2"，未列出的阶段为 1"""
+    workers = {}
+    for part in spec.split(','):
+        name, _, count = part.partition('=')
+        if name.strip():
+            workers[name.strip()] = max(int(count or 1), 1)
+    return workers
+
+
+class Work:
+    """在阶段间传递的单条消息"""
+
+    __slots__ = ('raw', 'event', 'content', 'media', 'result', 'created')
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.event: Optional[Dict[str, Any]] = None
+        self.content: Optional[str] = None
+        self.media = None        # 图片上传的 Future，见 media.py
+        self.result: Optional[Dict[str, Any]] = None
+        self.created = time.monotonic()
+
+
+class Stage:
+    """
+    流水线阶段
+
+    func(work) 返回 True 时交给下一阶段，返回 False 表示丢弃 (过期、无效等)；
+    抛出异常计为错误并丢弃该消息。
+    """
+
+    def __init__(self, name: str, func: Callable[[Work], bool], workers: int = 1, queue_size: int = 100):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.inbox: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy = 0.0          # 处理耗时累计
+        self.blocked = 0.0       # 等待下游队列腾出空间的时间累计
+
+    def _record(self, passed: Optional[bool], busy: float, blocked: float = 0.0):
+        with self._lock:
+            self.processed += 1
+            self.busy += busy
+            self.blocked += blocked
+            if passed is None:
+                self.errors += 1
+            elif not passed:
+                self.dropped += 1
+
+    def stats(self, elapsed: float) -> Dict[str, Any]:
+        with self._lock:
+            processed, busy, blocked = self.processed, self.busy, self.blocked
+            dropped, errors = self.dropped, self.errors
+        capacity = elapsed * self.workers if elapsed > 0 else 0
+        return {
+            'workers': self.workers,
+            'queued': self.inbox.qsize(),
+            'processed': processed,
+            'dropped': dropped,
+            'errors': errors,
+            'avg_ms': round(busy / processed * 1000, 2) if processed else 0.0,
+            # 利用率接近 100% 且输入队列满的阶段就是瓶颈
+            'utilization': round(busy / capacity, 3) if capacity else 0.0,
+            'blocked_s': round(blocked, 2),
+        }
+
+
+class StagedPipeline:
+    """按顺序连接多个阶段，由一个源线程从 reader 取消息送入第一阶段"""
+
+    def __init__(self, stages: List[Stage], reader, name: str = 'pipeline'):
+        self.stages = stages
+        self.reader = reader
+        self.name = name
+        self.stop_event = threading.Event()
+        self.source: Optional[threading.Thread] = None
+        self.started = 0.0
+
+    @classmethod
+    def from_funcs(cls, funcs: Dict[str, Callable[[Work], bool]], reader, name: str = 'pipeline',
+                   workers: Optional[Dict[str, int]] = None, queue_size: Optional[int] = None) -> 'StagedPipeline':
+        """按 STAGE_NAMES 顺序构建，线程数和队列长度默认取 PIPELINE_WORKERS / PIPELINE_QUEUE_SIZE"""
+        workers = workers if workers is not None else parse_workers(Config.PIPELINE_WORKERS)
+        queue_size = queue_size or Config.PIPELINE_QUEUE_SIZE
+        stages = [Stage(stage_name, funcs[stage_name], workers.get(stage_name, 1), queue_size)
+                  for stage_name in STAGE_NAMES if stage_name in funcs]
+        return cls(stages, reader, name)
+
+    def _source_loop(self):
+        first = self.stages[0].inbox
+        while not self.stop_event.is_set():
+            try:
+                raw = self.reader.get()
+            except Exception as e:
+                logger.error("❌ 流水线读取队列失败: %s", e)
+                self.stop_event.wait(5)
+                continue
+            if raw is not None:
+                first.put(Work(raw))
+
+    def _worker_loop(self, stage: Stage, downstream: Optional[Stage]):
+        while True:
+            work = stage.inbox.get()
+            if work is _STOP:
+                return
+            started = time.perf_counter()
+            try:
+                passed = bool(stage.func(work))
+            except Exception as e:
+                logger.error("❌ 阶段 %s 处理失败: %s", stage.name, e)
+                stage._record(None, time.perf_counter() - started)
+                continue
+            busy = time.perf_counter() - started
+            blocked = 0.0
+            if passed and downstream is not None:
+                put_started = time.perf_counter()
+                downstream.inbox.put(work)
+                blocked = time.perf_counter() - put_started
+            stage._record(passed, busy, blocked)
+
+    def start(self):
+        self.started = time.monotonic()
+        for index, stage in enumerate(self.stages):
+            downstream = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            for i in range(stage.workers):
+                thread = threading.Thread(target=self._worker_loop, args=(stage, downstream),
+                                          name=f"{self.name}-{stage.name}-{i}", daemon=True)
+                thread.start()
+                stage.threads.append(thread)
+        self.source = threading.Thread(target=self._source_loop, name=f"{self.name}-source", daemon=True)
+        self.source.start()
+        logger.info("🏭 流水线已启动: %s",
+                    " → ".join(f"{stage.name}x{stage.workers}" for stage in self.stages))
+
+    def shutdown(self):
+        """停止取新消息，已进入流水线的消息逐阶段处理完后退出"""
+        self.stop_event.set()
+        if self.source is not None:
+            self.source.join()
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.inbox.put(_STOP)
+            for thread in stage.threads:
+                thread.join()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {stage.name: stage.stats(elapsed) for stage in self.stages}
+
+    def bottleneck(self) -> Optional[str]:
+        stats = self.stats()
+        if not stats:
+            return None
+        return max(stats, key=lambda name: stats[name]['utilization'])
+
+    def run(self, should_run: Callable[[], bool], stats_interval: Optional[float] = None,
+            on_tick: Optional[Callable[[], Any]] = None):
+        """在调用线程中运行直到 should_run() 为假，并定期输出各阶段指标；on_tick 每 0.5 秒调用一次"""
+        stats_interval = stats_interval or Config.PIPELINE_STATS_INTERVAL
+        self.start()
+        last_report = time.monotonic()
+        try:
+            while should_run():
+                time.sleep(0.5)
+                if on_tick is not None:
+                    try:
+                        on_tick()
+                    except redis.exceptions.RedisError as e:
+                        # Redis 短暂不可用时跳过本次，不中断流水线
+                        logger.error("❌ 流水线定时任务 Redis 异常: %s", e)
+                if time.monotonic() - last_report >= stats_interval:
+                    last_report = time.monotonic()
+                    logger.info("📊 流水线指标 (瓶颈: %s): %s", self.bottleneck(), self.stats())
+        finally:
+            self.shutdown()
+            logger.info("📊 流水线最终指标: %s", self.stats())
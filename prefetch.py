@@ -0,0 +1,213 @@
+# prefetch.py - 消费端批量预取
+# 一次往返取回最多 N 条消息放入有界本地缓冲，减少每条消息的 Redis 往返；
+# 关闭或异常时把缓冲中尚未处理的消息原样放回队列，保证不丢消息；Redis 不可用时落盘到
+# PREFETCH_DUMP_PATH，下次启动时由 replay_dump() 放回队列。
+# 积压超过阈值时可切换为"最新优先"，从队列头部 (LPUSH 端) 取消息。
+
+import os
+import json
+import time
+import logging
+from collections import deque
+from typing import Optional, List, Callable
+
+import redis
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _server_version(redis_client: redis.Redis) -> tuple:
+    try:
+        version = redis_client.info('server').get('redis_version', '0')
+        return tuple(int(p) for p in str(version).split('.')[:2])
+    except Exception:
+        return (0, 0)
+
+
+class PrefetchingReader:
+    """
+    带本地缓冲的队列读取器
+
+    - Redis >= 7.0: BLMPOP ... COUNT N，一次阻塞往返取回一批
+    - Redis >= 6.2: RPOP key N 取批，队列为空时退回 BRPOP 阻塞等待
+    - 更老版本: 退化为逐条 BRPOP
+
+    fresh_first_threshold > 0 时每隔 FRESH_CHECK_INTERVAL 秒检查一次队列长度，
+    积压超过阈值则从左端 (最新) 取消息，积压回落后恢复从右端 (最早) 取。
+    """
+
+    def __init__(self, redis_client: redis.Redis, queue_name: str, prefetch: Optional[int] = None,
+                 block_timeout: int = 30, fresh_first_threshold: Optional[int] = None):
+        self.redis_client = redis_client
+        self.queue_name = queue_name
+        self.prefetch = max(prefetch or Config.PREFETCH_COUNT, 1)
+        self.block_timeout = block_timeout
+        self.fresh_first_threshold = (Config.FRESH_FIRST_THRESHOLD if fresh_first_threshold is None
+                                      else fresh_first_threshold)
+        self.direction = 'RIGHT'
+        self._last_depth_check = 0.0
+        self.buffer = deque()
+        self.buffer_direction = 'RIGHT'
+        self.ops = 0
+        self.delivered = 0
+
+        version = _server_version(redis_client)
+        self.use_blmpop = self.prefetch > 1 and version >= (7, 0)
+        self.use_rpop_count = self.prefetch > 1 and version >= (6, 2)
+        if self.prefetch > 1 and not self.use_rpop_count:
+            logger.warning("Redis %s 不支持批量 RPOP，预取已关闭", '.'.join(map(str, version)))
+            self.prefetch = 1
+
+    def _update_direction(self):
+        """按积压情况决定从哪一端取消息，LLEN 检查按时间间隔摊销"""
+        if self.fresh_first_threshold <= 0:
+            return
+        now = time.monotonic()
+        if now - self._last_depth_check < Config.FRESH_CHECK_INTERVAL:
+            return
+        self._last_depth_check = now
+        self.ops += 1
+        depth = self.redis_client.llen(self.queue_name)
+        direction = 'LEFT' if depth > self.fresh_first_threshold else 'RIGHT'
+        if direction != self.direction:
+            logger.info("🔀 队列积压 %d 条，切换为%s优先", depth, "最新" if direction == 'LEFT' else "最早")
+            self.direction = direction
+
+    def _refill(self) -> bool:
+        """从 Redis 取回一批消息到本地缓冲，返回是否取到"""
+        self._update_direction()
+        self.buffer_direction = direction = self.direction
+        if self.use_blmpop:
+            self.ops += 1
+            result = self.redis_client.blmpop(self.block_timeout, 1, self.queue_name,
+                                              direction=direction, count=self.prefetch)
+            if result:
+                self.buffer.extend(result[1])
+            return bool(self.buffer)
+
+        if self.use_rpop_count:
+            self.ops += 1
+            pop = self.redis_client.lpop if direction == 'LEFT' else self.redis_client.rpop
+            items = pop(self.queue_name, self.prefetch)
+            if items:
+                self.buffer.extend(items)
+                return True
+
+        self.ops += 1
+        bpop = self.redis_client.blpop if direction == 'LEFT' else self.redis_client.brpop
+        result = bpop(self.queue_name, timeout=self.block_timeout)
+        if result:
+            self.buffer.append(result[1])
+        return bool(self.buffer)
+
+    def get(self) -> Optional[str]:
+        """取一条原始消息；超时无消息时返回 None"""
+        if not self.buffer and not self._refill():
+            return None
+        self.delivered += 1
+        return self.buffer.popleft()
+
+    def unget(self, raw: str):
+        """把刚取出的消息放回缓冲最前面，下次 get() / requeue() 时仍排在第一位"""
+        self.buffer.appendleft(raw)
+        self.delivered -= 1
+
+    def requeue(self) -> int:
+        """
+        把缓冲中未处理的消息放回它们被取出的那一端，保持原有顺序
+
+        Returns:
+            放回的消息数
+        """
+        if not self.buffer:
+            return 0
+        pending: List[str] = list(self.buffer)
+        for attempt in range(3):
+            try:
+                # 缓冲顺序即出队顺序，逆序推回后最先出队的消息仍在原来那一端
+                push = self.redis_client.lpush if self.buffer_direction == 'LEFT' else self.redis_client.rpush
+                push(self.queue_name, *reversed(pending))
+                self.ops += 1
+                self.buffer.clear()
+                logger.info("↩️  已将 %d 条预取消息放回队列", len(pending))
+                return len(pending)
+            except redis.exceptions.RedisError as e:
+                logger.error("放回预取消息失败 (第 %d 次): %s", attempt + 1, e)
+                time.sleep(1)
+
+        # Redis 不可用时落盘，避免进程退出后丢失；每行 [队列名, 取出的一端, 消息]，按出队顺序
+        with open(Config.PREFETCH_DUMP_PATH, 'a', encoding='utf-8') as f:
+            for raw in pending:
+                f.write(json.dumps([self.queue_name, self.buffer_direction, raw], ensure_ascii=False) + "\n")
+        logger.error("❌ 无法放回 Redis，%d 条预取消息已写入 %s", len(pending), Config.PREFETCH_DUMP_PATH)
+        self.buffer.clear()
+        return 0
+
+    def ops_per_message(self) -> float:
+        return self.ops / self.delivered if self.delivered else float(self.ops)
+
+    def stats(self) -> dict:
+        return {
+            'prefetch': self.prefetch,
+            'buffered': len(self.buffer),
+            'redis_ops': self.ops,
+            'delivered': self.delivered,
+            'ops_per_message': round(self.ops_per_message(), 3),
+        }
+
+
+def replay_dump(client_for: Callable[[str], redis.Redis], path: Optional[str] = None) -> int:
+    """
+    把上次退出时落盘的预取消息放回各自队列被取出的那一端 (启动时调用)
+
+    先把文件改名为本进程独占的副本，多个消费者同时启动也只会回放一次；
+    Redis 仍不可用时把未放回的消息追加回原文件，下次启动再试。
+
+    Returns:
+        放回的消息数
+    """
+    path = path or Config.PREFETCH_DUMP_PATH
+    if not path or not os.path.exists(path):
+        return 0
+    claimed = f"{path}.{os.getpid()}"
+    try:
+        os.replace(path, claimed)
+    except FileNotFoundError:
+        return 0
+    records = []
+    with open(claimed, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            try:
+                queue_name, direction, raw = json.loads(line)
+            except ValueError:
+                # 旧格式: 每行一条原始消息，来自主队列的消费端
+                queue_name, direction, raw = Config.QUEUE_NAME, 'RIGHT', line
+            records.append((queue_name, direction, raw))
+
+    restored = 0
+    try:
+        start = 0
+        for i in range(1, len(records) + 1):
+            if i < len(records) and records[i][:2] == records[start][:2]:
+                continue
+            queue_name, direction = records[start][:2]
+            client = client_for(queue_name)
+            push = client.lpush if direction == 'LEFT' else client.rpush
+            # 与 requeue 相同: 逆序推回，最先出队的消息仍在原来那一端
+            push(queue_name, *reversed([raw for _, _, raw in records[start:i]]))
+            restored = i
+            start = i
+    except redis.exceptions.RedisError as e:
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in records[restored:]:
+                f.write(json.dumps(list(record), ensure_ascii=False) + "\n")
+        logger.error("❌ 回放预取落盘消息失败，%d 条保留在 %s: %s", len(records) - restored, path, e)
+    os.remove(claimed)
+    if restored:
+        logger.info("↩️  已将上次落盘的 %d 条预取消息放回队列 (%s)", restored, path)
+    return restored
@@ -6,15 +6,13 @@ import json
 import time
 import random
 
+from config import Config
+from spool import Spool
+
 # 连接到本地 Redis 服务
 # decode_responses=True 确保我们从 Redis 获取的是字符串而不是字节
-try:
-    r = redis.Redis(decode_responses=True)
-    r.ping()
-    print("成功连接到 Redis！")
-except redis.exceptions.ConnectionError as e:
-    print(f"无法连接到 Redis，请确保 Redis 服务正在运行: {e}")
-    exit()
+# 创建客户端不会立即连接，导入本模块时不再因 Redis 不可用而退出
+r = redis.Redis(decode_responses=True)
 
 def monitor_service():
     """模拟一个监控服务，随机生成事件。"""
@@ -32,11 +30,24 @@ if __name__ == "__main__":
     # 模拟生成一个事件
     content_to_tweet = monitor_service()
     
-    # 将内容打包成 JSON 字符串推入名为 'tweet_queue' 的队列
-    # lpush 从列表左侧推入
-    r.lpush('tweet_queue', json.dumps(content_to_tweet))
+    payload = json.dumps(content_to_tweet)
+    spool = Spool(Config.SPOOL_PATH) if Config.SPOOL_PATH else None
     
-    print(f"消息已发送到队列: {content_to_tweet['message']}")
+    # spool 中还有未回放的消息时排在它们后面
+    if spool and spool.append_if_pending('tweet_queue', payload):
+        print(f"spool 中有待回放消息，本条已追加到 {Config.SPOOL_PATH}，运行 python spool.py 回放")
+    else:
+        try:
+            # 将内容打包成 JSON 字符串推入名为 'tweet_queue' 的队列
+            # lpush 从列表左侧推入
+            r.lpush('tweet_queue', payload)
+            print(f"消息已发送到队列: {content_to_tweet['message']}")
+        except redis.exceptions.ConnectionError as e:
+            print(f"无法连接到 Redis，请确保 Redis 服务正在运行: {e}")
+            if spool and spool.append('tweet_queue', payload):
+                print(f"消息已写入本地 spool {Config.SPOOL_PATH}，Redis 恢复后运行 python spool.py 回放")
+    if spool:
+        spool.close()
 
 # ===================================================================
 
@@ -0,0 +1,319 @@
+# producer_daemon.py - 常驻生产者服务
+# 通过本地 HTTP (或 unix socket) 接收告警，单条或批量均可；
+# 由连接池 + pipeline 写入器按批量大小/时间窗口微批写入 Redis 队列。
+
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import logging
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Tuple, Optional
+
+import redis
+
+from config import Config
+from log_setup import setup_logging
+from producer_v2 import build_queue_item
+from codec import MessageCodec
+from schema import validate_line
+from shards import connect, ShardMap
+from spool import Spool, SpoolDrainer
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """微批写入器：凑满 batch_size 条或等待 linger 毫秒后，一次 pipeline 写入"""
+
+    def __init__(self, queue_name: str = None, batch_size: int = None, linger_ms: float = None,
+                 max_pending: int = None, workers: int = None):
+        self.queue_name = queue_name or Config.QUEUE_NAME
+        self.batch_size = batch_size or Config.DAEMON_BATCH_SIZE
+        self.linger = (linger_ms if linger_ms is not None else Config.DAEMON_LINGER_MS) / 1000.0
+        self.workers = workers or Config.DAEMON_WRITERS
+        self.pending = queue.Queue(maxsize=max_pending or Config.DAEMON_MAX_PENDING)
+        if Config.REDIS_CLUSTER:
+            self.redis_client = connect()
+        else:
+            self.pool = redis.ConnectionPool(max_connections=self.workers + 1, **Config.redis_kwargs())
+            self.redis_client = redis.Redis(connection_pool=self.pool)
+        # QUEUE_SHARDS > 0 时与 producer_v2 一样按 chain / type 写入分片队列，每个节点一次 pipeline
+        self.shards = ShardMap.from_config(self.redis_client, self.queue_name) if Config.QUEUE_SHARDS > 0 else None
+        # 退出时 Redis 仍不可用，未写入的消息转存到 spool，下次启动时回放
+        self.spool = Spool(Config.SPOOL_PATH) if Config.SPOOL_PATH else None
+        self.running = False
+        self.deadline: Optional[float] = None   # stop() 设置，之后不再重试 Redis
+        self.threads = []
+        self.stats = {'accepted': 0, 'written': 0, 'batches': 0, 'errors': 0, 'spooled': 0, 'lost': 0}
+        self._stats_lock = threading.Lock()
+        # 检查余量和放入在同一把锁内完成，并发请求不会只放入半个批次
+        self._submit_lock = threading.Lock()
+
+    def start(self):
+        self.redis_client.ping()
+        if self.spool and self.spool.has_pending():
+            SpoolDrainer(self.spool, self.redis_client).ensure_running()
+        self.running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"batch-writer-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, items: List[Tuple[Dict[str, Any], str]]) -> bool:
+        """
+        非阻塞提交 (队列消息, 编码后的消息)；积压超过上限时返回 False (由调用方返回 503)
+
+        分片在提交时确定，积压中只保存 (分片, 消息)。
+        """
+        entries = [(self.shards.shard_for(item) if self.shards else None, payload) for item, payload in items]
+        with self._submit_lock:
+            # 写入线程只会取走消息，持锁期间余量不会变小
+            if self.pending.qsize() + len(entries) > self.pending.maxsize:
+                return False
+            for entry in entries:
+                self.pending.put_nowait(entry)
+        with self._stats_lock:
+            self.stats['accepted'] += len(items)
+        return True
+
+    def _collect(self) -> List[Tuple[Optional[int], str]]:
+        """阻塞等待第一条，然后在 linger 窗口内尽量凑满一个批次"""
+        try:
+            batch = [self.pending.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _group(self, batch: List[Tuple[Optional[int], str]]) -> Dict[Optional[str], Tuple[redis.Redis, Dict[str, List[str]]]]:
+        """按节点分组: {节点: (客户端, {队列: [消息]})}，队列内保持提交顺序"""
+        if self.shards is None:
+            return {None: (self.redis_client, {self.queue_name: [payload for _, payload in batch]})}
+        return {node: (self.shards.clients[node], queues) for node, queues in self.shards.by_node(batch).items()}
+
+    def _past_deadline(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def _spill(self, payloads: List[str]):
+        """
+        把未能写入的消息转存到 spool，未配置 SPOOL_PATH (或 spool 已满) 时记为丢失
+
+        回放写入未分片的主队列，分片消费者同样会读取。
+        """
+        saved = sum(1 for payload in payloads if self.spool and self.spool.append(self.queue_name, payload))
+        with self._stats_lock:
+            self.stats['spooled'] += saved
+            self.stats['lost'] += len(payloads) - saved
+        if saved:
+            logger.warning("💾 Redis 仍不可用，%d 条消息已转存到 %s，下次启动时回放", saved, self.spool.path)
+        if len(payloads) > saved:
+            logger.error("❌ Redis 仍不可用，%d 条消息未能写入或转存，已丢失", len(payloads) - saved)
+
+    def _write(self, batch: List[Tuple[Optional[int], str]]):
+        """
+        写入一个批次，每个节点一次 pipeline；Redis 不可用时只重试失败的节点，批次不会丢弃
+
+        stop() 设置的期限过后不再重试，剩余消息转存到 spool。
+        """
+        groups = self._group(batch)
+        delay = 0.5
+        while True:
+            if self._past_deadline():
+                self._spill([payload for _, queues in groups.values()
+                             for payloads in queues.values() for payload in payloads])
+                return
+            for node, (client, queues) in list(groups.items()):
+                try:
+                    pipe = client.pipeline(transaction=False)
+                    for queue_name, payloads in queues.items():
+                        pipe.lpush(queue_name, *payloads)
+                    pipe.execute()
+                except redis.exceptions.RedisError as e:
+                    # 连接中断、超时、OOM、加载中等都只是暂时的，写入线程不能因此退出
+                    with self._stats_lock:
+                        self.stats['errors'] += 1
+                    logger.error("❌ 批量写入 Redis 失败%s，%.1fs 后重试: %s", f" ({node})" if node else '', delay, e)
+                    continue
+                del groups[node]
+                with self._stats_lock:
+                    self.stats['written'] += sum(len(payloads) for payloads in queues.values())
+            if not groups:
+                with self._stats_lock:
+                    self.stats['batches'] += 1
+                return
+            # 退避不越过 stop() 的期限
+            time.sleep(delay if self.deadline is None else max(min(delay, self.deadline - time.monotonic()), 0))
+            delay = min(delay * 2, 10)
+
+    def _loop(self):
+        while self.running or not self.pending.empty():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        停止接收并写完所有积压消息
+
+        最多等待 timeout (DAEMON_STOP_TIMEOUT) 秒；到期后 Redis 仍不可用时，未写入的批次转存到 spool 后返回。
+        """
+        timeout = Config.DAEMON_STOP_TIMEOUT if timeout is None else timeout
+        self.deadline = time.monotonic() + timeout
+        self.running = False
+        for t in self.threads:
+            # 写入线程到期后只做本地转存，多留几秒给它们收尾
+            t.join(max(self.deadline + 5 - time.monotonic(), 0))
+        stuck = sum(1 for t in self.threads if t.is_alive())
+        leftover = []
+        while True:
+            try:
+                leftover.append(self.pending.get_nowait()[1])
+            except queue.Empty:
+                break
+        if leftover:
+            self._spill(leftover)
+        if stuck:
+            logger.error("❌ %d 个写入线程仍阻塞在 Redis 调用中，其当前批次可能丢失", stuck)
+        if self.spool:
+            self.spool.close()
+
+    def status(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {**self.stats, 'pending': self.pending.qsize(), 'queue_name': self.queue_name}
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    """
+    POST /events  body 为单个事件对象、事件数组，或 NDJSON (每行一个事件)
+    GET  /health  返回写入器状态
+    """
+
+    writer: BatchWriter = None
+    codec: MessageCodec = None
+    protocol_version = 'HTTP/1.1'
+    # 缓冲写出，响应头和响应体合并为一次发送，避免 keep-alive 下的 Nagle 延迟
+    wbufsize = -1
+
+    def address_string(self):
+        # unix socket 下 client_address 不是 (host, port)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _reply(self, status: int, body: Dict[str, Any]):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok', **self.writer.status()})
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/events':
+            self._reply(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._reply(400, {'error': '无效的 Content-Length'})
+            return
+        body = self.rfile.read(length)
+        try:
+            if 'ndjson' in self.headers.get('Content-Type', ''):
+                events = [json.loads(line) for line in body.splitlines() if line.strip()]
+            else:
+                events = json.loads(body)
+                if not isinstance(events, list):
+                    events = [events]
+        except ValueError as e:
+            self._reply(400, {'error': f"JSON 解析失败: {e}"})
+            return
+
+        items, rejected = [], []
+        for i, event in enumerate(events):
+            error = validate_line(event)
+            if error:
+                rejected.append({'index': i, 'error': error})
+            else:
+                item = build_queue_item(event)
+                items.append((item, self.codec.encode(item)))
+
+        if items and not self.writer.submit(items):
+            self._reply(503, {'error': '写入积压已满，请稍后重试', 'pending': self.writer.pending.qsize()})
+            return
+        self._reply(202 if items else 400, {'accepted': len(items), 'rejected': rejected})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(writer: BatchWriter):
+    """启动 HTTP / unix socket 服务，阻塞直到收到退出信号"""
+    IngestHandler.writer = writer
+    IngestHandler.codec = MessageCodec(writer.redis_client)
+    servers = []
+    if Config.PRODUCER_UNIX_SOCKET:
+        if os.path.exists(Config.PRODUCER_UNIX_SOCKET):
+            os.remove(Config.PRODUCER_UNIX_SOCKET)
+        servers.append(UnixHTTPServer(Config.PRODUCER_UNIX_SOCKET, IngestHandler))
+        logger.info("📡 监听 unix socket: %s", Config.PRODUCER_UNIX_SOCKET)
+    if Config.PRODUCER_HTTP_PORT:
+        servers.append(ThreadingHTTPServer((Config.PRODUCER_HTTP_HOST, Config.PRODUCER_HTTP_PORT), IngestHandler))
+        logger.info("📡 监听 http://%s:%s/events", Config.PRODUCER_HTTP_HOST, Config.PRODUCER_HTTP_PORT)
+
+    threads = [threading.Thread(target=s.serve_forever, daemon=True) for s in servers]
+    for t in threads:
+        t.start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    while not stop.wait(60):
+        logger.info("📊 写入器状态: %s", writer.status())
+
+    logger.info("🛑 正在关闭，写入剩余积压...")
+    for s in servers:
+        s.shutdown()
+        s.server_close()
+    if Config.PRODUCER_UNIX_SOCKET and os.path.exists(Config.PRODUCER_UNIX_SOCKET):
+        os.remove(Config.PRODUCER_UNIX_SOCKET)
+    writer.stop()
+    logger.info("🔚 生产者服务已停止: %s", writer.status())
+
+
+def main():
+    setup_logging()
+    try:
+        writer = BatchWriter()
+        writer.start()
+    except redis.exceptions.ConnectionError as e:
+        logger.error("❌ 无法连接到 Redis: %s", e)
+        return 1
+    serve(writer)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,45 +1,66 @@
 # producer_v2.py - 监控服务和内容生成器
 # 这个程序负责生成内容并将其发送到队列中。
 
+import sys
 import redis
 import json
 import time
 import random
 import logging
+import argparse
+import threading
 from datetime import datetime
+from typing import Dict, List, Iterator, Optional
 from config import Config
+from log_setup import setup_logging, message_logger
+from spool import Spool, SpoolDrainer
+from codec import MessageCodec
+from shards import connect, ShardMap
+from replies import ReplyListener, new_request_id
 
-# 配置日志
-logging.basicConfig(
-    level=getattr(logging, Config.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
+msg_logger = message_logger(__name__)
+
+def build_queue_item(event: dict, seq: Optional[int] = None) -> dict:
+    """为事件添加队列元数据 (queue_timestamp / queue_id)；批量生成时用 seq 区分同一毫秒内的消息"""
+    now = time.time()
+    queue_id = f"msg_{int(now * 1000)}"
+    return {
+        **event,
+        "queue_timestamp": now,
+        "queue_id": queue_id if seq is None else f"{queue_id}_{seq}"
+    }
 
 class TweetProducer:
     """推文生产者类"""
     
     def __init__(self):
         """初始化生产者"""
+        self.redis_client = connect()
+        # QUEUE_SHARDS > 0 时按 chain / type 写入分片队列，见 shards.py
+        self.shards = ShardMap.from_config(self.redis_client) if Config.QUEUE_SHARDS > 0 else None
+        # QUEUE_ENCODING=compact 时写入紧凑编码，见 codec.py
+        self.codec = MessageCodec(self.redis_client)
+        # Redis 不可用时的本地 spool，见 spool.py
+        self.spool = Spool(Config.SPOOL_PATH) if Config.SPOOL_PATH else None
+        self.drainer = SpoolDrainer(self.spool, self.redis_client) if self.spool else None
+        # send_and_wait 的回复订阅，第一次调用时才建立
+        self.replies: Optional[ReplyListener] = None
+        self._replies_lock = threading.Lock()
         try:
             # 连接到Redis
-            redis_config = {
-                'host': Config.REDIS_HOST,
-                'port': Config.REDIS_PORT,
-                'db': Config.REDIS_DB,
-                'decode_responses': True
-            }
-            
-            if Config.REDIS_PASSWORD:
-                redis_config['password'] = Config.REDIS_PASSWORD
-            
-            self.redis_client = redis.Redis(**redis_config)
             self.redis_client.ping()
-            logger.info(f"成功连接到 Redis: {Config.REDIS_HOST}:{Config.REDIS_PORT}")
+            logger.info("成功连接到 Redis: %s:%s", Config.REDIS_HOST, Config.REDIS_PORT)
             
         except redis.exceptions.ConnectionError as e:
-            logger.error(f"无法连接到 Redis: {e}")
-            raise
+            if self.spool is None:
+                logger.error("无法连接到 Redis: %s", e)
+                raise
+            logger.warning("⚠️  无法连接到 Redis，消息将先写入本地 spool %s: %s", Config.SPOOL_PATH, e)
+        
+        # 上次运行遗留的消息先回放
+        if self.spool and self.spool.has_pending():
+            self.drainer.ensure_running()
     
     def generate_monitoring_alert(self) -> dict:
         """生成监控告警事件"""
@@ -124,12 +145,41 @@ class TweetProducer:
         }
         return event
     
+    def generate_alpha_token(self) -> dict:
+        """生成 Alpha 新代币事件 (字段与 alpha.json 一致)"""
+        chains = [
+            ("BNB Smart Chain Mainnet", "https://bscscan.com"),
+            ("Ethereum Mainnet", "https://etherscan.io"),
+            ("Base Mainnet", "https://basescan.org"),
+        ]
+        tokens = [("Sidekick", "K"), ("Moonbag", "MOON"), ("Alpha Cat", "ACAT"), ("Degen Pepe", "DPEPE")]
+        
+        chain, explorer = random.choice(chains)
+        name, symbol = random.choice(tokens)
+        address = "0x" + "".join(random.choice("0123456789abcdef") for _ in range(40))
+        contract = "0x" + "".join(random.choice("0123456789abcdef") for _ in range(40))
+        timestamp = datetime.now()
+        
+        event = {
+            "type": "alpha_new_token",
+            "chain": chain,
+            "address": address,
+            "name": name,
+            "symbol": symbol,
+            "amount": random.choice([1000000, 10000000, 250000000]),
+            "contract": contract,
+            "explorer": f"{explorer}/token/{contract}?a={address}",
+            "threshold": 1000000,
+            "detected_at": timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        return event
+    
     def generate_event(self, event_type: str = None) -> dict:
         """
         根据类型生成事件
         
         Args:
-            event_type: 事件类型 ('alert', 'business', 'scheduled', None为随机)
+            event_type: 事件类型 ('alert', 'business', 'scheduled', 'alpha', None为随机)
         """
         if event_type is None:
             event_type = random.choice(['alert', 'business', 'scheduled'])
@@ -140,6 +190,8 @@ class TweetProducer:
             return self.generate_business_update()
         elif event_type == 'scheduled':
             return self.generate_scheduled_content()
+        elif event_type == 'alpha':
+            return self.generate_alpha_token()
         else:
             return self.generate_monitoring_alert()
     
@@ -155,27 +207,85 @@ class TweetProducer:
         """
         try:
             # 添加队列元数据
-            queue_item = {
-                **event,
-                "queue_timestamp": time.time(),
-                "queue_id": f"msg_{int(time.time() * 1000)}"
-            }
+            queue_item = build_queue_item(event)
+            payload = self.codec.encode(queue_item)
+            
+            # spool 中还有未回放的消息时排在它们后面，保持顺序
+            # (spool 回放到未分片的主队列，分片消费者同样会读取)
+            if self.spool:
+                spooled = self.spool.append_if_pending(Config.QUEUE_NAME, payload)
+                if spooled is not None:
+                    self.drainer.ensure_running()
+                    return spooled
             
             # 推送到队列
-            result = self.redis_client.lpush(Config.QUEUE_NAME, json.dumps(queue_item, ensure_ascii=False))
+            try:
+                if self.shards:
+                    result = self.shards.push(queue_item, payload)
+                else:
+                    result = self.redis_client.lpush(Config.QUEUE_NAME, payload)
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+                if self.spool is None:
+                    raise
+                logger.warning("⚠️  Redis 不可用，%s 消息已写入本地 spool: %s", event.get('type'), e)
+                spooled = self.spool.append(Config.QUEUE_NAME, payload)
+                self.drainer.ensure_running()
+                return spooled
             
             if result:
-                logger.info(f"✅ 消息已发送到队列 '{Config.QUEUE_NAME}': {event['message'][:100]}...")
-                logger.debug(f"完整事件数据: {queue_item}")
+                msg_logger.info("✅ %s 消息已发送到队列 '%s'", event.get('type'), Config.QUEUE_NAME)
+                msg_logger.debug("完整事件数据: %s", queue_item)
                 return True
             else:
                 logger.error("❌ 发送消息到队列失败")
                 return False
                 
         except Exception as e:
-            logger.error(f"❌ 发送消息到队列时发生错误: {e}")
+            logger.error("❌ 发送消息到队列时发生错误: %s", e)
             return False
     
+    def _reply_listener(self) -> ReplyListener:
+        with self._replies_lock:
+            if self.replies is None:
+                self.replies = ReplyListener(self.redis_client)
+                self.replies.start()
+                # 先订阅再发送，避免回复早于订阅到达 (订阅失败时仍可按 TTL 键补查)
+                self.replies.subscribed.wait(5)
+            return self.replies
+    
+    def send_and_wait(self, event: dict, timeout: float = 30.0) -> Optional[dict]:
+        """
+        发送事件并等待消费者回报处理结果
+        
+        Args:
+            event: 事件字典
+            timeout: 最长等待秒数
+            
+        Returns:
+            {'request_id', 'status', 'success', 'tweet_id', 'tweet_url', 'error'}，
+            status 为 sent / failed / unknown / deferred / expired / digested / invalid；发送失败或超时返回 None
+        """
+        listener = self._reply_listener()
+        request_id = new_request_id()
+        waiter = listener.register(request_id)
+        if not self.send_to_queue({**event, 'reply_to': listener.channel, 'request_id': request_id}):
+            listener.unregister(request_id)
+            return None
+        reply = listener.wait(request_id, waiter, timeout)
+        if reply is None:
+            logger.warning("⏰ 等待 %s 消息处理结果超时 (%gs)", event.get('type'), timeout)
+        return reply
+    
+    def close(self, timeout: float = 5.0):
+        """退出前尽量回放 spool，未回放完的消息保留在本地文件中，下次启动继续"""
+        if self.replies is not None:
+            self.replies.close()
+        if self.spool is None:
+            return
+        if self.spool.has_pending() and not self.drainer.wait(timeout):
+            logger.warning("💾 spool 中仍有 %d 字节未写回 Redis，将在下次启动时回放", self.spool.pending_bytes)
+        self.spool.close()
+    
     def get_queue_status(self) -> dict:
         """获取队列状态"""
         try:
@@ -187,7 +297,7 @@ class TweetProducer:
                 'timestamp': time.time()
             }
         except Exception as e:
-            logger.error(f"获取队列状态失败: {e}")
+            logger.error("获取队列状态失败: %s", e)
             return {
                 'queue_name': Config.QUEUE_NAME,
                 'queue_length': -1,
@@ -216,22 +326,165 @@ class TweetProducer:
                     success_count += 1
                     time.sleep(0.5)  # 避免过快发送
                 else:
-                    logger.warning(f"第 {i+1} 条消息发送失败")
+                    logger.warning("第 %s 条消息发送失败", i+1)
             except Exception as e:
-                logger.error(f"生成第 {i+1} 条消息时发生错误: {e}")
+                logger.error("生成第 %s 条消息时发生错误: %s", i+1, e)
         
-        logger.info(f"📊 批量生成完成: {success_count}/{count} 条消息发送成功")
+        logger.info("📊 批量生成完成: %s/%s 条消息发送成功", success_count, count)
         return success_count
 
 
+def parse_mix(spec: str) -> Dict[str, float]:
+    """解析事件类型配比，例如 alert=5,business=2,scheduled=1,alpha=2"""
+    mix = {}
+    for part in spec.split(','):
+        event_type, _, weight = part.partition('=')
+        if event_type.strip():
+            mix[event_type.strip()] = float(weight or 1)
+    return mix
+
+
+class LoadGenerator:
+    """
+    开环负载生成器
+    
+    按到达过程预先排定每条消息的发送时刻，发送速度不受 Redis 响应快慢影响 (开环)；
+    落后于计划时一次 pipeline 补发所有已到期的消息，并记录相对计划的滞后。
+    事件从预先生成并序列化好的事件池中轮转取出，只在发送时拼接队列元数据。
+    """
+    
+    ARRIVALS = ('constant', 'poisson', 'bursty')
+    
+    def __init__(self, producer: TweetProducer, rate: float, duration: float, mix: Dict[str, float],
+                 arrival: str = 'poisson', pool_size: int = 10000, batch_max: int = 1000,
+                 burst_factor: float = 5.0, burst_period: float = 10.0, queue_name: str = None):
+        if arrival not in self.ARRIVALS:
+            raise ValueError(f"未知的到达过程: {arrival}")
+        self.producer = producer
+        self.rate = rate
+        self.duration = duration
+        self.arrival = arrival
+        self.batch_max = batch_max
+        self.burst_factor = burst_factor
+        self.burst_period = burst_period
+        self.queue_name = queue_name or Config.QUEUE_NAME
+        self.pool = self._build_pool(mix, pool_size)
+    
+    def _build_pool(self, mix: Dict[str, float], size: int) -> List[str]:
+        """预生成事件池：序列化后去掉末尾的 '}'，发送时直接拼接元数据"""
+        types, weights = list(mix), list(mix.values())
+        pool = []
+        for event_type in random.choices(types, weights=weights, k=size):
+            serialized = json.dumps(self.producer.generate_event(event_type), ensure_ascii=False)
+            pool.append(serialized[:-1])
+        return pool
+    
+    def _arrivals(self) -> Iterator[float]:
+        """生成相对开始时刻的计划发送时间"""
+        t = 0.0
+        while t < self.duration:
+            yield t
+            if self.arrival == 'constant':
+                t += 1.0 / self.rate
+            elif self.arrival == 'poisson':
+                t += random.expovariate(self.rate)
+            else:
+                # 突发: 每个周期前 1/burst_factor 时间内以 burst_factor 倍速率到达，其余时间静默，平均速率不变
+                in_burst = (t % self.burst_period) < self.burst_period / self.burst_factor
+                if in_burst:
+                    t += random.expovariate(self.rate * self.burst_factor)
+                else:
+                    t = (t // self.burst_period + 1) * self.burst_period
+    
+    def run(self) -> Dict[str, float]:
+        """运行负载并返回目标/实际速率和滞后统计"""
+        redis_client = self.producer.redis_client
+        pool, pool_len = self.pool, len(self.pool)
+        lags = []
+        sent = 0
+        batch = []
+        started_wall = time.time()
+        started = time.perf_counter()
+        
+        for scheduled in self._arrivals():
+            now = time.perf_counter() - started
+            if scheduled > now and batch:
+                redis_client.lpush(self.queue_name, *batch)
+                lags.append(now - first_scheduled)
+                sent += len(batch)
+                batch = []
+                now = time.perf_counter() - started
+            if scheduled > now:
+                time.sleep(scheduled - now)
+            if not batch:
+                first_scheduled = scheduled
+            seq = sent + len(batch)
+            batch.append(f'{pool[seq % pool_len]}, "queue_timestamp": {started_wall + scheduled}, '
+                         f'"queue_id": "load_{seq}"}}')
+            if len(batch) >= self.batch_max:
+                redis_client.lpush(self.queue_name, *batch)
+                lags.append(time.perf_counter() - started - first_scheduled)
+                sent += len(batch)
+                batch = []
+        if batch:
+            redis_client.lpush(self.queue_name, *batch)
+            lags.append(time.perf_counter() - started - first_scheduled)
+            sent += len(batch)
+        
+        # 末尾可能处于突发间的静默期，按完整时长计算实际速率
+        elapsed = max(time.perf_counter() - started, self.duration)
+        lags.sort()
+        return {
+            'arrival': self.arrival,
+            'target_rate': self.rate,
+            'achieved_rate': sent / elapsed if elapsed else 0.0,
+            'sent': sent,
+            'elapsed': elapsed,
+            'batches': len(lags),
+            'lag_p50_ms': lags[len(lags) // 2] * 1000 if lags else 0.0,
+            'lag_p99_ms': lags[int(len(lags) * 0.99)] * 1000 if lags else 0.0,
+            'lag_max_ms': lags[-1] * 1000 if lags else 0.0,
+        }
+
+
+def run_load(argv: List[str]) -> int:
+    """负载生成模式: python producer_v2.py load --rate 20000 --duration 30 --arrival poisson"""
+    parser = argparse.ArgumentParser(prog='producer_v2.py load', description="开环合成负载生成")
+    parser.add_argument('--rate', type=float, default=1000, help="目标速率 (条/秒)")
+    parser.add_argument('--duration', type=float, default=10, help="持续时间 (秒)")
+    parser.add_argument('--arrival', choices=LoadGenerator.ARRIVALS, default='poisson', help="到达过程")
+    parser.add_argument('--mix', default='alert=4,business=2,scheduled=1,alpha=3', help="事件类型配比")
+    parser.add_argument('--pool-size', type=int, default=10000, help="预生成事件池大小")
+    parser.add_argument('--batch-max', type=int, default=1000, help="单次 LPUSH 最多条数")
+    parser.add_argument('--burst-factor', type=float, default=5.0, help="bursty 模式下突发期速率倍数")
+    parser.add_argument('--burst-period', type=float, default=10.0, help="bursty 模式的周期 (秒)")
+    parser.add_argument('--queue', default=Config.QUEUE_NAME, help="目标队列")
+    args = parser.parse_args(argv)
+    
+    producer = TweetProducer()
+    generator = LoadGenerator(producer, args.rate, args.duration, parse_mix(args.mix), arrival=args.arrival,
+                              pool_size=args.pool_size, batch_max=args.batch_max,
+                              burst_factor=args.burst_factor, burst_period=args.burst_period,
+                              queue_name=args.queue)
+    logger.info("🚀 开始生成负载: %s 条/秒 x %ss (%s)", args.rate, args.duration, args.arrival)
+    result = generator.run()
+    logger.info("📊 目标 %.0f 条/秒，实际 %.0f 条/秒，共 %d 条；批次滞后 p50 %.1fms / p99 %.1fms / max %.1fms",
+                result['target_rate'], result['achieved_rate'], result['sent'],
+                result['lag_p50_ms'], result['lag_p99_ms'], result['lag_max_ms'])
+    return 0
+
+
 def main():
     """主函数"""
+    setup_logging()
+    if len(sys.argv) > 1 and sys.argv[1] == 'load':
+        return run_load(sys.argv[2:])
     try:
         producer = TweetProducer()
         
         # 显示队列状态
         status = producer.get_queue_status()
-        logger.info(f"📋 队列状态: {status}")
+        logger.info("📋 队列状态: %s", status)
         
         # 生成并发送一个事件
         event = producer.generate_event()
@@ -241,9 +494,10 @@ def main():
             logger.info("✅ 事件发送成功!")
         else:
             logger.error("❌ 事件发送失败!")
+        producer.close()
             
     except Exception as e:
-        logger.error(f"❌ 程序执行失败: {e}")
+        logger.error("❌ 程序执行失败: %s", e)
         return 1
     
     return 0
@@ -0,0 +1,200 @@
+# profiler.py - 消费者采样性能剖析
+# 每 PROFILE_EVERY 条消息对其中一条做 cProfile 剖析，同时由采样线程按 PROFILE_SAMPLE_MS
+# 抓取该线程的调用栈；定期输出 .prof (pstats / snakeviz) 和 .collapsed
+# (flamegraph.pl / speedscope 可直接读取的折叠栈)。
+# 发推、Webhook、图片上传在 sink / 上传线程池中执行，剖析期间提交的任务经 propagate() 包装后，
+# 这些线程也一并剖析和采样，结果里看到的是实际耗时所在，而不只是消费线程在 future.result() 上等待。
+# 未开启时 sample() 只做一次属性判断，返回共享的空上下文。
+
+import os
+import sys
+import time
+import signal
+import cProfile
+import pstats
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import nullcontext
+from typing import Optional, Dict
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_NULL = nullcontext()
+# 当前线程 (或提交任务的线程) 正在剖析的消息
+_current: contextvars.ContextVar = contextvars.ContextVar('profile_sample', default=None)
+
+
+def _collapse(frame) -> str:
+    """调用栈 → "模块:函数;模块:函数" (最外层在前)"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def propagate(fn):
+    """
+    在提交线程池任务的线程中调用: 正在剖析消息时，返回在工作线程中同样剖析和采样的包装函数
+
+    未在剖析时原样返回 fn，只多一次 ContextVar 读取。
+    """
+    sample = _current.get()
+    if sample is None:
+        return fn
+
+    def run(*args, **kwargs):
+        with _Sample(sample.profiler, parent=sample):
+            return fn(*args, **kwargs)
+    return run
+
+
+class _Sample:
+    """一条被剖析的消息；parent 不为空时表示该消息在线程池任务中的那一部分"""
+
+    def __init__(self, profiler: 'MessageProfiler', parent: Optional['_Sample'] = None):
+        self.profiler = profiler
+        self.parent = parent
+        self.profile: Optional[cProfile.Profile] = cProfile.Profile()
+        self._token = None
+
+    def __enter__(self):
+        self.profiler._begin(threading.get_ident())
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Python 3.12+ 同一时刻只允许一个 cProfile，另一线程正在剖析时只做调用栈采样
+            self.profile = None
+        self._token = _current.set(self.parent or self)
+        return self
+
+    def __exit__(self, *exc):
+        _current.reset(self._token)
+        if self.profile is not None:
+            self.profile.disable()
+        self.profiler._end(threading.get_ident(), self.profile, counted=self.parent is None)
+        return False
+
+
+class MessageProfiler:
+    """
+    按消息采样的剖析器
+
+    用法: with profiler.sample(): process(message)
+    可通过 PROFILE_ENABLED 启动时开启，或运行中发送 SIGUSR2 切换 (关闭时立即输出已收集的数据)。
+    """
+
+    def __init__(self, name: str, enabled: Optional[bool] = None, every: Optional[int] = None,
+                 directory: Optional[str] = None, dump_interval: Optional[float] = None,
+                 sample_ms: Optional[float] = None):
+        self.name = name
+        self.enabled = Config.PROFILE_ENABLED if enabled is None else enabled
+        self.every = max(every or Config.PROFILE_EVERY, 1)
+        self.directory = directory or Config.PROFILE_DIR
+        self.dump_interval = dump_interval or Config.PROFILE_DUMP_INTERVAL
+        self.sample_interval = (sample_ms or Config.PROFILE_SAMPLE_MS) / 1000.0
+        self._lock = threading.Lock()
+        self._count = 0
+        # 正在剖析的线程 → 嵌套层数 (同一个 sink 线程可能连续执行同一条消息的多个任务)
+        self._active: Counter = Counter()
+        self._stats: Optional[pstats.Stats] = None
+        self._stacks: Counter = Counter()
+        self._profiled = 0
+        self._last_dump = time.monotonic()
+        self._sampler: Optional[threading.Thread] = None
+
+    def install_signal(self, signum: Optional[int] = None):
+        """注册切换信号 (默认 SIGUSR2，仅主线程可调用；Windows 上没有该信号时跳过)"""
+        signum = signum or getattr(signal, 'SIGUSR2', None)
+        if signum is not None:
+            signal.signal(signum, lambda s, f: self.toggle())
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        # 信号处理函数中不直接写文件，交给后台线程
+        threading.Thread(target=self._toggled, name='profiler-toggle', daemon=True).start()
+
+    def _toggled(self):
+        logger.info("🔬 性能剖析已%s: %s (每 %d 条消息采样一条)", '开启' if self.enabled else '关闭',
+                    self.name, self.every)
+        if not self.enabled:
+            self.dump()
+
+    def sample(self):
+        """返回包裹单条消息处理的上下文；未开启或未轮到采样时为空上下文"""
+        if not self.enabled:
+            return _NULL
+        with self._lock:
+            self._count += 1
+            if self._count % self.every:
+                return _NULL
+        return _Sample(self)
+
+    def _begin(self, thread_id: int):
+        with self._lock:
+            self._active[thread_id] += 1
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_loop, name='profiler-sampler', daemon=True)
+                self._sampler.start()
+
+    def _end(self, thread_id: int, profile: Optional[cProfile.Profile], counted: bool = True):
+        """合并一段剖析结果；线程池任务 (counted=False) 不重复计入消息数，也不触发输出"""
+        with self._lock:
+            self._active[thread_id] -= 1
+            if self._active[thread_id] <= 0:
+                del self._active[thread_id]
+            if profile is not None:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+            if not counted:
+                return
+            self._profiled += 1
+            due = time.monotonic() - self._last_dump >= self.dump_interval
+        if due:
+            self.dump()
+
+    def _sample_loop(self):
+        """只在有消息正在被剖析时抓取对应线程的调用栈"""
+        while self.enabled:
+            time.sleep(self.sample_interval)
+            with self._lock:
+                active = list(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            stacks = [_collapse(frames[tid]) for tid in active if tid in frames]
+            with self._lock:
+                self._stacks.update(stacks)
+
+    def dump(self) -> Optional[Dict[str, str]]:
+        """输出已收集的数据并清空，返回写出的文件路径"""
+        with self._lock:
+            stats, stacks, profiled = self._stats, self._stacks, self._profiled
+            self._stats, self._stacks, self._profiled = None, Counter(), 0
+            self._last_dump = time.monotonic()
+        if stats is None and not stacks:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        paths = {}
+        if stats is not None:
+            paths['prof'] = base + '.prof'
+            stats.dump_stats(paths['prof'])
+        if stacks:
+            paths['collapsed'] = base + '.collapsed'
+            with open(paths['collapsed'], 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        logger.info("🔬 已输出 %d 条消息的剖析数据: %s", profiled, ', '.join(paths.values()))
+        return paths
+
+    def close(self):
+        self.enabled = False
+        self.dump()
@@ -0,0 +1,158 @@
+# replies.py - 生产者同步等待发送结果
+# send_and_wait 在事件中带上 reply_to (本进程的回复频道) 和 request_id；消费者处理完后
+# 把结果写入 <QUEUE_NAME>:reply:<request_id> (短 TTL) 并 PUBLISH 到回复频道。
+# 每个生产者进程只订阅一个频道、占用一条 pub/sub 连接，所有未完成的请求按 request_id 分发；
+# 连接中断或 PUBLISH 丢失时按 TTL 键补查，不需要轮询。
+
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from typing import Optional, Dict, Any
+
+import redis
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def reply_key(request_id: str, queue_name: Optional[str] = None) -> str:
+    return f"{queue_name or Config.QUEUE_NAME}:reply:{request_id}"
+
+
+class ReplyPublisher:
+    """消费端: 对带 reply_to 的事件回报处理结果"""
+
+    def __init__(self, redis_client: redis.Redis, ttl: Optional[int] = None, queue_name: Optional[str] = None):
+        self.redis_client = redis_client
+        self.ttl = ttl or Config.REPLY_TTL
+        self.queue_name = queue_name or Config.QUEUE_NAME
+
+    def publish(self, event: Dict[str, Any], status: str, result: Optional[Dict[str, Any]] = None,
+                error: Optional[str] = None):
+        """
+        回报结果；没有 reply_to 的事件 (fire-and-forget) 直接返回
+
+        Args:
+            status: sent / failed / unknown (投递超时，可能已发出) / deferred (额度不足已暂存) /
+                expired / digested (已并入告警汇总) / invalid
+        """
+        channel = event.get('reply_to')
+        request_id = event.get('request_id')
+        if not channel or not request_id:
+            return
+        result = result or {}
+        reply = json.dumps({
+            'request_id': request_id,
+            'status': status,
+            'success': bool(result.get('success')),
+            'tweet_id': result.get('tweet_id'),
+            'tweet_url': result.get('tweet_url'),
+            'error': error or result.get('error'),
+        }, ensure_ascii=False)
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.set(reply_key(request_id, self.queue_name), reply, ex=self.ttl)
+            pipe.publish(channel, reply)
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            logger.warning("回报发送结果失败 (%s): %s", request_id, e)
+
+
+class _Waiter:
+    def __init__(self):
+        self.done = threading.Event()
+        self.reply: Optional[Dict[str, Any]] = None
+
+
+class ReplyListener(threading.Thread):
+    """
+    生产端: 一条 pub/sub 连接上复用所有未完成的请求
+
+    重连后用 TTL 键补查断线期间可能错过的回复。
+    """
+
+    def __init__(self, redis_client: redis.Redis, queue_name: Optional[str] = None):
+        super().__init__(name='reply-listener', daemon=True)
+        self.redis_client = redis_client
+        self.queue_name = queue_name or Config.QUEUE_NAME
+        self.channel = f"{self.queue_name}:replies:{socket.gethostname()}:{uuid.uuid4().hex[:8]}"
+        self.waiters: Dict[str, _Waiter] = {}
+        self.stop_event = threading.Event()
+        self.subscribed = threading.Event()
+        self._lock = threading.Lock()
+
+    def register(self, request_id: str) -> _Waiter:
+        waiter = _Waiter()
+        with self._lock:
+            self.waiters[request_id] = waiter
+        return waiter
+
+    def unregister(self, request_id: str):
+        with self._lock:
+            self.waiters.pop(request_id, None)
+
+    def _resolve(self, reply: Dict[str, Any]):
+        with self._lock:
+            waiter = self.waiters.pop(reply.get('request_id'), None)
+        if waiter is not None:
+            waiter.reply = reply
+            waiter.done.set()
+
+    def check_keys(self, request_ids=None):
+        """从 TTL 键补查回复 (断线重连后，或等待超时前的最后一次确认)"""
+        with self._lock:
+            pending = list(self.waiters) if request_ids is None else [r for r in request_ids if r in self.waiters]
+        if not pending:
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        for request_id in pending:
+            pipe.get(reply_key(request_id, self.queue_name))
+        for raw in pipe.execute():
+            if raw:
+                self._resolve(json.loads(raw))
+
+    def run(self):
+        while not self.stop_event.is_set():
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                self.subscribed.set()
+                self.check_keys()
+                while not self.stop_event.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message['type'] == 'message':
+                        try:
+                            self._resolve(json.loads(message['data']))
+                        except ValueError:
+                            logger.warning("无法解析的回复: %r", message['data'])
+            except redis.exceptions.ConnectionError as e:
+                self.subscribed.clear()
+                logger.error("❌ 回复订阅连接中断，5 秒后重连: %s", e)
+                self.stop_event.wait(5)
+            finally:
+                pubsub.close()
+
+    def wait(self, request_id: str, waiter: _Waiter, timeout: float) -> Optional[Dict[str, Any]]:
+        """等待回复，超时返回 None"""
+        try:
+            if not waiter.done.wait(timeout):
+                try:
+                    self.check_keys([request_id])
+                except redis.exceptions.RedisError:
+                    pass
+            return waiter.reply
+        finally:
+            self.unregister(request_id)
+
+    def close(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout=2)
+
+
+def new_request_id() -> str:
+    return f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:12]}"
@@ -0,0 +1,27 @@
+# schema.py - 队列事件的字段约定
+# 入队前的校验 (backfill / producer_daemon) 和 Alpha 消费者共用，不依赖任何消费端模块，
+# 生产端工具导入时不会连带加载 sinks / pipeline / media 等。
+
+from typing import Optional, Any
+
+# alpha_new_token 事件的必填字段
+REQUIRED_FIELDS = ['type', 'chain', 'name', 'symbol', 'amount', 'contract']
+
+
+def validate_line(event: Any) -> Optional[str]:
+    """
+    校验单条事件
+
+    Returns:
+        合法时返回 None，否则返回错误原因
+    """
+    if not isinstance(event, dict):
+        return "不是 JSON 对象"
+    if event.get('type') == 'alpha_new_token':
+        missing = [key for key in REQUIRED_FIELDS if event.get(key) in (None, '')]
+        if missing:
+            return f"缺少必要字段: {', '.join(missing)}"
+        return None
+    if not event.get('message'):
+        return "缺少 'message' 字段"
+    return None
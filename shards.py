@@ -0,0 +1,289 @@
+# shards.py - 多节点队列分片
+# QUEUE_SHARDS > 0 时，生产者按 chain (或 type) 用跳跃一致性哈希把消息写入 N 个分片队列
+# <QUEUE_NAME>:{s<i>}，花括号是 Redis Cluster 的哈希标签，分片队列和它的派生键落在同一个槽位。
+# 分片到节点的映射: REDIS_CLUSTER=true 时由 Cluster 按槽位路由；REDIS_NODES 列出多个独立节点时
+# 按一致性哈希环分配。消费者用 CONSUMER_SHARDS 只订阅部分分片，吞吐随节点数扩展。
+
+import bisect
+import hashlib
+import logging
+import queue
+import threading
+from typing import Optional, Dict, List, Any, Tuple, Iterable
+
+import redis
+
+from config import Config
+from prefetch import PrefetchingReader, replay_dump
+from partitions import parse_fields, partition_key
+
+logger = logging.getLogger(__name__)
+
+# 每个节点在哈希环上的虚拟节点数，越多分布越均匀
+RING_VNODES = 160
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def jump_hash(key: str, buckets: int) -> int:
+    """
+    跳跃一致性哈希 (Lamping & Veach)
+
+    分片数从 N 增加到 N+1 时只有约 1/(N+1) 的键换到新分片，且不需要保存哈希环。
+    """
+    h = _hash64(key)
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        h = (h * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((h >> 33) + 1)))
+    return b
+
+
+def shard_queue(queue_name: str, shard: int) -> str:
+    # 去掉主队列的哈希标签 (Cluster 下为 {tweet_queue})，否则所有分片都按它落在同一个槽位
+    base = queue_name.replace('{', '').replace('}', '')
+    return f"{base}:{{s{shard}}}"
+
+
+def parse_shards(spec: str, total: int) -> List[int]:
+    """解析要订阅的分片，例如 "0-3,7"；留空表示全部"""
+    if not spec.strip():
+        return list(range(total))
+    shards = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        shards.update(range(int(start), int(end or start) + 1))
+    invalid = [s for s in shards if not 0 <= s < total]
+    if invalid:
+        raise ValueError(f"CONSUMER_SHARDS 超出范围 0-{total - 1}: {sorted(invalid)}")
+    return sorted(shards)
+
+
+def parse_nodes(spec: str) -> List[Tuple[str, int, int]]:
+    """解析 REDIS_NODES，例如 "10.0.0.1:6379,10.0.0.2:6379/1" → [(host, port, db)]"""
+    nodes = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        address, _, db = item.partition('/')
+        host, _, port = address.rpartition(':')
+        nodes.append((host or address, int(port) if host else Config.REDIS_PORT, int(db or Config.REDIS_DB)))
+    return nodes
+
+
+def connect() -> redis.Redis:
+    """默认节点的客户端；REDIS_CLUSTER=true 时为按槽位路由所有键的 RedisCluster"""
+    if Config.REDIS_CLUSTER:
+        from redis.cluster import RedisCluster
+        kwargs = Config.redis_kwargs()
+        kwargs.pop('db')
+        return RedisCluster(**kwargs)
+    return redis.Redis(**Config.redis_kwargs())
+
+
+class HashRing:
+    """一致性哈希环: 增减节点时只有相邻区间的键换节点"""
+
+    def __init__(self, nodes: List[str], vnodes: int = RING_VNODES):
+        points = sorted((_hash64(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key: str) -> str:
+        return self._nodes[bisect.bisect(self._points, _hash64(key)) % len(self._points)]
+
+
+class ShardMap:
+    """
+    分片 → 队列键 → Redis 客户端
+
+    没有配置 REDIS_NODES / REDIS_CLUSTER 时所有分片在默认节点上，仍可按分片拆分消费者。
+    注意: 修改 REDIS_NODES 会让部分分片换节点，旧节点上该分片的积压需先消费完。
+    """
+
+    def __init__(self, shards: int, queue_name: Optional[str] = None, fields: Optional[List[str]] = None,
+                 clients: Optional[Dict[str, redis.Redis]] = None, default_client: Optional[redis.Redis] = None):
+        self.shards = shards
+        self.queue_name = queue_name or Config.QUEUE_NAME
+        self.fields = fields or parse_fields(Config.SHARD_KEYS)
+        self.default_client = default_client or connect()
+        self.clients = clients or {'default': self.default_client}
+        self.ring = HashRing(list(self.clients)) if len(self.clients) > 1 else None
+
+    @classmethod
+    def from_config(cls, default_client: Optional[redis.Redis] = None, queue_name: Optional[str] = None) -> 'ShardMap':
+        if Config.QUEUE_SHARDS > 0 and Config.QUEUE_PARTITIONS > 0:
+            logger.warning("⚠️  QUEUE_PARTITIONS 只分区未分片的主队列，与 QUEUE_SHARDS 同时开启时分片中的消息不会被分区消费")
+        default_client = default_client or connect()
+        clients = None
+        if Config.REDIS_CLUSTER:
+            clients = {'cluster': default_client}
+        elif Config.REDIS_NODES:
+            kwargs = Config.redis_kwargs()
+            clients = {}
+            for host, port, db in parse_nodes(Config.REDIS_NODES):
+                clients[f"{host}:{port}/{db}"] = redis.Redis(**{**kwargs, 'host': host, 'port': port, 'db': db})
+        return cls(Config.QUEUE_SHARDS, queue_name=queue_name, clients=clients, default_client=default_client)
+
+    @property
+    def enabled(self) -> bool:
+        return self.shards > 0
+
+    def shard_for(self, event: Any) -> int:
+        return jump_hash(partition_key(event, self.fields), self.shards)
+
+    def queue(self, shard: int) -> str:
+        return shard_queue(self.queue_name, shard)
+
+    def node(self, shard: int) -> str:
+        return self.ring.node(self.queue(shard)) if self.ring else next(iter(self.clients))
+
+    def client(self, shard: int) -> redis.Redis:
+        return self.clients[self.node(shard)]
+
+    def push(self, event: Any, payload: str) -> int:
+        """写入事件所属分片"""
+        shard = self.shard_for(event)
+        return self.client(shard).lpush(self.queue(shard), payload)
+
+    def by_node(self, items: Iterable[Tuple[int, str]]) -> Dict[str, Dict[str, List[str]]]:
+        """把 (分片, 消息) 按节点 → 分片队列分组，分片内保持顺序；每个节点用 clients[node] 一次 pipeline 写入"""
+        groups: Dict[str, Dict[str, List[str]]] = {}
+        for shard, payload in items:
+            groups.setdefault(self.node(shard), {}).setdefault(self.queue(shard), []).append(payload)
+        return groups
+
+    def depths(self) -> Dict[int, int]:
+        """各分片积压，按节点合并为一次往返"""
+        by_node: Dict[str, List[int]] = {}
+        for shard in range(self.shards):
+            by_node.setdefault(self.node(shard), []).append(shard)
+        depths = {}
+        for node, shards in by_node.items():
+            pipe = self.clients[node].pipeline(transaction=False)
+            for shard in shards:
+                pipe.llen(self.queue(shard))
+            depths.update(zip(shards, pipe.execute()))
+        return dict(sorted(depths.items()))
+
+
+class ShardFetcher(threading.Thread):
+    """阻塞读取单个分片 (或未分片的主队列)，把消息交给 ShardedReader"""
+
+    def __init__(self, name: str, reader: PrefetchingReader, handoff: queue.Queue):
+        super().__init__(name=f"shard-{name}", daemon=True)
+        self.source = name
+        self.reader = reader
+        self.handoff = handoff
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                raw = self.reader.get()
+            except Exception as e:
+                # 任何异常 (ResponseError、超时、集群重定向失败等) 都不能让读取线程退出，否则该分片无人消费
+                logger.error("❌ 分片 %s 读取失败，5s 后重试: %s", self.source, e)
+                self.stop_event.wait(5)
+                continue
+            while raw is not None:
+                try:
+                    self.handoff.put((self, raw), timeout=0.5)
+                    break
+                except queue.Full:
+                    if self.stop_event.is_set():
+                        # 还没交出去的消息放回预取缓冲，随 requeue 一起放回队列
+                        self.reader.buffer.appendleft(raw)
+                        break
+
+
+class ShardedReader:
+    """
+    同时读取多个分片的读取器，接口与 PrefetchingReader 相同 (get / requeue / stats)
+
+    每个分片一个读取线程，分片之间互不阻塞；Cluster 中不同槽位的键不能放进同一条 BLMPOP。
+    未分片的主队列 (旧生产者、spool 回放、额度恢复后的暂存消息) 也一并读取。
+    读取线程在第一次 get() 时才启动，只查看状态的进程不会取走消息。
+    """
+
+    def __init__(self, shard_map: ShardMap, shards: Optional[List[int]] = None, block_timeout: int = 30):
+        self.shard_map = shard_map
+        self.shards = parse_shards(Config.CONSUMER_SHARDS, shard_map.shards) if shards is None else shards
+        self.block_timeout = block_timeout
+        sources = [(str(s), shard_map.client(s), shard_map.queue(s)) for s in self.shards]
+        sources.append(('main', shard_map.default_client, shard_map.queue_name))
+        self.handoff: queue.Queue = queue.Queue(maxsize=len(sources))
+        self.fetchers = [ShardFetcher(name, PrefetchingReader(client, queue_name, block_timeout=1), self.handoff)
+                         for name, client, queue_name in sources]
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for fetcher in self.fetchers:
+                fetcher.start()
+            logger.info("🗂️  分片消费已启动: 订阅分片 %s (共 %d 个)", self.shards, self.shard_map.shards)
+
+    def get(self) -> Optional[str]:
+        """取一条原始消息；超时无消息时返回 None"""
+        if not self._started:
+            self._start()
+        try:
+            _, raw = self.handoff.get(timeout=self.block_timeout)
+        except queue.Empty:
+            return None
+        return raw
+
+    def requeue(self) -> int:
+        """停止读取线程，把已取出未处理的消息按原顺序放回各自的分片"""
+        for fetcher in self.fetchers:
+            fetcher.stop_event.set()
+        for fetcher in self.fetchers:
+            if fetcher.is_alive():
+                fetcher.join()
+        pending: Dict[ShardFetcher, List[str]] = {}
+        while True:
+            try:
+                fetcher, raw = self.handoff.get_nowait()
+            except queue.Empty:
+                break
+            pending.setdefault(fetcher, []).append(raw)
+        for fetcher, raws in pending.items():
+            # 交接队列中的消息比预取缓冲中的更早出队，排在前面
+            fetcher.reader.buffer.extendleft(reversed(raws))
+        return sum(fetcher.reader.requeue() for fetcher in self.fetchers)
+
+    def stats(self) -> dict:
+        per_source = {fetcher.source: fetcher.reader.stats() for fetcher in self.fetchers}
+        return {
+            'shards': self.shards,
+            'redis_ops': sum(s['redis_ops'] for s in per_source.values()),
+            'delivered': sum(s['delivered'] for s in per_source.values()),
+            'buffered': sum(s['buffered'] for s in per_source.values()) + self.handoff.qsize(),
+            'delivered_by_shard': {name: s['delivered'] for name, s in per_source.items()},
+        }
+
+
+def make_reader(redis_client: redis.Redis, queue_name: str, block_timeout: int = 30):
+    """
+    QUEUE_SHARDS > 0 时返回分片读取器，否则返回单队列的 PrefetchingReader
+
+    创建前先把上次退出时落盘的预取消息放回队列 (分片消息回到所在节点)。
+    """
+    if Config.QUEUE_SHARDS > 0:
+        shard_map = ShardMap.from_config(redis_client)
+        clients = {shard_map.queue(s): shard_map.client(s) for s in range(shard_map.shards)}
+        replay_dump(lambda name: clients.get(name, redis_client))
+        return ShardedReader(shard_map, block_timeout=block_timeout)
+    replay_dump(lambda name: redis_client)
+    return PrefetchingReader(redis_client, queue_name, block_timeout=block_timeout)
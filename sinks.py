@@ -0,0 +1,272 @@
+# sinks.py - 推文输出目标 (Sink)
+# 把"发送"从 TwitterClient 中解耦出来，支持按事件类型路由到多个目标并发投递。
+
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Optional, Dict, Any, List
+from config import Config
+from log_setup import message_logger
+from profiler import propagate
+
+logger = logging.getLogger(__name__)
+msg_logger = message_logger(__name__)
+
+
+def _sink_setting(name: str, key: str, default):
+    """读取单个 sink 的覆盖配置，例如 SINK_WEBHOOK_TIMEOUT / SINK_TWITTER_WORKERS"""
+    value = os.getenv(f"SINK_{name.upper()}_{key}")
+    if value in (None, ''):
+        return default
+    return type(default)(value)
+
+
+class BaseSink:
+    """输出目标基类，每个 sink 拥有独立的线程池和超时"""
+
+    kind = 'base'
+
+    def __init__(self, name: Optional[str] = None, workers: Optional[int] = None, timeout: Optional[float] = None):
+        self.name = name or self.kind
+        self.workers = workers or _sink_setting(self.name, 'WORKERS', Config.SINK_WORKERS)
+        self.timeout = timeout or _sink_setting(self.name, 'TIMEOUT', Config.SINK_TIMEOUT)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"sink-{self.name}")
+
+    def send(self, content: str, event: Dict[str, Any], **kwargs) -> Optional[Dict[str, Any]]:
+        """
+        同步投递一条内容
+
+        Returns:
+            成功时返回包含 'success': True 的结果字典，失败时返回 None
+        """
+        raise NotImplementedError
+
+    def submit(self, content: str, event: Dict[str, Any], **kwargs):
+        """提交到本 sink 的线程池，返回 Future；正在剖析这条消息时 sink 线程也一并剖析"""
+        return self._executor.submit(propagate(self.send), content, event, **kwargs)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class TwitterSink(BaseSink):
+    """通过 TwitterClient 发送推文；配置 TWITTER_ACCOUNTS_FILE 时使用多账号池"""
+
+    kind = 'twitter'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # 仅在真正需要发推时才加载 tweepy 并校验凭据
+        self.pool = None
+        if Config.TWITTER_ACCOUNTS_FILE:
+            from account_pool import AccountPool
+            self.pool = AccountPool.from_file()
+            self.client = self.pool.primary_client
+        else:
+            from twitter_client import TwitterClient
+            self.client = TwitterClient()
+
+    def send(self, content: str, event: Dict[str, Any], **kwargs) -> Optional[Dict[str, Any]]:
+        if self.pool:
+            return self.pool.send_tweet(content, event, **kwargs)
+        return self.client.send_tweet(content, **kwargs)
+
+
+class WebhookSink(BaseSink):
+    """以 JSON POST 方式投递到 Webhook"""
+
+    kind = 'webhook'
+
+    def __init__(self, url: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        import requests
+        self.url = url or Config.WEBHOOK_URL
+        if not self.url:
+            raise ValueError("WebhookSink 需要配置 WEBHOOK_URL")
+        self.session = requests.Session()
+
+    def send(self, content: str, event: Dict[str, Any], **kwargs) -> Optional[Dict[str, Any]]:
+        try:
+            response = self.session.post(
+                self.url,
+                json={'content': content, 'event': event},
+                timeout=self.timeout
+            )
+            if 200 <= response.status_code < 300:
+                return {'success': True, 'status_code': response.status_code, 'timestamp': time.time()}
+            logger.error("Webhook 返回异常状态码: %s", response.status_code)
+            return None
+        except Exception as e:
+            logger.error("Webhook 投递失败: %s", e)
+            return None
+
+
+class FileSink(BaseSink):
+    """追加写入 JSONL 文件"""
+
+    kind = 'file'
+
+    def __init__(self, path: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or Config.SINK_FILE_PATH
+        self._lock = threading.Lock()
+
+    def send(self, content: str, event: Dict[str, Any], **kwargs) -> Optional[Dict[str, Any]]:
+        record = {
+            'timestamp': time.time(),
+            'type': event.get('type'),
+            'content': content,
+            'event': event,
+        }
+        try:
+            line = json.dumps(record, ensure_ascii=False) + "\n"
+            with self._lock:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            return {'success': True, 'path': self.path, 'timestamp': record['timestamp']}
+        except Exception as e:
+            logger.error("写入输出文件失败: %s", e)
+            return None
+
+
+class NullSink(BaseSink):
+    """空投递 (dry-run)：只记录预览，不需要任何凭据或网络"""
+
+    kind = 'null'
+
+    def send(self, content: str, event: Dict[str, Any], **kwargs) -> Optional[Dict[str, Any]]:
+        msg_logger.info("推文内容预览（未发送）: %s", content)
+        return {'success': True, 'dry_run': True, 'content': content, 'timestamp': time.time()}
+
+
+SINK_TYPES = {cls.kind: cls for cls in (TwitterSink, WebhookSink, FileSink, NullSink)}
+
+
+def delivery_status(result: Optional[Dict[str, Any]]) -> str:
+    """SinkRouter.dispatch 结果对应的回报状态: sent / unknown (超时，可能已发出) / failed"""
+    if result and result.get('success'):
+        return 'sent'
+    if result and result.get('unknown'):
+        return 'unknown'
+    return 'failed'
+
+
+def parse_routes(spec: str) -> Dict[str, List[str]]:
+    """
+    解析路由配置
+
+    格式: "alpha_new_token=twitter,file;monitoring_alert=webhook;*=twitter"
+    """
+    routes = {}
+    for part in spec.split(';'):
+        part = part.strip()
+        if not part:
+            continue
+        if '=' not in part:
+            raise ValueError(f"无效的 SINK_ROUTES 配置项: {part}")
+        event_type, names = part.split('=', 1)
+        sink_names = [n.strip() for n in names.split(',') if n.strip()]
+        for n in sink_names:
+            if n not in SINK_TYPES:
+                raise ValueError(f"未知的 sink 类型: {n}")
+        routes[event_type.strip()] = sink_names
+    return routes
+
+
+class SinkRouter:
+    """按事件类型把内容并发扇出到多个 sink"""
+
+    def __init__(self, routes: Dict[str, List[str]], sinks: Dict[str, BaseSink]):
+        self.routes = routes
+        self.sinks = sinks
+
+    @classmethod
+    def from_config(cls) -> 'SinkRouter':
+        """根据 SINK_ROUTES 构建路由；未配置时按 TWITTER_SENDING 选择 twitter 或 null"""
+        spec = Config.SINK_ROUTES or ('*=twitter' if Config.TWITTER_SENDING else '*=null')
+        routes = parse_routes(spec)
+        names = sorted({n for sink_names in routes.values() for n in sink_names})
+        sinks = {name: SINK_TYPES[name]() for name in names}
+        logger.info("输出路由: %s", spec)
+        return cls(routes, sinks)
+
+    @property
+    def twitter_client(self):
+        """若路由中包含 twitter sink，返回其 TwitterClient，否则为 None"""
+        sink = self.sinks.get('twitter')
+        return sink.client if sink else None
+
+    def sinks_for(self, event_type: Optional[str]) -> List[str]:
+        return self.routes.get(event_type) or self.routes.get('*', [])
+
+    def dispatch(self, content: str, event: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        """
+        并发投递到该事件类型的所有 sink
+
+        Returns:
+            汇总结果，所有 sink 成功时 success 为 True；
+            若 twitter sink 成功，会带上 tweet_id / tweet_url；
+            超时但仍在后台执行 (可能已经发出) 的 sink 列在 unknown 中，调用方不应重新投递
+        """
+        names = self.sinks_for(event.get('type'))
+        if not names:
+            logger.warning("事件类型 %s 没有配置任何 sink", event.get('type'))
+            return {'success': False, 'results': {}}
+
+        started = time.monotonic()
+        futures = {name: self.sinks[name].submit(content, event, **kwargs) for name in names}
+
+        results = {}
+        unknown = []
+        for name, future in futures.items():
+            # 各 sink 的超时都从同一起点计算，慢的目标不会拖累其他目标
+            remaining = self.sinks[name].timeout - (time.monotonic() - started)
+            try:
+                results[name] = future.result(timeout=max(remaining, 0))
+            except FutureTimeoutError:
+                if future.cancel():
+                    # 还在线程池中排队，没有开始投递
+                    logger.error("sink '%s' 投递超时 (%ss)，已取消", name, self.sinks[name].timeout)
+                    results[name] = None
+                else:
+                    # 已经开始执行的请求无法中止，可能稍后仍会发出
+                    logger.error("sink '%s' 投递超时 (%ss)，仍在后台执行，结果未知", name, self.sinks[name].timeout)
+                    future.add_done_callback(lambda f, name=name: self._log_late(name, f))
+                    results[name] = None
+                    unknown.append(name)
+            except Exception as e:
+                logger.error("sink '%s' 投递异常: %s", name, e)
+                results[name] = None
+
+        summary = {
+            'success': all(r and r.get('success') for r in results.values()),
+            'results': results,
+        }
+        if unknown:
+            summary['unknown'] = unknown
+        for r in results.values():
+            if r and r.get('tweet_url'):
+                summary['tweet_id'] = r.get('tweet_id')
+                summary['tweet_url'] = r.get('tweet_url')
+                break
+        return summary
+
+    @staticmethod
+    def _log_late(name: str, future):
+        """超时后才完成的投递，记录最终结果"""
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.warning("sink '%s' 超时的投递最终失败: %s", name, e)
+            return
+        if result and result.get('success'):
+            logger.warning("sink '%s' 超时的投递最终已完成: %s", name, result.get('tweet_url') or result)
+        else:
+            logger.warning("sink '%s' 超时的投递最终失败", name)
+
+    def close(self):
+        for sink in self.sinks.values():
+            sink.close()
@@ -0,0 +1,376 @@
+# soak.py - 故障注入长稳测试 (soak / chaos)
+# 在本地 Redis 和假 Twitter 服务器上长时间运行消费者，周期性注入
+# 连接断开、Redis 重启、慢响应、429 风暴和非法 JSON，
+# 统计恢复时间、丢失/重复消息数以及消费者内存增长。
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List
+
+import redis
+
+from producer_v2 import build_queue_item
+from log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+SOAK_MARKER = re.compile(r"#soak-(\d+)")
+
+FAULTS = ['conn_drop', 'redis_restart', 'slow_redis', 'slow_twitter', 'rate_limit_storm', 'malformed_json']
+
+
+class FakeTwitterState:
+    """假 Twitter 服务器的状态与故障开关"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deliveries: Dict[int, int] = {}
+        self.delivery_times: List[float] = []
+        self.latency = 0.0
+        self.rate_limited_until = 0.0
+        self.next_id = 1
+
+    def record(self, text: str) -> str:
+        with self.lock:
+            match = SOAK_MARKER.search(text)
+            if match:
+                seq = int(match.group(1))
+                self.deliveries[seq] = self.deliveries.get(seq, 0) + 1
+            self.delivery_times.append(time.time())
+            tweet_id = str(self.next_id)
+            self.next_id += 1
+            return tweet_id
+
+    def last_delivery_after(self, t: float) -> Optional[float]:
+        with self.lock:
+            for ts in self.delivery_times:
+                if ts >= t:
+                    return ts
+        return None
+
+
+class FakeTwitterHandler(BaseHTTPRequestHandler):
+    """实现消费者用到的两个端点: GET /2/users/me 和 POST /2/tweets"""
+
+    state: FakeTwitterState = None
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _faults(self) -> bool:
+        """注入延迟和 429，返回 True 表示已经回复"""
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if time.time() < self.state.rate_limited_until:
+            self._reply(429, {'title': 'Too Many Requests'},
+                        {'x-rate-limit-reset': str(int(self.state.rate_limited_until) + 1)})
+            return True
+        return False
+
+    def do_GET(self):
+        if self._faults():
+            return
+        if self.path.startswith('/2/users/me'):
+            self._reply(200, {'data': {'id': '1', 'name': 'Soak Bot', 'username': 'soak_bot'}})
+        else:
+            self._reply(404, {'title': 'Not Found'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self._faults():
+            return
+        if self.path.startswith('/2/tweets'):
+            text = json.loads(body or b'{}').get('text', '')
+            tweet_id = self.state.record(text)
+            self._reply(201, {'data': {'id': tweet_id, 'text': text}})
+        else:
+            self._reply(404, {'title': 'Not Found'})
+
+
+class RedisServer:
+    """harness 管理的本地 redis-server (开启 AOF，重启不丢数据)"""
+
+    def __init__(self, port: int, binary: str = 'redis-server'):
+        self.port = port
+        self.binary = binary
+        self.dir = tempfile.mkdtemp(prefix='soak-redis-')
+        self.proc = None
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            [self.binary, '--port', str(self.port), '--dir', self.dir, '--save', '',
+             '--appendonly', 'yes', '--appendfsync', 'always'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        client = redis.Redis(port=self.port)
+        for _ in range(50):
+            try:
+                client.ping()
+                return
+            except redis.exceptions.ConnectionError:
+                time.sleep(0.1)
+        raise RuntimeError("redis-server 启动失败")
+
+    def stop(self):
+        if self.proc:
+            self.proc.terminate()
+            self.proc.wait()
+            self.proc = None
+
+    def cleanup(self):
+        self.stop()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def rss_kb(pid: int) -> Optional[int]:
+    """读取进程常驻内存 (Linux /proc)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class SoakHarness:
+    """生产消息、运行消费者、注入故障并汇总结果"""
+
+    def __init__(self, args):
+        self.args = args
+        self.queue_name = args.queue
+        self.state = FakeTwitterState()
+        self.redis_server = RedisServer(args.redis_port) if args.manage_redis else None
+        self.admin = redis.Redis(host=args.redis_host, port=args.redis_port, decode_responses=True)
+        self.produced = 0
+        self.malformed = 0
+        self.faults: List[Dict[str, Any]] = []
+        self.memory: List[Dict[str, Any]] = []
+        self.consumer = None
+        self.stop = threading.Event()
+
+    # ---------- 组件 ----------
+
+    def start_fake_twitter(self) -> str:
+        FakeTwitterHandler.state = self.state
+        server = ThreadingHTTPServer(('127.0.0.1', self.args.twitter_port), FakeTwitterHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.twitter_server = server
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    def start_consumer(self, twitter_url: str):
+        env = {
+            **os.environ,
+            'TWITTER_BEARER_TOKEN': 'soak', 'TWITTER_CONSUMER_KEY': 'soak', 'TWITTER_CONSUMER_SECRET': 'soak',
+            'TWITTER_ACCESS_TOKEN': 'soak', 'TWITTER_ACCESS_TOKEN_SECRET': 'soak',
+            'TWITTER_API_BASE_URL': twitter_url,
+            'TWITTER_SENDING': 'true', 'SINK_ROUTES': '', 'TWITTER_ACCOUNTS_FILE': '',
+            'USE_PROXY': 'false', 'HTTP_PROXY': '', 'HTTPS_PROXY': '',
+            'REDIS_HOST': self.args.redis_host, 'REDIS_PORT': str(self.args.redis_port),
+            'QUEUE_NAME': self.queue_name, 'LOG_LEVEL': self.args.consumer_log_level,
+        }
+        self.consumer = subprocess.Popen([sys.executable, self.args.consumer], env=env)
+
+    def producer_loop(self):
+        """以固定速率生产带序号的消息"""
+        interval = 1.0 / self.args.rate
+        next_at = time.monotonic()
+        while not self.stop.is_set():
+            event = {'type': 'soak', 'message': f"soak test #soak-{self.produced} {time.strftime('%H:%M:%S')}"}
+            try:
+                self.admin.lpush(self.queue_name, json.dumps(build_queue_item(event), ensure_ascii=False))
+                self.produced += 1
+            except redis.exceptions.ConnectionError:
+                # Redis 不可用期间生产端的失败不计入消费端丢失
+                pass
+            next_at += interval
+            self.stop.wait(max(next_at - time.monotonic(), 0))
+
+    def monitor_loop(self):
+        started = time.time()
+        while not self.stop.wait(self.args.sample_interval):
+            sample = {'t': round(time.time() - started, 1), 'rss_kb': rss_kb(self.consumer.pid),
+                      'delivered': len(self.state.deliveries), 'produced': self.produced}
+            self.memory.append(sample)
+            logger.info("📊 %s", sample)
+
+    # ---------- 故障 ----------
+
+    def inject(self, fault: str):
+        duration = self.args.fault_duration
+        started = time.time()
+        logger.warning("💥 注入故障: %s (%.0fs)", fault, duration)
+        try:
+            if fault == 'conn_drop':
+                self.admin.client_kill_filter(_type='normal', skipme=True)
+            elif fault == 'redis_restart':
+                if not self.redis_server:
+                    logger.info("未托管 redis-server，跳过重启故障")
+                    return
+                self.redis_server.stop()
+                time.sleep(duration)
+                self.redis_server.start()
+            elif fault == 'slow_redis':
+                # 暂停所有普通客户端的命令处理，模拟 Redis 响应缓慢
+                self.admin.client_pause(int(duration * 1000))
+                time.sleep(duration)
+            elif fault == 'slow_twitter':
+                self.state.latency = self.args.slow_latency
+                time.sleep(duration)
+                self.state.latency = 0.0
+            elif fault == 'rate_limit_storm':
+                self.state.rate_limited_until = time.time() + duration
+                time.sleep(duration)
+            elif fault == 'malformed_json':
+                garbage = ['{not json', '', '[]', '{"type": "soak"', '\x00\xff']
+                self.admin.lpush(self.queue_name, *garbage)
+                self.malformed += len(garbage)
+        except redis.exceptions.RedisError as e:
+            logger.error("注入 %s 失败: %s", fault, e)
+            return
+        self.faults.append({'fault': fault, 'started': started, 'ended': time.time()})
+
+    def fault_loop(self):
+        enabled = self.args.faults
+        while not self.stop.wait(self.args.fault_interval):
+            self.inject(random.choice(enabled))
+
+    # ---------- 汇总 ----------
+
+    def report(self, queued_left: int) -> Dict[str, Any]:
+        deliveries = self.state.deliveries
+        delivered = len(deliveries)
+        duplicated = sum(count - 1 for count in deliveries.values() if count > 1)
+        lost = max(self.produced - delivered - queued_left, 0)
+
+        recovery: Dict[str, List[float]] = {}
+        for f in self.faults:
+            first = self.state.last_delivery_after(f['ended'])
+            if first is not None:
+                recovery.setdefault(f['fault'], []).append(first - f['ended'])
+
+        rss = [m['rss_kb'] for m in self.memory if m['rss_kb']]
+        return {
+            'duration': self.args.duration,
+            'produced': self.produced,
+            'delivered_unique': delivered,
+            'duplicated': duplicated,
+            'lost': lost,
+            'still_queued': queued_left,
+            'malformed_injected': self.malformed,
+            'faults_injected': len(self.faults),
+            'recovery_seconds': {
+                k: {'count': len(v), 'mean': round(sum(v) / len(v), 2), 'max': round(max(v), 2)}
+                for k, v in recovery.items()
+            },
+            'rss_kb': {
+                'start': rss[0] if rss else None,
+                'end': rss[-1] if rss else None,
+                'max': max(rss) if rss else None,
+                'growth': rss[-1] - rss[0] if len(rss) > 1 else None,
+            },
+            'samples': self.memory,
+        }
+
+    def run(self) -> Dict[str, Any]:
+        if self.redis_server:
+            self.redis_server.start()
+        self.admin.delete(self.queue_name)
+        twitter_url = self.start_fake_twitter()
+        self.start_consumer(twitter_url)
+
+        threads = [threading.Thread(target=fn, daemon=True)
+                   for fn in (self.producer_loop, self.monitor_loop, self.fault_loop)]
+        for t in threads:
+            t.start()
+        try:
+            time.sleep(self.args.duration)
+        except KeyboardInterrupt:
+            logger.info("🛑 提前结束")
+        self.stop.set()
+        for t in threads:
+            t.join()
+
+        # 停止生产后等待消费者排空队列，再优雅关闭 (预取缓冲会被放回队列)
+        deadline = time.time() + self.args.drain_timeout
+        while time.time() < deadline:
+            try:
+                if self.admin.llen(self.queue_name) == 0:
+                    break
+            except redis.exceptions.ConnectionError:
+                pass
+            time.sleep(1)
+        time.sleep(self.args.drain_grace)
+        self.consumer.send_signal(signal.SIGTERM)
+        try:
+            self.consumer.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.consumer.kill()
+
+        queued_left = sum(1 for raw in self.admin.lrange(self.queue_name, 0, -1) if SOAK_MARKER.search(raw))
+        result = self.report(queued_left)
+        self.twitter_server.shutdown()
+        if self.redis_server:
+            self.redis_server.cleanup()
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="消费者故障注入长稳测试")
+    parser.add_argument('--duration', type=float, default=3600, help="运行时长(秒)")
+    parser.add_argument('--rate', type=float, default=0.3, help="生产速率(条/秒)")
+    parser.add_argument('--consumer', default='consumer_v2.py', help="被测消费者脚本")
+    parser.add_argument('--faults', nargs='+', default=FAULTS, choices=FAULTS, help="启用的故障类型")
+    parser.add_argument('--fault-interval', type=float, default=120, help="两次故障之间的间隔(秒)")
+    parser.add_argument('--fault-duration', type=float, default=10, help="单次故障持续时间(秒)")
+    parser.add_argument('--slow-latency', type=float, default=5, help="slow_twitter 时每个请求的延迟(秒)")
+    parser.add_argument('--sample-interval', type=float, default=30, help="内存采样间隔(秒)")
+    parser.add_argument('--drain-timeout', type=float, default=600, help="结束后等待排空的最长时间(秒)")
+    parser.add_argument('--drain-grace', type=float, default=5, help="队列排空后等待在途消息完成的时间(秒)")
+    parser.add_argument('--redis-host', default='127.0.0.1')
+    parser.add_argument('--redis-port', type=int, default=6390)
+    parser.add_argument('--no-manage-redis', dest='manage_redis', action='store_false',
+                        help="使用已有的 Redis，而不是由 harness 启动 redis-server (无法注入重启故障)")
+    parser.add_argument('--twitter-port', type=int, default=0, help="假 Twitter 服务器端口，0 为随机")
+    parser.add_argument('--queue', default='soak_queue')
+    parser.add_argument('--consumer-log-level', default='WARNING')
+    parser.add_argument('--report', default='soak_report.json', help="结果报告输出路径")
+    args = parser.parse_args(argv)
+
+    setup_logging(level='INFO')
+    result = SoakHarness(args).run()
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    summary = {k: v for k, v in result.items() if k != 'samples'}
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0 if result['lost'] == 0 and result['duplicated'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+# spool.py - 生产端本地预写日志 (WAL)
+# Redis 不可用时，消息追加写入本地 spool 文件；后台回放线程在连接恢复后
+# 按 pipeline 批量写回队列。回放进度记录在偏移文件中，保证顺序和至少一次投递。
+# 多个生产者进程共用同一个 spool 文件，追加、回放和清空都在 <path>.lock 的 flock 下进行。
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Tuple
+
+try:
+    import fcntl
+except ImportError:   # 非 POSIX 平台只有进程内的锁
+    fcntl = None
+
+import redis
+
+from config import Config
+from log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class Spool:
+    """
+    追加写的本地消息日志
+
+    每行一条 JSON 记录 [queue_name, payload]；<path>.offset 记录已成功写回 Redis 的字节偏移。
+    全部回放完成后清空文件，偏移归零。文件大小和偏移可能被其他进程改变，每次加锁后重新读取。
+    """
+
+    def __init__(self, path: str, fsync: Optional[str] = None, max_bytes: Optional[int] = None,
+                 fsync_interval: Optional[float] = None):
+        self.path = path
+        self.offset_path = f"{path}.offset"
+        self.lock_path = f"{path}.lock"
+        self.fsync = fsync or Config.SPOOL_FSYNC
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError(f"未知的 SPOOL_FSYNC 策略: {self.fsync}")
+        self.max_bytes = Config.SPOOL_MAX_BYTES if max_bytes is None else max_bytes
+        self.fsync_interval = Config.SPOOL_FSYNC_INTERVAL if fsync_interval is None else fsync_interval
+        self.lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+        self._last_fsync = 0.0
+        # 首次写入时才创建文件
+        self.file = None
+        self.size = 0
+        self.offset = 0
+        with self.locked():
+            self._repair()
+            self._refresh()
+
+    @contextmanager
+    def locked(self):
+        """进程内线程锁 + 跨进程文件锁，可重入；加锁后重新读取文件大小和回放偏移"""
+        with self.lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                if self._lock_file is None:
+                    self._lock_file = open(self.lock_path, 'a')
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1:
+                    self._refresh()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _refresh(self):
+        self.size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self.offset = self._load_offset()
+
+    def _repair(self):
+        """截掉崩溃时写了一半的最后一行"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(max(size - 65536, 0))
+            tail = f.read()
+            if tail.endswith(b"\n"):
+                return
+            cut = size - len(tail) + tail.rfind(b"\n") + 1 if b"\n" in tail else 0
+            f.truncate(cut)
+            logger.warning("spool 末尾存在不完整记录，已截断 %d 字节", size - cut)
+
+    def _load_offset(self) -> int:
+        try:
+            with open(self.offset_path, 'r', encoding='utf-8') as f:
+                offset = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        # 偏移超过文件大小说明文件已被清空
+        return offset if offset <= self.size else 0
+
+    def _save_offset(self, offset: int):
+        tmp_path = f"{self.offset_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+        self.offset = offset
+
+    @property
+    def pending_bytes(self) -> int:
+        with self.locked():
+            return self.size - self.offset
+
+    def has_pending(self) -> bool:
+        with self.locked():
+            return self.size > self.offset
+
+    def _append(self, queue_name: str, payload: str) -> bool:
+        line = (json.dumps([queue_name, payload], ensure_ascii=False) + "\n").encode('utf-8')
+        if self.max_bytes and self.size + len(line) > self.max_bytes:
+            logger.error("❌ spool 已达上限 %d 字节，消息被丢弃", self.max_bytes)
+            return False
+        if self.file is None:
+            self.file = open(self.path, 'ab')
+        self.file.write(line)
+        self.file.flush()
+        self.size += len(line)
+        now = time.monotonic()
+        if self.fsync == 'always' or (self.fsync == 'interval' and now - self._last_fsync >= self.fsync_interval):
+            os.fsync(self.file.fileno())
+            self._last_fsync = now
+        return True
+
+    def append(self, queue_name: str, payload: str) -> bool:
+        with self.locked():
+            return self._append(queue_name, payload)
+
+    def append_if_pending(self, queue_name: str, payload: str) -> Optional[bool]:
+        """
+        spool 中还有未回放的消息时追加到末尾，返回是否写入成功；spool 为空时返回 None
+
+        此时直接写 Redis 会越过更早的消息，调用方应改走 spool 以保持顺序。
+        """
+        with self.locked():
+            if self.size <= self.offset:
+                return None
+            return self._append(queue_name, payload)
+
+    def read_batch(self, max_records: int) -> Tuple[List[Tuple[str, str]], int]:
+        """
+        从当前偏移读取最多 max_records 条，返回记录和读完后的偏移
+
+        调用方应在同一个 locked() 中完成读取、写回 Redis 和 commit，否则其他进程可能重复回放同一批。
+        """
+        records = []
+        if self.size <= self.offset:
+            return records, self.offset
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            end = self.offset
+            while len(records) < max_records and end < self.size:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                end += len(line)
+                try:
+                    queue_name, payload = json.loads(line)
+                    records.append((queue_name, payload))
+                except ValueError:
+                    logger.error("spool 中存在无法解析的记录，已跳过: %r", line[:200])
+        return records, end
+
+    def commit(self, offset: int):
+        """标记偏移之前的记录已写入 Redis；全部回放完成时清空文件"""
+        with self.locked():
+            self._save_offset(offset)
+            # 加锁时重新读取了文件大小，其他进程追加的记录不会被清掉
+            if offset >= self.size:
+                # 先归零偏移再截断：两步之间崩溃只会导致重复回放，不会丢失
+                self._save_offset(0)
+                os.truncate(self.path, 0)
+                self.size = 0
+
+    def close(self):
+        with self.lock:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+            if self.file is None:
+                return
+            if self.fsync != 'never':
+                os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+
+class SpoolDrainer:
+    """后台回放线程：Redis 可用时把 spool 按 pipeline 批量写回队列，清空后退出"""
+
+    def __init__(self, spool: Spool, redis_client: redis.Redis, batch_size: int = 500):
+        self.spool = spool
+        self.redis_client = redis_client
+        self.batch_size = batch_size
+        self.thread: Optional[threading.Thread] = None
+        self.replayed = 0
+        self._start_lock = threading.Lock()
+
+    def ensure_running(self):
+        with self._start_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='spool-drainer', daemon=True)
+                self.thread.start()
+
+    def drain_once(self) -> int:
+        """回放一批，返回写回的条数；整批在文件锁内完成，多个进程不会重复回放同一批"""
+        with self.spool.locked():
+            records, end = self.spool.read_batch(self.batch_size)
+            if records:
+                pipe = self.redis_client.pipeline(transaction=False)
+                # 相邻且同队列的记录合并为一次 LPUSH，参数顺序即入队顺序
+                start = 0
+                for i in range(1, len(records) + 1):
+                    if i == len(records) or records[i][0] != records[start][0]:
+                        pipe.lpush(records[start][0], *(payload for _, payload in records[start:i]))
+                        start = i
+                pipe.execute()
+            if end > self.spool.offset:
+                self.spool.commit(end)
+        self.replayed += len(records)
+        return len(records)
+
+    def _run(self):
+        delay = 1.0
+        logger.info("💾 spool 中有 %d 字节待回放，等待 Redis 可用...", self.spool.pending_bytes)
+        while self.spool.has_pending():
+            try:
+                if not self.drain_once():
+                    # 末尾记录尚未写完整，稍后再读
+                    time.sleep(0.05)
+                delay = 1.0
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+                logger.debug("回放暂停，Redis 仍不可用: %s", e)
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+        logger.info("✅ spool 回放完成，共写回 %d 条消息", self.replayed)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待回放完成，返回 spool 是否已清空"""
+        if self.thread is not None:
+            self.thread.join(timeout)
+        return not self.spool.has_pending()
+
+
+def main():
+    """手动回放 spool: python spool.py [spool 路径]"""
+    setup_logging()
+    path = sys.argv[1] if len(sys.argv) > 1 else Config.SPOOL_PATH
+    if not os.path.exists(path):
+        logger.info("spool 文件不存在: %s", path)
+        return 0
+    spool = Spool(path)
+    if not spool.has_pending():
+        logger.info("spool 为空，无需回放")
+        return 0
+    drainer = SpoolDrainer(spool, redis.Redis(**Config.redis_kwargs()))
+    try:
+        while drainer.drain_once():
+            pass
+    except redis.exceptions.ConnectionError as e:
+        logger.error("❌ 无法连接到 Redis，剩余 %d 字节保留在 spool 中: %s", spool.pending_bytes, e)
+        return 1
+    finally:
+        spool.close()
+    logger.info("✅ 已写回 %d 条消息", drainer.replayed)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
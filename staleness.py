@@ -0,0 +1,131 @@
+# staleness.py - 消息时效策略
+# 按事件类型配置最大消息年龄，过期消息在渲染/发送前直接分流到过期计数和日志。
+
+import time
+import logging
+from datetime import datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Optional, Dict, Any
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def parse_max_age(spec: str) -> Dict[str, float]:
+    """
+    解析最大年龄配置 (秒)
+
+    格式: "alpha_new_token=600;monitoring_alert=900;*=0"，0 表示永不过期
+    """
+    policy = {}
+    for part in spec.split(';'):
+        part = part.strip()
+        if not part:
+            continue
+        if '=' not in part:
+            raise ValueError(f"无效的 MESSAGE_MAX_AGE 配置项: {part}")
+        event_type, seconds = part.split('=', 1)
+        policy[event_type.strip()] = float(seconds)
+    return policy
+
+
+@lru_cache(maxsize=None)
+def parse_tz(spec: str) -> Optional[tzinfo]:
+    """解析 DETECTED_AT_TZ: "UTC"、"+08:00" 或 IANA 名称 (Asia/Shanghai)；留空返回 None (本机时区)"""
+    spec = spec.strip()
+    if not spec:
+        return None
+    if spec.upper() in ('UTC', 'Z'):
+        return timezone.utc
+    if spec[0] in '+-':
+        hours, _, minutes = spec[1:].partition(':')
+        offset = timedelta(hours=int(hours), minutes=int(minutes or 0))
+        return timezone(offset if spec[0] == '+' else -offset)
+    from zoneinfo import ZoneInfo
+    return ZoneInfo(spec)
+
+
+@lru_cache(maxsize=4096)
+def _parse_detected_at(value: str, tz_spec: str) -> Optional[float]:
+    """"%Y-%m-%d %H:%M:%S" 或 ISO 8601；自带时区偏移时按偏移，否则按 DETECTED_AT_TZ"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None and tz_spec:
+        parsed = parsed.replace(tzinfo=parse_tz(tz_spec))
+    return parsed.timestamp()
+
+
+def event_time(event: Dict[str, Any]) -> Optional[float]:
+    """
+    事件产生时间 (epoch 秒)
+
+    优先取 queue_timestamp (生产者写入的 epoch，与时区无关)；没有时才解析 detected_at。
+    detected_at 晚于当前时间说明时区或时钟有偏差，视为未知，不据此判断过期。
+    """
+    queue_ts = event.get('queue_timestamp')
+    if isinstance(queue_ts, (int, float)):
+        return float(queue_ts)
+    detected_at = event.get('detected_at')
+    if isinstance(detected_at, str) and detected_at:
+        parsed = _parse_detected_at(detected_at, Config.DETECTED_AT_TZ)
+        if parsed is not None and parsed <= time.time():
+            return parsed
+    return None
+
+
+class StalenessPolicy:
+    """按类型判断消息是否过期，并把过期消息记录到 Redis"""
+
+    def __init__(self, max_age: Dict[str, float], redis_client=None, queue_name: Optional[str] = None):
+        self.max_age = max_age
+        self.redis_client = redis_client
+        self.queue_name = queue_name or Config.QUEUE_NAME
+        self.expired_count = 0
+
+    @classmethod
+    def from_config(cls, redis_client=None) -> 'StalenessPolicy':
+        return cls(parse_max_age(Config.MESSAGE_MAX_AGE), redis_client=redis_client)
+
+    @property
+    def enabled(self) -> bool:
+        return any(v > 0 for v in self.max_age.values())
+
+    def max_age_for(self, event_type: Optional[str]) -> float:
+        return self.max_age.get(event_type, self.max_age.get('*', 0))
+
+    def is_expired(self, event: Dict[str, Any], now: Optional[float] = None) -> bool:
+        limit = self.max_age_for(event.get('type'))
+        if limit <= 0:
+            return False
+        created = event_time(event)
+        if created is None:
+            return False
+        return (now or time.time()) - created > limit
+
+    def record_expired(self, event: Dict[str, Any], raw: Optional[str] = None):
+        """过期计数 + 有界过期日志，一次 pipeline 往返"""
+        self.expired_count += 1
+        event_type = event.get('type', 'unknown')
+        created = event_time(event)
+        logger.info("⌛ 丢弃过期消息: type=%s age=%.0fs", event_type, time.time() - created if created else -1)
+        if self.redis_client is None:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hincrby(f"{self.queue_name}:expired:count", event_type, 1)
+            if Config.EXPIRED_LOG_MAX > 0 and raw is not None:
+                pipe.lpush(f"{self.queue_name}:expired", raw)
+                pipe.ltrim(f"{self.queue_name}:expired", 0, Config.EXPIRED_LOG_MAX - 1)
+            pipe.execute()
+        except Exception as e:
+            logger.warning("记录过期消息失败: %s", e)
+
+    def drop_if_expired(self, event: Dict[str, Any], raw: Optional[str] = None) -> bool:
+        """过期时记录并返回 True，调用方应直接跳过该消息"""
+        if self.is_expired(event):
+            self.record_expired(event, raw)
+            return True
+        return False
@@ -10,12 +10,10 @@ from producer_v2 import TweetProducer
 from consumer_v2 import TweetConsumer
 from twitter_client import TwitterClient
 from config import Config
+from log_setup import setup_logging
 
 # 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging(level='INFO')
 logger = logging.getLogger(__name__)
 
 def test_twitter_connection():
@@ -0,0 +1,106 @@
+# tweet_length.py - 推文加权长度计算与智能截断
+# 按 Twitter 的计数规则 (twitter-text v3) 在本地校验长度，避免超长推文被 API 以 BadRequest 拒绝、
+# 或未超长的推文被误截断：CJK 等字符计 2，任何链接计 23，一个 emoji 序列计 2。
+
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+
+from config import Config
+
+URL_LENGTH = 23
+ELLIPSIS = '…'
+
+# 计 1 的码位区间，其余计 2 (twitter-text v3 配置)
+_LIGHT_RANGES = ((0x0000, 0x10FF), (0x2000, 0x200D), (0x2010, 0x201F), (0x2032, 0x2037))
+
+# 链接在空白、CJK 字符和全角标点处结束
+_URL_STOP = r'\s\u3000-\u303F\u4E00-\u9FFF\uFF00-\uFFEF'
+# 链接末尾的标点不属于链接
+_URL_TAIL = rf'[^{_URL_STOP}]*[^{_URL_STOP}.,;:!?)\]]'
+_URL = (
+    rf'https?://{_URL_TAIL}'
+    # 不带协议的常见域名也会被 Twitter 自动识别为链接
+    rf'|\b(?:[a-zA-Z0-9-]+\.)+(?:com|org|net|io|xyz|app|co|ai|finance|info|me)\b(?:/(?:{_URL_TAIL})?)?'
+)
+_EMOJI_BASE = (r'[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\u2300-\u23FF\u2190-\u21FF'
+               r'\u2934\u2935\u25AA-\u25FE\u3030\u303D\u3297\u3299]')
+# 变体选择符 FE0F / 肤色修饰符
+_EMOJI_MOD = r'[\uFE0F\U0001F3FB-\U0001F3FF]?'
+_EMOJI = (
+    r'[\U0001F1E6-\U0001F1FF]{2}'                   # 国旗
+    r'|[0-9#*]\uFE0F?\u20E3'                    # 键帽
+    rf'|{_EMOJI_BASE}{_EMOJI_MOD}(?:\u200D{_EMOJI_BASE}{_EMOJI_MOD})*'   # ZWJ 组合序列
+)
+_TOKEN_RE = re.compile(rf'(?P<url>{_URL})|(?P<emoji>{_EMOJI})')
+
+
+def _char_weight(ch: str) -> int:
+    cp = ord(ch)
+    for low, high in _LIGHT_RANGES:
+        if low <= cp <= high:
+            return 1
+    return 2
+
+
+def _tokens(text: str) -> List[Tuple[str, int]]:
+    """切分为不可拆分的单元 (链接 / emoji 序列 / 单个字符) 及其权重"""
+    tokens = []
+    pos = 0
+    for match in _TOKEN_RE.finditer(text):
+        tokens.extend((ch, _char_weight(ch)) for ch in text[pos:match.start()])
+        tokens.append((match.group(), URL_LENGTH if match.lastgroup == 'url' else 2))
+        pos = match.end()
+    tokens.extend((ch, _char_weight(ch)) for ch in text[pos:])
+    return tokens
+
+
+@lru_cache(maxsize=4096)
+def weighted_length(text: str) -> int:
+    """推文加权长度 (Twitter 计数口径)"""
+    text = unicodedata.normalize('NFC', text)
+    if text.isascii() and '.' not in text:
+        return len(text)
+    return sum(weight for _, weight in _tokens(text))
+
+
+def fits(text: str, limit: Optional[int] = None) -> bool:
+    return weighted_length(text) <= (limit or Config.MAX_TWEET_LENGTH)
+
+
+def truncate(text: str, limit: Optional[int] = None) -> str:
+    """按加权长度截断并追加省略号，不会切断链接或 emoji"""
+    limit = limit or Config.MAX_TWEET_LENGTH
+    text = unicodedata.normalize('NFC', text)
+    if weighted_length(text) <= limit:
+        return text
+    budget = limit - _char_weight(ELLIPSIS)
+    parts = []
+    for token, weight in _tokens(text):
+        if weight > budget:
+            break
+        parts.append(token)
+        budget -= weight
+    return ''.join(parts).rstrip() + ELLIPSIS
+
+
+def render_template(template: str, data: Dict[str, Any], optional_fields: Optional[List[str]] = None,
+                    limit: Optional[int] = None) -> str:
+    """
+    渲染模板并保证不超长
+
+    超长时按 optional_fields 的顺序逐个删掉包含该字段的模板行，仍然超长才按加权长度截断。
+    """
+    limit = limit or Config.MAX_TWEET_LENGTH
+    content = template.format(**data)
+    if weighted_length(content) <= limit:
+        return content
+    lines = template.split('\n')
+    for field in optional_fields or []:
+        placeholder = '{' + field + '}'
+        lines = [line for line in lines if placeholder not in line]
+        content = '\n'.join(lines).format(**data)
+        if weighted_length(content) <= limit:
+            return content
+    return truncate(content, limit)
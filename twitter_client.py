@@ -4,28 +4,77 @@ import time
 import os
 import requests
 import urllib3
-from typing import Optional, Dict, Any
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from typing import Optional, Dict, Any, Iterator, Iterable, List
 from config import Config
+from log_setup import message_logger
+from tweet_length import weighted_length, truncate
+from cache import TTLCache
 
-# 配置日志
-logging.basicConfig(
-    level=getattr(logging, Config.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
+msg_logger = message_logger(__name__)
+
+TWITTER_API_HOST = 'https://api.twitter.com'
+SEARCH_TWEET_FIELDS = ('created_at', 'author_id', 'public_metrics')
+USER_FIELDS = ('description', 'public_metrics')
+# get_users 单次请求最多 100 个 ID / 用户名
+USERS_PER_REQUEST = 100
+
+
+class _ApiBaseAdapter(HTTPAdapter):
+    """把发往 api.twitter.com 的请求改写到 TWITTER_API_BASE_URL (用于本地假服务器/压测)"""
+    
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = base_url.rstrip('/')
+    
+    def send(self, request, **kwargs):
+        request.url = self.base_url + request.url[len(TWITTER_API_HOST):]
+        return super().send(request, **kwargs)
+
 
 class TwitterClient:
     """Twitter API 客户端类"""
     
-    def __init__(self):
-        """初始化Twitter客户端"""
+    CREDENTIAL_FIELDS = ('bearer_token', 'consumer_key', 'consumer_secret', 'access_token', 'access_token_secret')
+    
+    def __init__(self, credentials: Optional[Dict[str, str]] = None, name: str = 'default',
+                 retry_on_rate_limit: bool = True):
+        """
+        初始化Twitter客户端
+        
+        Args:
+            credentials: 账号凭据 (bearer_token/consumer_key/...)，为空时使用 Config 中的 TWITTER_* 配置
+            name: 账号名称，仅用于日志
+            retry_on_rate_limit: 为 False 时遇到速率限制直接抛出 tweepy.TooManyRequests，由调用方切换账号
+        """
+        self.name = name
+        self.retry_on_rate_limit = retry_on_rate_limit
+        self.user_id = None
+        self._api = None
+        # 相同查询在 TTL 内只请求一次 API
+        self.search_cache = TTLCache(Config.SEARCH_CACHE_TTL, Config.SEARCH_CACHE_SIZE)
+        # 用户信息按 ('id', id) 和 ('username', 小写用户名) 两个键缓存
+        self.user_cache = TTLCache(Config.USER_CACHE_TTL, Config.USER_CACHE_SIZE)
+        # 从每个响应头中记录的速率限制: 按接口的 15 分钟窗口，以及应用/用户的 24 小时发推额度
+        self.rate_limits: Dict[str, Dict[str, Any]] = {}
+        self.daily_quota: Optional[Dict[str, Any]] = None
+        self.last_rate_limited: float = 0.0
         try:
             # 验证配置
-            Config.validate()
+            if credentials is None:
+                Config.validate()
+                credentials = {field: getattr(Config, f"TWITTER_{field.upper()}") for field in self.CREDENTIAL_FIELDS}
+            else:
+                missing_fields = [field for field in self.CREDENTIAL_FIELDS if not credentials.get(field)]
+                if missing_fields:
+                    raise ValueError(f"账号 {name} 缺少必要的配置: {', '.join(missing_fields)}")
+            self.credentials = credentials
             
             # 配置全局代理（如果启用）
             if Config.USE_PROXY and Config.PROXY_URL:
-                logger.info(f"使用代理: {Config.PROXY_URL}")
+                logger.info("使用代理: %s", Config.PROXY_URL)
                 
                 # 设置全局代理环境变量
                 proxy_env_vars = {
@@ -49,16 +98,16 @@ class TwitterClient:
                     response = requests.get('https://httpbin.org/ip', proxies=proxies, timeout=10)
                     if response.status_code == 200:
                         ip_info = response.json()
-                        logger.info(f"代理测试成功，当前IP: {ip_info.get('origin', 'unknown')}")
+                        logger.info("代理测试成功，当前IP: %s", ip_info.get('origin', 'unknown'))
                     else:
-                        logger.warning(f"代理测试返回状态码: {response.status_code}")
+                        logger.warning("代理测试返回状态码: %s", response.status_code)
                 except requests.exceptions.ProxyError as e:
-                    logger.error(f"代理连接失败: {e}")
+                    logger.error("代理连接失败: %s", e)
                     raise Exception(f"无法连接到代理服务器 {Config.PROXY_URL}")
                 except requests.exceptions.Timeout as e:
-                    logger.warning(f"代理测试超时: {e}")
+                    logger.warning("代理测试超时: %s", e)
                 except Exception as e:
-                    logger.warning(f"代理测试失败: {e}")
+                    logger.warning("代理测试失败: %s", e)
                 
                 # 确保代理配置生效
                 logger.info("代理配置已应用，tweepy将通过环境变量使用代理")
@@ -71,12 +120,8 @@ class TwitterClient:
             
             # 创建 Twitter API v2 客户端
             client_kwargs = {
-                'bearer_token': Config.TWITTER_BEARER_TOKEN,
-                'consumer_key': Config.TWITTER_CONSUMER_KEY,
-                'consumer_secret': Config.TWITTER_CONSUMER_SECRET,
-                'access_token': Config.TWITTER_ACCESS_TOKEN,
-                'access_token_secret': Config.TWITTER_ACCESS_TOKEN_SECRET,
-                'wait_on_rate_limit': True  # 自动处理速率限制
+                **{field: credentials[field] for field in self.CREDENTIAL_FIELDS},
+                'wait_on_rate_limit': retry_on_rate_limit  # 自动处理速率限制
             }
             
             # 如果使用代理，添加代理配置
@@ -86,26 +131,79 @@ class TwitterClient:
                 pass
             
             self.client = tweepy.Client(**client_kwargs)
+            self.client.session.hooks['response'].append(self._capture_rate_limits)
+            if Config.TWITTER_API_BASE_URL:
+                logger.warning("Twitter API 请求将发往: %s", Config.TWITTER_API_BASE_URL)
+                self.client.session.mount(TWITTER_API_HOST, _ApiBaseAdapter(Config.TWITTER_API_BASE_URL))
             
             # 验证认证
             self._verify_credentials()
             logger.info("Twitter API 客户端初始化成功")
             
         except Exception as e:
-            logger.error(f"Twitter API 客户端初始化失败: {e}")
+            logger.error("Twitter API 客户端初始化失败: %s", e)
             raise
     
+    def _capture_rate_limits(self, response, *args, **kwargs):
+        """requests 响应钩子: 记录 x-rate-limit-* 与 x-app/user-limit-24hour-* 响应头"""
+        headers = response.headers
+        endpoint = f"{response.request.method} {urlparse(response.url).path}"
+        if 'x-rate-limit-remaining' in headers:
+            self.rate_limits[endpoint] = {
+                'limit': int(headers.get('x-rate-limit-limit', 0)),
+                'remaining': int(headers['x-rate-limit-remaining']),
+                'reset': int(headers.get('x-rate-limit-reset', 0)),
+            }
+        # 应用级和用户级 24 小时额度取更紧的一个
+        quotas = []
+        for scope in ('app', 'user'):
+            remaining = headers.get(f'x-{scope}-limit-24hour-remaining')
+            if remaining is not None:
+                quotas.append({
+                    'scope': scope,
+                    'limit': int(headers.get(f'x-{scope}-limit-24hour-limit', 0)),
+                    'remaining': int(remaining),
+                    'reset': int(headers.get(f'x-{scope}-limit-24hour-reset', 0)),
+                })
+        if quotas:
+            self.daily_quota = min(quotas, key=lambda q: q['remaining'])
+        if response.status_code == 429:
+            self.last_rate_limited = time.time()
+        return response
+    
+    def quota_snapshot(self, endpoint: str = 'POST /2/tweets') -> Dict[str, Any]:
+        """发推相关的最新额度信息 (尚未收到响应头时对应项为 None)"""
+        return {
+            'endpoint': self.rate_limits.get(endpoint),
+            'daily': self.daily_quota,
+            'last_rate_limited': self.last_rate_limited,
+        }
+    
+    @property
+    def api(self) -> tweepy.API:
+        """v1.1 API 客户端 (媒体上传只有 v1.1 接口)，首次使用时创建"""
+        if self._api is None:
+            auth = tweepy.OAuth1UserHandler(
+                self.credentials['consumer_key'], self.credentials['consumer_secret'],
+                self.credentials['access_token'], self.credentials['access_token_secret']
+            )
+            self._api = tweepy.API(auth)
+        return self._api
+    
     def _verify_credentials(self):
         """验证Twitter API凭据"""
         try:
-            user = self.client.get_me()
+            user = self.client.get_me(user_fields=list(USER_FIELDS))
             if user.data:
-                logger.info(f"已认证用户: @{user.data.username} ({user.data.name})")
+                self.user_id = str(user.data.id)
+                # 认证用户的信息顺便放入缓存，之后的状态查询不再消耗 API 调用
+                self._cache_user(self._user_dict(user.data))
+                logger.info("[%s] 已认证用户: @%s (%s)", self.name, user.data.username, user.data.name)
                 return True
             else:
                 raise Exception("无法获取用户信息")
         except Exception as e:
-            logger.error(f"Twitter API 凭据验证失败: {e}")
+            logger.error("Twitter API 凭据验证失败: %s", e)
             raise
     
     def send_tweet(self, content: str, **kwargs) -> Optional[Dict[str, Any]]:
@@ -120,21 +218,22 @@ class TwitterClient:
             发送成功的推文信息，失败时返回 None
         """
         try:
-            # 验证推文长度
-            if len(content) > Config.MAX_TWEET_LENGTH:
-                logger.warning(f"推文内容超过 {Config.MAX_TWEET_LENGTH} 字符限制，当前长度: {len(content)}")
-                content = content[:Config.MAX_TWEET_LENGTH-3] + "..."
-                logger.info(f"推文已截断为: {content}")
+            # 按 Twitter 加权长度在本地校验 (CJK 计 2、链接计 23)，避免超长请求被拒
+            length = weighted_length(content)
+            if length > Config.MAX_TWEET_LENGTH:
+                logger.warning("推文内容超过 %s 字符限制，当前加权长度: %s", Config.MAX_TWEET_LENGTH, length)
+                content = truncate(content, Config.MAX_TWEET_LENGTH)
+                logger.info("推文已截断为: %s", content)
             
             # 发送推文
-            logger.info(f"正在发送推文: {content[:50]}...")
+            msg_logger.debug("正在发送推文: %s...", content[:50])
             response = self.client.create_tweet(text=content, **kwargs)
             
             if response.data:
                 tweet_id = response.data['id']
                 tweet_url = f"https://twitter.com/user/status/{tweet_id}"
-                logger.info(f"推文发送成功! Tweet ID: {tweet_id}")
-                logger.info(f"推文链接: {tweet_url}")
+                msg_logger.debug("推文发送成功! Tweet ID: %s", tweet_id)
+                msg_logger.debug("推文链接: %s", tweet_url)
                 
                 return {
                     'success': True,
@@ -148,59 +247,158 @@ class TwitterClient:
                 return None
                 
         except tweepy.TooManyRequests as e:
-            logger.warning(f"达到速率限制，等待重试... {e}")
+            if not self.retry_on_rate_limit:
+                raise
+            logger.warning("达到速率限制，等待重试... %s", e)
             time.sleep(Config.RATE_LIMIT_BUFFER * 60)  # 等待几分钟后重试
             return self.send_tweet(content, **kwargs)
             
         except tweepy.Forbidden as e:
-            logger.error(f"权限被拒绝，可能是内容违规或账号限制: {e}")
+            logger.error("权限被拒绝，可能是内容违规或账号限制: %s", e)
             return None
             
         except tweepy.BadRequest as e:
-            logger.error(f"请求格式错误: {e}")
+            logger.error("请求格式错误: %s", e)
             return None
             
         except Exception as e:
-            logger.error(f"发送推文时发生未知错误: {e}")
+            logger.error("发送推文时发生未知错误: %s", e)
             return None
     
+    @staticmethod
+    def _user_dict(user) -> Dict[str, Any]:
+        metrics = getattr(user, 'public_metrics', None) or {}
+        return {
+            'id': user.id,
+            'username': user.username,
+            'name': user.name,
+            'description': getattr(user, 'description', '') or '',
+            'followers_count': metrics.get('followers_count', 0),
+            'following_count': metrics.get('following_count', 0),
+            'tweet_count': metrics.get('tweet_count', 0)
+        }
+    
+    def _cache_user(self, info: Dict[str, Any]):
+        self.user_cache.set(('id', str(info['id'])), info)
+        self.user_cache.set(('username', info['username'].lower()), info)
+    
+    def _fetch_users(self, field: str, values: List[str]):
+        """按 ID 或用户名分批请求 get_users，结果写入缓存"""
+        for start in range(0, len(values), USERS_PER_REQUEST):
+            chunk = values[start:start + USERS_PER_REQUEST]
+            response = self.client.get_users(**{field: chunk}, user_fields=list(USER_FIELDS))
+            for user in response.data or []:
+                self._cache_user(self._user_dict(user))
+            for error in response.errors or []:
+                logger.warning("用户查询失败: %s", error.get('detail', error))
+    
+    def get_users(self, user_ids: Iterable[Any] = (), usernames: Iterable[str] = ()) -> Dict[str, Dict[str, Any]]:
+        """
+        批量获取用户信息，缓存未命中的部分合并为 get_users 请求 (每次最多 100 个)
+        
+        Args:
+            user_ids: 用户ID列表
+            usernames: 用户名列表 (不包含@)
+            
+        Returns:
+            {用户ID或用户名: 用户信息}，用户名键与传入的写法一致；查不到的用户不在结果中
+        """
+        wanted = [('ids', 'id', str(user_id), str(user_id)) for user_id in user_ids]
+        wanted += [('usernames', 'username', name.lstrip('@').lower(), name) for name in usernames]
+        missing: Dict[str, List[str]] = {'ids': [], 'usernames': []}
+        for field, kind, key, _ in wanted:
+            if self.user_cache.get((kind, key)) is None and key not in missing[field]:
+                missing[field].append(key)
+        for field, values in missing.items():
+            if values:
+                try:
+                    self._fetch_users(field, values)
+                except Exception as e:
+                    logger.error("批量获取用户信息失败: %s", e)
+        
+        users = {}
+        for _, kind, key, original in wanted:
+            info = self.user_cache.get((kind, key))
+            if info is not None:
+                users[original] = info
+        return users
+    
     def get_user_info(self, username: Optional[str] = None, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
-        获取用户信息
+        获取用户信息 (带缓存)
         
         Args:
             username: 用户名 (不包含@)
-            user_id: 用户ID
+            user_id: 用户ID，两者都为空时返回当前认证用户
             
         Returns:
             用户信息字典，失败时返回 None
         """
-        try:
-            if username:
-                user = self.client.get_user(username=username)
-            elif user_id:
-                user = self.client.get_user(id=user_id)
-            else:
-                # 获取当前认证用户信息
-                user = self.client.get_me()
-            
-            if user.data:
-                return {
-                    'id': user.data.id,
-                    'username': user.data.username,
-                    'name': user.data.name,
-                    'description': getattr(user.data, 'description', ''),
-                    'followers_count': getattr(user.data, 'public_metrics', {}).get('followers_count', 0),
-                    'following_count': getattr(user.data, 'public_metrics', {}).get('following_count', 0),
-                    'tweet_count': getattr(user.data, 'public_metrics', {}).get('tweet_count', 0)
+        if username:
+            user = self.get_users(usernames=[username]).get(username)
+        else:
+            user = self.get_users(user_ids=[user_id or self.user_id]).get(str(user_id or self.user_id))
+        if user is None:
+            logger.error("无法获取用户信息")
+        return user
+    
+    def _search_page(self, query: str, page_size: int, next_token: Optional[str],
+                     tweet_fields: tuple) -> Dict[str, Any]:
+        """请求一页搜索结果，按 (查询, 页大小, next_token) 缓存"""
+        def load():
+            response = self.client.search_recent_tweets(
+                query=query,
+                max_results=page_size,
+                next_token=next_token,
+                tweet_fields=list(tweet_fields)
+            )
+            tweets = [
+                {
+                    'id': tweet.id,
+                    'text': tweet.text,
+                    'author_id': tweet.author_id,
+                    'created_at': tweet.created_at.isoformat() if tweet.created_at else None,
+                    'public_metrics': getattr(tweet, 'public_metrics', {})
                 }
-            else:
-                logger.error("无法获取用户信息")
-                return None
-                
-        except Exception as e:
-            logger.error(f"获取用户信息失败: {e}")
-            return None
+                for tweet in response.data or []
+            ]
+            return {'tweets': tweets, 'next_token': (response.meta or {}).get('next_token')}
+        
+        return self.search_cache.get_or_load((query, page_size, next_token, tweet_fields), load)
+    
+    def iter_search(self, query: str, max_results: Optional[int] = None, page_size: int = 100,
+                    tweet_fields: tuple = SEARCH_TWEET_FIELDS) -> Iterator[Dict[str, Any]]:
+        """
+        按需逐页搜索推文 (生成器)，只有消费到下一页时才发起请求
+        
+        Args:
+            query: 搜索查询
+            max_results: 最多返回的推文数，None 表示翻完所有页
+            page_size: 每页条数 (10-100)
+            
+        Yields:
+            推文字典
+        """
+        page_size = min(max(page_size, 10), 100)
+        if max_results is not None:
+            # 只要少量结果时不必拉满一页
+            page_size = min(page_size, max(max_results, 10))
+        yielded = 0
+        next_token = None
+        while True:
+            try:
+                page = self._search_page(query, page_size, next_token, tweet_fields)
+            except Exception as e:
+                logger.error("搜索推文失败: %s", e)
+                return
+            for tweet in page['tweets']:
+                if max_results is not None and yielded >= max_results:
+                    return
+                yield tweet
+                yielded += 1
+            next_token = page['next_token']
+            if not next_token or (max_results is not None and yielded >= max_results):
+                return
     
     def search_tweets(self, query: str, max_results: int = 10) -> list:
         """
@@ -208,36 +406,15 @@ class TwitterClient:
         
         Args:
             query: 搜索查询
-            max_results: 最大结果数 (1-100)
+            max_results: 最大结果数，超过 100 时自动翻页
             
         Returns:
             推文列表
         """
-        try:
-            tweets = self.client.search_recent_tweets(
-                query=query,
-                max_results=min(max_results, 100),
-                tweet_fields=['created_at', 'author_id', 'public_metrics']
-            )
-            
-            if tweets.data:
-                return [
-                    {
-                        'id': tweet.id,
-                        'text': tweet.text,
-                        'author_id': tweet.author_id,
-                        'created_at': tweet.created_at.isoformat() if tweet.created_at else None,
-                        'public_metrics': getattr(tweet, 'public_metrics', {})
-                    }
-                    for tweet in tweets.data
-                ]
-            else:
-                logger.info(f"未找到匹配查询 '{query}' 的推文")
-                return []
-                
-        except Exception as e:
-            logger.error(f"搜索推文失败: {e}")
-            return []
+        tweets = list(self.iter_search(query, max_results=max_results))
+        if not tweets:
+            logger.info("未找到匹配查询 '%s' 的推文", query)
+        return tweets
     
     def get_rate_limit_status(self) -> Dict[str, Any]:
         """